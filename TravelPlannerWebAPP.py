@@ -3,21 +3,43 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import streamlit as st
-import operator
-import sqlite3
+import altair as alt
+import pandas as pd
 import json
+import math
 import os
-import uuid
-from typing import List, Annotated, TypedDict
-from datetime import datetime, date, timedelta
-from langchain_core.messages import AnyMessage, AIMessage
-from langchain_core.tools import tool
-from langgraph.graph import StateGraph, END, START
-from langgraph.graph.message import add_messages
-from langgraph.types import Send
-from langgraph.checkpoint.sqlite import SqliteSaver
-from amadeus import Client, ResponseError
-
+import time
+from datetime import date, timedelta
+from itinerary_optimizer import rank_itineraries, rooms_needed
+from offer_table import FlightOfferTable
+from travel_planner_engine import (
+    CACHE_WARMER_ENABLED,
+    FLIGHT_LARGE_MAX_RESULTS,
+    FLIGHT_SEARCH_MODE,
+    HOTEL_SEARCH_MODE,
+    MAX_TRIP_LEGS,
+    RESULT_CACHE_BACKEND,
+    build_multi_city_inputs,
+    build_trip_inputs,
+    convert_city_to_airport_code,
+    convert_prices_to_currency,
+    get_airport_code_cache,
+    get_airport_index,
+    get_cache_warmer,
+    get_flight_result_cache,
+    get_fx_rate_table,
+    get_hotel_result_cache,
+    get_price_history,
+    get_request_coalescer,
+    get_search_job_queue,
+    get_tracer,
+    get_upstream_guard,
+    list_trip_stays,
+    resolve_location_code,
+    sort_hotels_by_price,
+    trip_price_trends
+)
+from search_jobs import FINISHED_STATUSES, SearchQueueFull
 
 # 2. Streamlit Page Configuration
 
@@ -30,621 +52,851 @@ st.set_page_config(
 st.title("✈️ AI Travel Planner")
 st.markdown("Plan your perfect trip with AI-powered flight and hotel search")
 
-# 3. AMADEUS API Setup
+# 3. Building The Streamlit Interface
 
-@st.cache_resource
-def initialize_amadeus_client():
-    try:
-        client = Client(
-            client_id=os.environ.get('AMADEUS_CLIENT_ID'),
-            client_secret=os.environ.get('AMADEUS_CLIENT_SECRET')
-        )
-        return client
-    except Exception:
-        return None
+MAX_HOTELS_SHOWN = 10
 
-amadeus_client = initialize_amadeus_client()
+# Idempotent: the first session of the server process starts the warmer thread.
+if CACHE_WARMER_ENABLED:
+    get_cache_warmer().start()
 
-# 4. Helping Functions
 
-def convert_city_to_airport_code(city_name):
-    if amadeus_client is None:
-        return city_name
+def render_price_matrix(price_matrix, currency):
+    priced_cells = [cell for cell in price_matrix if cell['total_price'] is not None]
     
-    try:
-        api_response = amadeus_client.reference_data.locations.get(
-            keyword=city_name, 
-            subType='CITY'
-        )
-        
-        if api_response.data:
-            airport_code = api_response.data[0]['iataCode']
-            return airport_code
-    except Exception:
-        pass
+    if not priced_cells:
+        st.warning("No prices found for the nearby dates. Please try different dates or cities.")
+        return
+    
+    matrix_frame = pd.DataFrame(price_matrix)
+    cell_position = {
+        "x": alt.X("outbound_date:O", title="Outbound date"),
+        "y": alt.Y("return_date:O", title="Return date")
+    }
+    
+    heatmap = alt.Chart(matrix_frame).mark_rect().encode(
+        color=alt.Color(
+            "total_price:Q",
+            title=f"Flights ({currency})",
+            scale=alt.Scale(scheme="redyellowgreen", reverse=True)
+        ),
+        tooltip=["outbound_date", "return_date", "outbound_price", "return_price", "total_price"],
+        **cell_position
+    )
+    price_labels = alt.Chart(matrix_frame).mark_text(fontSize=11).encode(
+        text=alt.Text("total_price:Q", format=".0f"),
+        **cell_position
+    )
     
-    return city_name
+    st.altair_chart(heatmap + price_labels, use_container_width=True)
+    
+    cheapest_cell = min(priced_cells, key=lambda cell: cell['total_price'])
+    st.success(
+        f"**Cheapest dates:** {cheapest_cell['outbound_date']} → {cheapest_cell['return_date']} "
+        f"for {cheapest_cell['total_price']:.2f} {currency} per traveler (outbound + return)"
+    )
+
 
+MAX_NEARBY_AIRPORTS_SHOWN = 4
+NEARBY_AIRPORT_RADIUS_KM = 150
 
-def convert_currency(amount, from_currency, to_currency):
-    """Convert currency using Frankfurter API (free, no API key needed)"""
-    if from_currency == to_currency:
-        return amount
+
+def location_input(label, field_key, default_name, placeholder):
+    """City or airport picker; typing filters the bundled index, anything else is accepted and resolved later"""
+    place_names = {place.name: place.label for place in get_airport_index().places}
+    if field_key not in st.session_state:
+        st.session_state[field_key] = default_name
     
-    try:
-        import requests
-        url = f"https://api.frankfurter.app/latest?amount={amount}&from={from_currency}&to={to_currency}"
-        response = requests.get(url, timeout=5)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if 'rates' in data and to_currency in data['rates']:
-                return float(data['rates'][to_currency])
-        
-        return amount
-    except Exception:
-        return amount
+    location_text = st.selectbox(
+        label,
+        list(place_names),
+        index=None,
+        key=field_key,
+        format_func=lambda place_name: place_names.get(place_name, place_name),
+        accept_new_options=True,
+        placeholder=placeholder
+    )
+    render_nearby_airports(field_key, location_text)
+    return location_text
 
 
-def check_if_dates_are_valid(arrival_date_string, return_date_string):
-    try:
-        today = datetime.now().date()
-        arrival_date = datetime.strptime(arrival_date_string, "%Y-%m-%d").date()
-        return_date = datetime.strptime(return_date_string, "%Y-%m-%d").date()
-        
-        if arrival_date < today:
-            error_message = "Arrival date cannot be in the past. Please select a future date."
-            return False, error_message
-        
-        if return_date < today:
-            error_message = "Return date cannot be in the past. Please select a future date."
-            return False, error_message
-        
-        if return_date <= arrival_date:
-            error_message = "Return date must be after arrival date."
-            return False, error_message
-        
-        return True, "Dates are valid"
-    except ValueError:
-        error_message = "Invalid date format. Please use YYYY-MM-DD format."
-        return False, error_message
+def pick_nearby_airport(field_key, picker_key):
+    picked_name = st.session_state.get(picker_key)
+    if picked_name:
+        st.session_state[field_key] = picked_name
+    st.session_state[picker_key] = None
 
 
-def convert_json_string_to_list(json_string):
-    try:
-        data = json.loads(json_string)
-        if isinstance(data, list):
-            return data
-        else:
-            return []
-    except Exception:
-        return []
-
-
-def replace_old_value_with_new(old_value, new_value):
-    return new_value
-
-# 5. Defining the State Schema
-
-class TravelAgentState(TypedDict):
-    messages: Annotated[List[AnyMessage], add_messages]
-    origin: Annotated[str, replace_old_value_with_new]
-    destination: Annotated[str, replace_old_value_with_new]
-    currency: Annotated[str, replace_old_value_with_new]
-    budget: Annotated[str, replace_old_value_with_new]
-    num_people: Annotated[str, replace_old_value_with_new]
-    arrival_date: Annotated[str, replace_old_value_with_new]
-    stay_duration: Annotated[str, replace_old_value_with_new]
-    return_date: Annotated[str, replace_old_value_with_new]
-    flight_options: Annotated[List[dict], operator.add]
-    hotel_options: Annotated[List[dict], operator.add]
-    date_error: Annotated[str, replace_old_value_with_new]
-
-# 6. Implementing The Core Tools
-
-@tool
-def search_flight(origin, destination, date, currency="USD"):
-    """Search for flights between two cities on a specific date"""
-    if amadeus_client is None:
-        empty_result = []
-        return json.dumps(empty_result)
+def render_nearby_airports(field_key, location_text):
+    place = get_airport_index().find(location_text) if location_text else None
+    if place is None:
+        return
     
-    try:
-        origin_airport_code = convert_city_to_airport_code(origin)
-        destination_airport_code = convert_city_to_airport_code(destination)
-        
-        api_response = amadeus_client.shopping.flight_offers_search.get(
-            originLocationCode=origin_airport_code,
-            destinationLocationCode=destination_airport_code,
-            departureDate=date,
-            adults=1,
-            currencyCode=currency,
-            max=3
-        )
-        
-        flight_results = []
-        
-        for flight in api_response.data[:3]:
-            flight_price = float(flight['price']['total'])
-            flight_currency = flight['price']['currency']
-
-            if flight_currency != currency:
-                flight_price = convert_currency(flight_price, flight_currency, currency)
-                flight_currency = currency
-            
-            flight_segments = flight['itineraries'][0]['segments']
-            airline_code = flight_segments[0]['carrierCode']
-            
-            departure_time_full = flight_segments[0]['departure']['at']
-            arrival_time_full = flight_segments[-1]['arrival']['at']
-            
-            if 'T' in departure_time_full:
-                departure_time = departure_time_full.split('T')[1][:5]
-            else:
-                departure_time = departure_time_full
-            
-            if 'T' in arrival_time_full:
-                arrival_time = arrival_time_full.split('T')[1][:5]
-            else:
-                arrival_time = arrival_time_full
-            
-            try:
-                date_object = datetime.strptime(date, "%Y-%m-%d")
-                formatted_date = date_object.strftime("%y%m%d")
-            except:
-                formatted_date = date.replace("-", "")[2:]
-            
-            skyscanner_url = (
-                f"https://www.skyscanner.com/transport/flights/"
-                f"{origin_airport_code.lower()}/{destination_airport_code.lower()}/{formatted_date}/"
-                f"?adults=1&cabinclass=economy&rtn=0"
-            )
-            
-            flight_info = {
-                "type": "flight",
-                "airline": airline_code,
-                "route": f"{origin_airport_code} -> {destination_airport_code}",
-                "origin_code": origin_airport_code,
-                "destination_code": destination_airport_code,
-                "price": flight_price,
-                "currency": flight_currency,
-                "departure": departure_time,
-                "arrival": arrival_time,
-                "date": date,
-                "link": skyscanner_url
-            }
-            
-            flight_results.append(flight_info)
-        
-        return json.dumps(flight_results)
-    
-    except ResponseError:
-        empty_result = []
-        return json.dumps(empty_result)
-    except Exception:
-        empty_result = []
-        return json.dumps(empty_result)
-
-@tool
-def search_hotel(location, checkin_date, checkout_date, currency="USD"):
-    """Search for hotels in a city for specific dates"""
-    if amadeus_client is None:
-        empty_result = []
-        return json.dumps(empty_result)
+    nearby_airports = get_airport_index().nearby_airports(
+        place.code, radius_km=NEARBY_AIRPORT_RADIUS_KM, limit=MAX_NEARBY_AIRPORTS_SHOWN
+    )
+    if not nearby_airports:
+        return
     
-    try:
-        city_airport_code = convert_city_to_airport_code(location)
-        
-        hotels_api_response = amadeus_client.reference_data.locations.hotels.by_city.get(
-            cityCode=city_airport_code
-        )
-        
-        if not hotels_api_response.data:
-            location_url_encoded = location.replace(' ', '+')
-            fallback_url = f"https://www.booking.com/searchresults.html?ss={location_url_encoded}&checkin={checkin_date}&checkout={checkout_date}&selected_currency={currency}"
-            
-            fallback_hotel = {
-                "type": "hotel",
-                "name": f"Hotels in {location}",
-                "price": None,
-                "currency": currency,
-                "rating": 0,
-                "rating_word": "",
-                "stars": 0,
-                "address": location,
-                "distance_to_center": "Various",
-                "link": fallback_url
-            }
-            
-            return json.dumps([fallback_hotel])
-        
-        hotel_results = []
-        hotel_id_list = []
-        
-        for hotel in hotels_api_response.data[:5]:
-            hotel_id = hotel['hotelId']
-            hotel_id_list.append(hotel_id)
-        
-        hotel_ids_joined = ','.join(hotel_id_list)
-        
-        try:
-            offers_api_response = amadeus_client.shopping.hotel_offers_search.get(
-                hotelIds=hotel_ids_joined,
-                checkInDate=checkin_date,
-                checkOutDate=checkout_date,
-                adults=1,
-                currency=currency
-            )
-            
-            for hotel_offer in offers_api_response.data:
-                hotel_name = hotel_offer['hotel']['name']
-                hotel_id = hotel_offer['hotel']['hotelId']
-                
-                hotel_price = None
-                hotel_currency = currency
-                
-                if hotel_offer.get('offers') and len(hotel_offer['offers']) > 0:
-                    hotel_price = float(hotel_offer['offers'][0]['price']['total'])
-                    api_currency = hotel_offer['offers'][0]['price']['currency']
-                    
-                    if api_currency != currency:
-                        hotel_price = convert_currency(hotel_price, api_currency, currency)
-                    
-                    hotel_currency = currency
-                
-                hotel_name_url_encoded = hotel_name.replace(" ", "+")
-                location_url_encoded = location.replace(' ', '+')
-                booking_url = f"https://www.booking.com/searchresults.html?ss={hotel_name_url_encoded}+{location_url_encoded}&checkin={checkin_date}&checkout={checkout_date}&selected_currency={currency}"
-                
-                hotel_info = {
-                    "type": "hotel",
-                    "name": hotel_name,
-                    "price": hotel_price,
-                    "currency": hotel_currency,
-                    "rating": 0,
-                    "rating_word": "",
-                    "stars": 0,
-                    "address": location,
-                    "distance_to_center": "N/A",
-                    "link": booking_url
-                }
-                
-                hotel_results.append(hotel_info)
-        
-        except ResponseError:
-            for hotel in hotels_api_response.data[:5]:
-                hotel_name = hotel.get('name', 'Unknown Hotel')
-                hotel_name_url_encoded = hotel_name.replace(" ", "+")
-                location_url_encoded = location.replace(' ', '+')
-                booking_url = f"https://www.booking.com/searchresults.html?ss={hotel_name_url_encoded}+{location_url_encoded}&checkin={checkin_date}&checkout={checkout_date}&selected_currency={currency}"
-                
-                hotel_info = {
-                    "type": "hotel",
-                    "name": hotel_name,
-                    "price": None,
-                    "currency": currency,
-                    "rating": 0,
-                    "rating_word": "",
-                    "stars": 0,
-                    "address": location,
-                    "distance_to_center": "N/A",
-                    "link": booking_url
-                }
-                
-                hotel_results.append(hotel_info)
-        
-        return json.dumps(hotel_results)
+    nearby_labels = {airport.name: f"{airport.code} · {airport.city} ({distance_km} km)" for airport, distance_km in nearby_airports}
+    picker_key = f"{field_key}_nearby"
+    st.pills(
+        "Nearby airports",
+        list(nearby_labels),
+        format_func=nearby_labels.get,
+        key=picker_key,
+        on_change=pick_nearby_airport,
+        args=(field_key, picker_key)
+    )
+
+
+def describe_unknown_location(location_text):
+    suggestions = get_airport_index().suggest(location_text, limit=3)
+    did_you_mean = f" Did you mean {', '.join(place.name for place in suggestions)}?" if suggestions else ""
+    return f"No airport found for **{location_text}**.{did_you_mean}"
+
+
+def render_leg_editor(origin, destination, arrival_date, return_date):
+    """Editable table of legs seeded with the round trip; returns the complete rows as legs"""
+    seed_legs = pd.DataFrame([
+        {"origin": origin, "destination": destination, "date": arrival_date},
+        {"origin": destination, "destination": origin, "date": return_date},
+    ])
+    edited_legs = st.data_editor(
+        seed_legs,
+        key="multi_city_legs",
+        num_rows="dynamic",
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "origin": st.column_config.TextColumn("From", required=True),
+            "destination": st.column_config.TextColumn("To", required=True),
+            "date": st.column_config.DateColumn("Departure", min_value=date.today(), required=True),
+        }
+    )
+    return [
+        {"origin": leg["origin"], "destination": leg["destination"], "date": pd.Timestamp(leg["date"]).strftime("%Y-%m-%d")}
+        for leg in edited_legs.to_dict("records")
+        if leg.get("origin") and leg.get("destination") and pd.notna(leg.get("date"))
+    ]
+
+
+st.markdown("---")
+
+col1, col2 = st.columns(2)
+
+with col1:
+    origin = location_input("Origin City", "origin", "New York", "e.g., Mumbai, New York, London")
+    arrival_date = st.date_input("Arrival Date", value=date.today(), min_value=date.today())
+    currency = st.selectbox("Currency", ["USD", "EUR", "GBP", "INR", "JPY"], index=0)
+
+with col2:
+    destination = location_input("Destination City", "destination", "Paris", "e.g., Paris, Delhi, Tokyo")
+    return_date = st.date_input("Return Date", value=date.today() + timedelta(days=7), min_value=date.today())
+    budget = st.number_input("Budget", value=2000, min_value=100, step=100)
+
+num_people = st.number_input("Number of Travelers", value=1, min_value=1, max_value=10)
+
+flexible_dates = st.checkbox("Flexible dates (compare flight prices for nearby days)")
+flex_days = 0
+if flexible_dates:
+    flex_days = st.slider("Days either side", min_value=1, max_value=3, value=2)
+
+full_city_hotels = st.checkbox(
+    "Search every hotel in the city (slower, more results)",
+    value=HOTEL_SEARCH_MODE == "full_city"
+)
+
+large_flight_results = st.checkbox(
+    f"More flight results (up to {FLIGHT_LARGE_MAX_RESULTS} per leg, with filters and sorting)",
+    value=FLIGHT_SEARCH_MODE == "large"
+)
+
+multi_city = st.checkbox(f"Multi-city trip (up to {MAX_TRIP_LEGS} legs, a hotel at every stop)")
+trip_legs = []
+if multi_city:
+    trip_legs = render_leg_editor(origin, destination, arrival_date, return_date)
+
+st.markdown("---")
+
+
+def render_trip_header(origin, destination, arrival_date_str, return_date_str, num_nights, budget, currency, num_people):
+    st.markdown(f"## Your Trip Plan: {origin} ↔ {destination}")
+    st.markdown(f"**Dates:** {arrival_date_str} to {return_date_str} ({num_nights} nights)")
+    st.markdown(f"**Budget:** {budget:.2f} {currency}")
+    st.markdown(f"**Travelers:** {num_people}")
     
-    except ResponseError:
-        empty_result = []
-        return json.dumps(empty_result)
-    except Exception:
-        empty_result = []
-        return json.dumps(empty_result)
+    st.markdown("---")
+
+
+def describe_stops(stops):
+    if not stops:
+        return "Non-stop"
+    return f"{stops} stop" if stops == 1 else f"{stops} stops"
+
 
-# 7. Making The Travel Specialist Sub-Graph
+def render_flight_list(flights):
+    for flight in flights:
+        with st.container():
+            col1, col2, col3 = st.columns([2, 2, 1])
+            with col1:
+                st.markdown(f"**{flight.airline}** - {flight.route}")
+                st.markdown(f"Departs: {flight.departure} | Arrives: {flight.arrival} | {describe_stops(flight.stops)}")
+            with col2:
+                st.markdown(f"**Price:** {flight.price:.2f} {flight.currency}")
+            with col3:
+                st.link_button("Book", flight.link, use_container_width=True)
+        st.markdown("")
 
-def travel_agent_node(state):
-    user_currency = state.get('currency', 'USD')
+
+FLIGHTS_PER_PAGE = 10
+FLIGHT_SORT_LABELS = {"price": "Price", "departure": "Departure time", "arrival": "Arrival time", "stops": "Stops", "airline": "Airline"}
+FLIGHT_STOP_CHOICES = {None: "Any number of stops", 0: "Non-stop only", 1: "Up to 1 stop", 2: "Up to 2 stops"}
+
+
+def render_flight_table(flights, table_key):
+    """Filter, sort and page through one direction's flights; only the current page is drawn"""
+    if len(flights) <= FLIGHTS_PER_PAGE:
+        render_flight_list(flights)
+        return
     
-    outbound_flight_result = search_flight.invoke({
-        "origin": state['origin'],
-        "destination": state['destination'],
-        "date": state['arrival_date'],
-        "currency": user_currency
-    })
+    flight_table = FlightOfferTable(flights)
+    with st.expander(f"Filter and sort {len(flights)} flights"):
+        col1, col2 = st.columns(2)
+        with col1:
+            sort_key = st.selectbox("Sort by", list(FLIGHT_SORT_LABELS), format_func=FLIGHT_SORT_LABELS.get, key=f"{table_key}_sort")
+        with col2:
+            max_stops = st.selectbox("Stops", list(FLIGHT_STOP_CHOICES), format_func=FLIGHT_STOP_CHOICES.get, key=f"{table_key}_stops")
+        airline_names = flight_table.airlines()
+        # Keyed by the choices too, so a new search with other airlines or prices starts unfiltered.
+        airlines = st.multiselect("Airlines", airline_names, key=f"{table_key}_airlines_{'_'.join(airline_names)}")
+        max_price = None
+        price_range = flight_table.price_range()
+        if price_range and price_range[1] > price_range[0]:
+            cheapest_price, dearest_price = math.floor(price_range[0]), math.ceil(price_range[1])
+            max_price = st.slider(
+                "Maximum price", min_value=cheapest_price, max_value=dearest_price, value=dearest_price,
+                key=f"{table_key}_max_price_{cheapest_price}_{dearest_price}"
+            )
+        departure_hours = st.slider("Departing between (hour)", min_value=0, max_value=24, value=(0, 24), key=f"{table_key}_departure")
     
-    return_flight_result = search_flight.invoke({
-        "origin": state['destination'],
-        "destination": state['origin'],
-        "date": state['return_date'],
-        "currency": user_currency
-    })
+    visible_flights = flight_table.filter(
+        max_price=max_price, max_stops=max_stops, airlines=airlines, departure_hours=departure_hours
+    ).sort(sort_key)
+    if not len(visible_flights):
+        st.warning("No flights match these filters.")
+        return
     
-    outbound_flights = convert_json_string_to_list(outbound_flight_result)
-    return_flights = convert_json_string_to_list(return_flight_result)
+    page_count = visible_flights.page_count(FLIGHTS_PER_PAGE)
+    page_key = f"{table_key}_page"
+    # Filtering can leave fewer pages than the one being shown.
+    if st.session_state.get(page_key, 1) > page_count:
+        st.session_state[page_key] = page_count
+    page_number = 1
+    if page_count > 1:
+        page_number = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, step=1, key=page_key)
     
-    all_flights = outbound_flights + return_flights
+    first_shown = (page_number - 1) * FLIGHTS_PER_PAGE
+    last_shown = min(first_shown + FLIGHTS_PER_PAGE, len(visible_flights))
+    st.caption(f"Showing {first_shown + 1}–{last_shown} of {len(visible_flights)} matching flights ({len(flights)} found)")
+    render_flight_list(visible_flights.page(page_number - 1, FLIGHTS_PER_PAGE))
+
+
+def split_flights_by_direction(flights, origin):
+    origin_code = convert_city_to_airport_code(origin)
     
-    return {"flight_options": all_flights}
+    outbound_flights = []
+    return_flights = []
+    
+    for flight in flights:
+        if flight.origin_code == origin_code:
+            outbound_flights.append(flight)
+        else:
+            return_flights.append(flight)
+    
+    return outbound_flights, return_flights
 
 
-travel_graph_builder = StateGraph(TravelAgentState)
-travel_graph_builder.add_node("travel_agent", travel_agent_node)
-travel_graph_builder.add_edge(START, "travel_agent")
-travel_graph_builder.add_edge("travel_agent", END)
-travel_graph = travel_graph_builder.compile()
+def render_flight_options(flights, origin, destination, currency):
+    st.markdown("### ✈️ Flight Options")
+    
+    if not flights:
+        st.warning("No flights found. Please try different dates or cities.")
+        st.markdown("---")
+        return
+    
+    outbound_flights, return_flights = split_flights_by_direction(flights, origin)
+    
+    if outbound_flights:
+        st.markdown("#### Outbound Flights")
+        render_flight_table(outbound_flights, "outbound_flights")
+    
+    if return_flights:
+        st.markdown("#### Return Flights")
+        render_flight_table(return_flights, "return_flights")
+    
+    if outbound_flights and return_flights:
+        cheapest_out = min(outbound_flights, key=lambda x: x.price)
+        cheapest_ret = min(return_flights, key=lambda x: x.price)
+        total_flight = cheapest_out.price + cheapest_ret.price
+        st.info(f"**Best Flight Deal:** {total_flight:.2f} {currency} per person (outbound + return)")
+    
+    st.markdown("---")
 
-# 8. Making The Accommodation Specialist Sub-Graph
 
-def hotel_agent_node(state):
-    user_currency = state.get('currency', 'USD')
+def render_hotel_options(hotels, num_nights, still_searching=False):
+    st.markdown("### 🏨 Hotel Options")
     
-    hotel_search_result = search_hotel.invoke({
-        "location": state['destination'],
-        "checkin_date": state['arrival_date'],
-        "checkout_date": state['return_date'],
-        "currency": user_currency
-    })
+    if not hotels:
+        if not still_searching:
+            st.warning("No hotels found. Please try a different destination.")
+        return
     
-    hotels = convert_json_string_to_list(hotel_search_result)
+    if still_searching:
+        st.caption(f"{len(hotels)} hotels so far, still searching...")
+    elif len(hotels) > MAX_HOTELS_SHOWN:
+        st.caption(f"Showing the {MAX_HOTELS_SHOWN} cheapest of {len(hotels)} hotels")
     
-    return {"hotel_options": hotels}
+    for hotel in hotels[:MAX_HOTELS_SHOWN]:
+        with st.container():
+            col1, col2, col3 = st.columns([2, 2, 1])
+            with col1:
+                st.markdown(f"**{hotel.name}**")
+                st.markdown(f"Location: {hotel.distance_to_center} from center")
+            with col2:
+                if hotel.price:
+                    total_hotel = hotel.price * num_nights
+                    st.markdown(f"**Price:** {hotel.price:.2f} {hotel.currency}/night")
+                    st.markdown(f"Total: {total_hotel:.2f} {hotel.currency} ({num_nights} nights)")
+                else:
+                    st.markdown("**Price:** See website")
+            with col3:
+                st.link_button("Book", hotel.link, use_container_width=True)
+        st.markdown("")
 
 
-hotel_graph_builder = StateGraph(TravelAgentState)
-hotel_graph_builder.add_node("hotel_agent", hotel_agent_node)
-hotel_graph_builder.add_edge(START, "hotel_agent")
-hotel_graph_builder.add_edge("hotel_agent", END)
-hotel_graph = hotel_graph_builder.compile()
+ITINERARY_TOP_K = int(os.environ.get("ITINERARY_TOP_K", "5"))
 
-# 9. Building The Main Graph Nodes
 
-def intake_node(state):
-    return {
-        "flight_options": [],
-        "hotel_options": []
-    }
+def render_itinerary_table(itineraries, currency):
+    st.dataframe(
+        pd.DataFrame([
+            {
+                "Outbound": f"{itinerary.outbound.airline} {itinerary.outbound.departure}",
+                "Return": f"{itinerary.return_flight.airline} {itinerary.return_flight.departure}",
+                "Hotel": itinerary.hotel.name,
+                f"Flights ({currency})": round(itinerary.flight_cost, 2),
+                f"Hotel ({currency})": round(itinerary.hotel_cost, 2),
+                f"Total ({currency})": round(itinerary.total_cost, 2),
+            }
+            for itinerary in itineraries
+        ]),
+        hide_index=True,
+        use_container_width=True
+    )
+
+
+def render_budget_analysis(flights, hotels, origin, num_people, num_nights, budget, currency):
+    """Budget panel for the whole party from whatever has arrived so far; missing parts show as pending"""
+    outbound_flights, return_flights = split_flights_by_direction(flights or [], origin)
+    has_hotel_prices = any(hotel.price for hotel in hotels)
+    
+    itineraries = []
+    within_budget = False
+    flight_cost = None
+    hotel_cost = None
+    
+    if outbound_flights and return_flights:
+        itineraries = rank_itineraries(
+            outbound_flights, return_flights, hotels, num_people, num_nights, budget=budget, top_k=ITINERARY_TOP_K
+        )
+        within_budget = bool(itineraries)
+        if not itineraries:
+            itineraries = rank_itineraries(outbound_flights, return_flights, hotels, num_people, num_nights, top_k=1)
+        flight_cost = itineraries[0].flight_cost
+        if itineraries[0].hotel is not None:
+            hotel_cost = itineraries[0].hotel_cost
+    elif has_hotel_prices:
+        cheapest_hotel_price = min(hotel.price for hotel in hotels if hotel.price)
+        hotel_cost = cheapest_hotel_price * num_nights * rooms_needed(num_people)
+    
+    if flight_cost is None and hotel_cost is None:
+        return
+    
+    st.markdown("#### Budget Analysis")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric(f"Flights (party of {num_people})", f"{flight_cost:.2f} {currency}" if flight_cost is not None else "…")
+    with col2:
+        st.metric(f"Hotel ({num_nights} nights)", f"{hotel_cost:.2f} {currency}" if hotel_cost is not None else "…")
+    with col3:
+        if flight_cost is None or hotel_cost is None:
+            st.metric("Total", "…")
+        elif within_budget:
+            st.metric("Total", f"{itineraries[0].total_cost:.2f} {currency}", f"✓ Within budget")
+        else:
+            total_cost = itineraries[0].total_cost
+            st.metric("Total", f"{total_cost:.2f} {currency}", f"Over by {total_cost - budget:.2f}")
+    
+    if within_budget and hotel_cost is not None:
+        st.markdown(f"**Top {len(itineraries)} itineraries within budget**")
+        render_itinerary_table(itineraries, currency)
+    
+    st.markdown("---")
 
 
-def planner_node(state):
-    dates_are_valid, validation_message = check_if_dates_are_valid(
-        state['arrival_date'], 
-        state['return_date']
+MAX_OPTIONS_PER_LEG_SHOWN = 3
+
+
+def render_trip_leg(leg_number, leg, flights, stay, hotels):
+    """One leg of a multi-city trip and the stay at the stop it ends at; None means still searching"""
+    st.markdown(f"#### Leg {leg_number}: {leg['origin']} → {leg['destination']} ({leg['date']})")
+    if flights is None:
+        st.info("Searching for flights...")
+    elif not flights:
+        st.warning("No flights found for this leg.")
+    else:
+        render_flight_list(sorted(flights, key=lambda flight: flight.price)[:MAX_OPTIONS_PER_LEG_SHOWN])
+    
+    if stay is None:
+        return
+    
+    _, city, checkin_date, checkout_date = stay
+    num_nights = (date.fromisoformat(checkout_date) - date.fromisoformat(checkin_date)).days
+    st.markdown(f"**🏨 Stay in {city}:** {checkin_date} to {checkout_date} ({num_nights} nights)")
+    if hotels is None:
+        st.info("Searching for hotels...")
+        return
+    
+    priced_hotels = [hotel for hotel in sort_hotels_by_price(hotels) if hotel.price]
+    if not priced_hotels:
+        st.warning("No hotel prices found for this stop.")
+    for hotel in priced_hotels[:MAX_OPTIONS_PER_LEG_SHOWN]:
+        st.markdown(f"- [{hotel.name}]({hotel.link}): {hotel.price:.2f} {hotel.currency}/night")
+
+
+def render_multi_city_summary(itinerary, num_people, budget, currency):
+    flight_cost = sum(leg["cheapest_flight"].price for leg in itinerary if leg["cheapest_flight"]) * num_people
+    hotel_cost = sum(
+        leg["stay"]["cheapest_hotel"].price * leg["stay"]["nights"] * rooms_needed(num_people)
+        for leg in itinerary
+        if leg.get("stay") and leg["stay"]["cheapest_hotel"]
     )
+    total_cost = flight_cost + hotel_cost
     
-    if not dates_are_valid:
-        return {"date_error": validation_message}
+    st.markdown("#### Budget Analysis")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric(f"Flights ({len(itinerary)} legs, party of {num_people})", f"{flight_cost:.2f} {currency}")
+    with col2:
+        st.metric("Hotels (all stops)", f"{hotel_cost:.2f} {currency}")
+    with col3:
+        if total_cost <= budget:
+            st.metric("Total", f"{total_cost:.2f} {currency}", "✓ Within budget")
+        else:
+            st.metric("Total", f"{total_cost:.2f} {currency}", f"Over by {total_cost - budget:.2f}")
     
-    return {}
+    legs_without_flights = [str(leg_number) for leg_number, leg in enumerate(itinerary, start=1) if not leg["cheapest_flight"]]
+    if legs_without_flights:
+        st.warning(f"No flights found for leg {', '.join(legs_without_flights)}; the total leaves them out.")
 
 
-def decide_next_step_after_planning(state):
-    if state.get('date_error'):
-        return "present_plan"
-    return "specialists"
+def render_price_trends(origin, destination, arrival_date_str, return_date_str, currency, hotel_search_mode, flight_search_mode):
+    """Cheapest price per past fetch of this trip, straight from the local price history"""
+    trend_points = trip_price_trends(
+        origin, destination, arrival_date_str, return_date_str, currency, hotel_search_mode, flight_search_mode
+    )
+    with st.expander("📈 Price history for this trip"):
+        series_names = [trend_point["series"] for trend_point in trend_points]
+        if not any(series_names.count(series_name) > 1 for series_name in set(series_names)):
+            st.caption("Prices are recorded on every search. Check this trip again later to see how they move.")
+            return
+        
+        trend_frame = pd.DataFrame(trend_points)
+        trend_frame["fetched_at"] = pd.to_datetime(trend_frame["fetched_at"], unit="s")
+        trend_chart = alt.Chart(trend_frame).mark_line(point=True).encode(
+            x=alt.X("fetched_at:T", title="Checked at"),
+            y=alt.Y("cheapest_price:Q", title=f"Cheapest price ({currency})"),
+            color=alt.Color("series:N", title=None),
+            tooltip=["series", "fetched_at", "cheapest_price", "offers"]
+        )
+        st.altair_chart(trend_chart, use_container_width=True)
 
 
-def route_to_both_agents(state):
-    return [
-        Send("travel_agent", state),
-        Send("accommodation_agent", state)
-    ]
+# Offers of the last few searches, keyed by what was searched. Currency,
+# budget and party size are applied at render time, so changing them only
+# re-prices these locally; a new route or new dates needs a new search.
+MAX_CACHED_SEARCHES = 5
 
 
-def present_plan_node(state):
-    if state.get('date_error'):
-        error_message = state.get('date_error')
-        error_text = f"**Error:** {error_message}"
-        return {"messages": [AIMessage(content=error_text)]}
-    
-    return {"messages": [AIMessage(content="Success")]}
+def trip_search_key(origin, destination, arrival_date_str, return_date_str, hotel_search_mode, flight_search_mode):
+    return (origin, destination, arrival_date_str, return_date_str, hotel_search_mode, flight_search_mode)
+
+
+def remember_trip_results(search_key, flights, hotels, currency):
+    cached_searches = st.session_state.setdefault("trip_results", {})
+    cached_searches.pop(search_key, None)
+    cached_searches[search_key] = {"flights": flights, "hotels": hotels, "currency": currency}
+    while len(cached_searches) > MAX_CACHED_SEARCHES:
+        del cached_searches[next(iter(cached_searches))]
 
-# 10. Building The Main Graph
 
-@st.cache_resource
-def build_workflow():
-    database_connection = sqlite3.connect("travel_planner_streamlit.db", check_same_thread=False)
-    memory_saver = SqliteSaver(conn=database_connection)
+def render_cached_trip_results(search_key, currency, budget, num_people):
+    """Show a previous search for the current inputs without calling upstream; False if there is none"""
+    trip_results = st.session_state.get("trip_results", {}).get(search_key)
+    if trip_results is None:
+        return False
     
-    workflow_builder = StateGraph(TravelAgentState)
+    origin, destination, arrival_date_str, return_date_str, hotel_search_mode, flight_search_mode = search_key
+    num_nights = (date.fromisoformat(return_date_str) - date.fromisoformat(arrival_date_str)).days
+    flights = convert_prices_to_currency(trip_results["flights"], currency)
+    hotels = sort_hotels_by_price(convert_prices_to_currency(trip_results["hotels"], currency))
     
-    workflow_builder.add_node("intake", intake_node)
-    workflow_builder.add_node("planner", planner_node)
-    workflow_builder.add_node("specialists", lambda state: {})
-    workflow_builder.add_node("present_plan", present_plan_node)
-    workflow_builder.add_node("travel_agent", travel_graph)
-    workflow_builder.add_node("accommodation_agent", hotel_graph)
+    render_trip_header(origin, destination, arrival_date_str, return_date_str, num_nights, budget, currency, num_people)
+    render_flight_options(flights, origin, destination, currency)
+    render_hotel_options(hotels, num_nights)
+    render_budget_analysis(flights, hotels, origin, num_people, num_nights, budget, currency)
+    st.caption("Prices from your last search for this trip, converted locally. Search again for fresh prices.")
+    render_price_trends(origin, destination, arrival_date_str, return_date_str, trip_results["currency"], hotel_search_mode, flight_search_mode)
+    return True
+
+
+# Searches run as background jobs (search_jobs.py). The session keeps only
+# the job id; the page redraws from the events the job has stored so far
+# and polls while it runs, so no script run waits on upstream calls.
+SEARCH_JOB_POLL_SECONDS = float(os.environ.get("SEARCH_JOB_POLL_SECONDS", "0.5"))
+
+
+def multi_city_search_key(trip_legs, hotel_search_mode, flight_search_mode):
+    return ("multi_city", tuple((leg["origin"], leg["destination"], leg["date"]) for leg in trip_legs), hotel_search_mode, flight_search_mode)
+
+
+def flexible_dates_search_key(origin, destination, arrival_date_str, return_date_str, flex_days):
+    return ("flexible_dates", origin, destination, arrival_date_str, return_date_str, flex_days)
+
+
+def submit_search_job(user_inputs, search_key, trip_legs=None, search_kind="trip"):
+    """Queue the search and keep its job id in the session; warns instead when the planner is full"""
+    # Starts today's rate-table download while the job waits for a worker.
+    get_fx_rate_table().get_rates(user_inputs["currency"])
     
-    workflow_builder.add_edge(START, "intake")
-    workflow_builder.add_edge("intake", "planner")
-    workflow_builder.add_conditional_edges(
-        "planner",
-        decide_next_step_after_planning,
-        {"specialists": "specialists", "present_plan": "present_plan"}
-    )
-    workflow_builder.add_conditional_edges(
-        "specialists",
-        route_to_both_agents,
-        ["travel_agent", "accommodation_agent"]
-    )
-    workflow_builder.add_edge(["travel_agent", "accommodation_agent"], "present_plan")
-    workflow_builder.add_edge("present_plan", END)
+    previous_job = st.session_state.pop("search_job", None)
+    if previous_job is not None:
+        get_search_job_queue().cancel(previous_job["job_id"])
+    
+    try:
+        job_id = get_search_job_queue().submit(user_inputs, search_kind)
+    except SearchQueueFull as error:
+        st.warning(f"The planner is busy right now ({error.queued} searches waiting). Please try again in a few seconds.")
+        return
     
-    return workflow_builder.compile(checkpointer=memory_saver)
+    st.session_state["last_trace_id"] = job_id
+    st.session_state["search_job"] = {
+        "job_id": job_id, "kind": search_kind, "search_key": search_key, "trip_legs": trip_legs, "currency": user_inputs["currency"]
+    }
 
-app = build_workflow()
 
-# 11. Building The Streamlit Interface
+def render_search_job_status(job):
+    if job["status"] == "queued":
+        st.info("Waiting for a free search worker...")
+    elif job["status"] == "running":
+        st.info(f"Searching... ({time.time() - job['started_at']:.0f}s so far)")
+    elif job["status"] == "done":
+        status_message = f"Search completed in {job['finished_at'] - job['started_at']:.1f}s"
+        if job["first_event_at"] is not None:
+            status_message += f" (first results after {job['first_event_at'] - job['started_at']:.1f}s)"
+        queue_wait_seconds = job["started_at"] - job["submitted_at"]
+        if queue_wait_seconds >= 1:
+            status_message += f", after waiting {queue_wait_seconds:.1f}s for a free worker"
+        st.success(status_message)
+    elif job["status"] == "failed":
+        st.error(f"An error occurred: {job['error']}")
+        st.info("Please check your API credentials and try again.")
+    else:
+        st.warning("Search cancelled.")
 
-st.markdown("---")
 
-col1, col2 = st.columns(2)
+def render_trip_job(search_job, job, currency, budget, num_people):
+    """Round-trip results from whatever events the job has stored so far"""
+    search_events = job["events"]
+    date_errors = [payload for event_name, payload in search_events if event_name == "date_error"]
+    if date_errors:
+        st.error(date_errors[0])
+        return
+    
+    render_search_job_status(job)
+    if not search_events:
+        return
+    
+    origin, destination, arrival_date_str, return_date_str, hotel_search_mode, flight_search_mode = search_job["search_key"]
+    num_nights = (date.fromisoformat(return_date_str) - date.fromisoformat(arrival_date_str)).days
+    still_searching = job["status"] not in FINISHED_STATUSES
+    flights = next((payload for event_name, payload in reversed(search_events) if event_name == "flights"), None)
+    hotels = next((payload for event_name, payload in reversed(search_events) if event_name == "hotels"), None)
+    streamed_hotels = [hotel for event_name, payload in search_events if event_name == "hotel_chunk" for hotel in payload]
+    
+    if job["status"] == "done" and not search_job.get("remembered") and flights is not None and hotels is not None:
+        remember_trip_results(search_job["search_key"], flights, hotels, search_job["currency"])
+        search_job["remembered"] = True
+    
+    render_trip_header(origin, destination, arrival_date_str, return_date_str, num_nights, budget, currency, num_people)
+    
+    if flights is not None:
+        flights = convert_prices_to_currency(flights, currency)
+        render_flight_options(flights, origin, destination, currency)
+    elif still_searching:
+        st.info("Searching for flights...")
+    
+    if hotels is not None:
+        hotels = sort_hotels_by_price(convert_prices_to_currency(hotels, currency))
+        render_hotel_options(hotels, num_nights)
+    elif streamed_hotels:
+        hotels = sort_hotels_by_price(convert_prices_to_currency(streamed_hotels, currency))
+        render_hotel_options(hotels, num_nights, still_searching=still_searching)
+    elif still_searching:
+        st.info("Searching for hotels...")
+    
+    render_budget_analysis(flights, hotels or [], origin, num_people, num_nights, budget, currency)
+    
+    if job["status"] == "done":
+        st.info("**Note:** Prices shown are from Amadeus API and may not reflect live rates. Click booking links for current prices.")
+        render_price_trends(origin, destination, arrival_date_str, return_date_str, search_job["currency"], hotel_search_mode, flight_search_mode)
+
+
+def render_multi_city_job(search_job, job, budget, num_people):
+    """Multi-city legs and stops from the job's events; prices stay in the currency searched"""
+    trip_legs = search_job["trip_legs"]
+    currency = search_job["currency"]
+    search_events = job["events"]
+    date_errors = [payload for event_name, payload in search_events if event_name == "date_error"]
+    if date_errors:
+        st.error(date_errors[0])
+        return
+    
+    render_search_job_status(job)
+    st.markdown(f"## Your Multi-City Trip: {' → '.join([trip_legs[0]['origin']] + [leg['destination'] for leg in trip_legs])}")
+    
+    still_searching = job["status"] not in FINISHED_STATUSES
+    stays_by_leg = {stay[0]: stay for stay in list_trip_stays(trip_legs)}
+    flights_by_leg = dict(payload for event_name, payload in search_events if event_name == "leg_flights")
+    hotels_by_stay = dict(payload for event_name, payload in search_events if event_name == "stay_hotels")
+    for leg_index, leg in enumerate(trip_legs):
+        if still_searching or leg_index in flights_by_leg:
+            render_trip_leg(
+                leg_index + 1, leg, flights_by_leg.get(leg_index), stays_by_leg.get(leg_index), hotels_by_stay.get(leg_index)
+            )
+    
+    itinerary = next((payload for event_name, payload in search_events if event_name == "itinerary"), None)
+    if itinerary:
+        render_multi_city_summary(itinerary, num_people, budget, currency)
 
-with col1:
-    origin = st.text_input("Origin City", value="New York", placeholder="e.g., Mumbai, New York, London")
-    arrival_date = st.date_input("Arrival Date", value=date.today(), min_value=date.today())
-    currency = st.selectbox("Currency", ["USD", "EUR", "GBP", "INR", "JPY"], index=0)
 
-with col2:
-    destination = st.text_input("Destination City", value="Paris", placeholder="e.g., Paris, Delhi, Tokyo")
-    return_date = st.date_input("Return Date", value=date.today() + timedelta(days=7), min_value=date.today())
-    budget = st.number_input("Budget", value=2000, min_value=100, step=100)
+def render_flexible_dates_job(search_job, job):
+    """The price matrix once the job has priced every cell, in the currency searched"""
+    render_search_job_status(job)
+    price_matrix = next((payload for event_name, payload in job["events"] if event_name == "price_matrix"), None)
+    if price_matrix is None:
+        return
+    
+    _, origin, destination, _, _, flex_days = search_job["search_key"]
+    st.markdown(f"## Flexible Dates: {origin} ↔ {destination}")
+    st.markdown(f"Round-trip flight prices for ±{flex_days} days around your dates")
+    render_price_matrix(price_matrix, search_job["currency"])
 
-num_people = st.number_input("Number of Travelers", value=1, min_value=1, max_value=10)
 
-st.markdown("---")
+def render_search_job_results(search_job, job, currency, budget, num_people):
+    if search_job["kind"] == "flexible_dates":
+        render_flexible_dates_job(search_job, job)
+    elif search_job["trip_legs"]:
+        render_multi_city_job(search_job, job, budget, num_people)
+    else:
+        render_trip_job(search_job, job, currency, budget, num_people)
+
+
+@st.fragment(run_every=SEARCH_JOB_POLL_SECONDS)
+def poll_search_job(search_job, currency, budget, num_people):
+    job = get_search_job_queue().get(search_job["job_id"])
+    if job is None:
+        # Purged while we were polling; the full rerun falls back to the cached results.
+        st.session_state.pop("search_job", None)
+        st.rerun()
+    render_search_job_results(search_job, job, currency, budget, num_people)
+    if job["status"] in FINISHED_STATUSES:
+        # One full rerun stops the polling and shows the final results.
+        st.rerun()
+
+
+def render_search_job(search_job, currency, budget, num_people):
+    """Draw a submitted search, polling while it runs; False if the job has been purged"""
+    job = get_search_job_queue().get(search_job["job_id"])
+    if job is None:
+        return False
+    if job["status"] in FINISHED_STATUSES:
+        render_search_job_results(search_job, job, currency, budget, num_people)
+    else:
+        poll_search_job(search_job, currency, budget, num_people)
+    return True
+
 
-if st.button("Search Flights & Hotels", type="primary", use_container_width=True):
+arrival_date_str = arrival_date.strftime("%Y-%m-%d")
+return_date_str = return_date.strftime("%Y-%m-%d")
+hotel_search_mode = "full_city" if full_city_hotels else "sample"
+flight_search_mode = "large" if large_flight_results else "sample"
+search_key = trip_search_key(origin, destination, arrival_date_str, return_date_str, hotel_search_mode, flight_search_mode)
+
+search_clicked = st.button("Search Flights & Hotels", type="primary", use_container_width=True)
+if search_clicked:
+    
+    trip_locations = [place for leg in trip_legs for place in (leg["origin"], leg["destination"])] if multi_city else [origin, destination]
+    # Unknown places are caught here rather than after the search has already run empty.
+    unknown_locations = [
+        location_text for location_text in dict.fromkeys(trip_locations)
+        if location_text and resolve_location_code(location_text) is None
+    ]
     
-    if not origin or not destination:
+    if not origin or not destination or (multi_city and not trip_legs):
         st.error("Please enter both origin and destination cities.")
+    elif unknown_locations:
+        for location_text in unknown_locations:
+            st.error(describe_unknown_location(location_text))
+    elif multi_city:
+        user_inputs = build_multi_city_inputs(
+            trip_legs, currency, budget, num_people, hotel_search_mode=hotel_search_mode, flight_search_mode=flight_search_mode
+        )
+        submit_search_job(user_inputs, multi_city_search_key(trip_legs, hotel_search_mode, flight_search_mode), trip_legs)
+    elif flexible_dates:
+        flexible_dates_inputs = {
+            "origin": origin,
+            "destination": destination,
+            "currency": currency,
+            "arrival_date": arrival_date_str,
+            "return_date": return_date_str,
+            "flex_days": flex_days,
+            "leg_prices": {},
+            "price_matrix": []
+        }
+        submit_search_job(
+            flexible_dates_inputs,
+            flexible_dates_search_key(origin, destination, arrival_date_str, return_date_str, flex_days),
+            search_kind="flexible_dates"
+        )
     else:
-        
-        with st.spinner("Searching for flights and hotels... This may take a moment."):
-            
-            arrival_date_str = arrival_date.strftime("%Y-%m-%d")
-            return_date_str = return_date.strftime("%Y-%m-%d")
-            stay_duration = str((return_date - arrival_date).days)
-            
-            user_inputs = {
-                "messages": [],
-                "origin": origin,
-                "destination": destination,
-                "currency": currency,
-                "budget": str(budget),
-                "num_people": str(num_people),
-                "arrival_date": arrival_date_str,
-                "return_date": return_date_str,
-                "stay_duration": stay_duration,
-                "flight_options": [],
-                "hotel_options": [],
-                "date_error": ""
-            }
-            
-            unique_thread_id = str(uuid.uuid4())
-            config = {"configurable": {"thread_id": unique_thread_id}}
-            
-            try:
-                result = app.invoke(user_inputs, config)
-                
-                if result.get('date_error'):
-                    st.error(result['date_error'])
-                else:
-                    flights = result.get("flight_options", [])
-                    hotels = result.get("hotel_options", [])
-                    num_nights = (return_date - arrival_date).days
-                    
-                    st.success("Search completed!")
-                    
-                    st.markdown(f"## Your Trip Plan: {origin} ↔ {destination}")
-                    st.markdown(f"**Dates:** {arrival_date_str} to {return_date_str} ({num_nights} nights)")
-                    st.markdown(f"**Budget:** {budget:.2f} {currency}")
-                    st.markdown(f"**Travelers:** {num_people}")
-                    
-                    st.markdown("---")
-                    
-                    st.markdown("### ✈️ Flight Options")
-                    
-                    if flights:
-                        origin_code = convert_city_to_airport_code(origin)
-                        destination_code = convert_city_to_airport_code(destination)
-                        
-                        outbound_flights = []
-                        return_flights = []
-                        
-                        for flight in flights:
-                            if flight.get('origin_code') == origin_code:
-                                outbound_flights.append(flight)
-                            else:
-                                return_flights.append(flight)
-                        
-                        if outbound_flights:
-                            st.markdown("#### Outbound Flights")
-                            for i, flight in enumerate(outbound_flights, 1):
-                                with st.container():
-                                    col1, col2, col3 = st.columns([2, 2, 1])
-                                    with col1:
-                                        st.markdown(f"**{flight['airline']}** - {flight['route']}")
-                                        st.markdown(f"Departs: {flight['departure']} | Arrives: {flight['arrival']}")
-                                    with col2:
-                                        st.markdown(f"**Price:** {flight['price']:.2f} {flight['currency']}")
-                                    with col3:
-                                        st.link_button("Book", flight['link'], use_container_width=True)
-                                st.markdown("")
-                        
-                        if return_flights:
-                            st.markdown("#### Return Flights")
-                            for i, flight in enumerate(return_flights, 1):
-                                with st.container():
-                                    col1, col2, col3 = st.columns([2, 2, 1])
-                                    with col1:
-                                        st.markdown(f"**{flight['airline']}** - {flight['route']}")
-                                        st.markdown(f"Departs: {flight['departure']} | Arrives: {flight['arrival']}")
-                                    with col2:
-                                        st.markdown(f"**Price:** {flight['price']:.2f} {flight['currency']}")
-                                    with col3:
-                                        st.link_button("Book", flight['link'], use_container_width=True)
-                                st.markdown("")
-                        
-                        if outbound_flights and return_flights:
-                            cheapest_out = min(outbound_flights, key=lambda x: x['price'])
-                            cheapest_ret = min(return_flights, key=lambda x: x['price'])
-                            total_flight = cheapest_out['price'] + cheapest_ret['price']
-                            st.info(f"**Best Flight Deal:** {total_flight:.2f} {currency} (outbound + return)")
-                    else:
-                        st.warning("No flights found. Please try different dates or cities.")
-                    
-                    st.markdown("---")
-                    
-                    st.markdown("### 🏨 Hotel Options")
-                    
-                    if hotels:
-                        for i, hotel in enumerate(hotels, 1):
-                            with st.container():
-                                col1, col2, col3 = st.columns([2, 2, 1])
-                                with col1:
-                                    st.markdown(f"**{hotel['name']}**")
-                                    st.markdown(f"Location: {hotel['distance_to_center']} from center")
-                                with col2:
-                                    if hotel['price']:
-                                        total_hotel = hotel['price'] * num_nights
-                                        st.markdown(f"**Price:** {hotel['price']:.2f} {hotel['currency']}/night")
-                                        st.markdown(f"Total: {total_hotel:.2f} {hotel['currency']} ({num_nights} nights)")
-                                    else:
-                                        st.markdown("**Price:** See website")
-                                with col3:
-                                    st.link_button("Book", hotel['link'], use_container_width=True)
-                            st.markdown("")
-                        
-                        if flights and outbound_flights and return_flights:
-                            hotels_with_prices = [h for h in hotels if h.get('price')]
-                            if hotels_with_prices:
-                                cheapest_hotel = min(hotels_with_prices, key=lambda x: x['price'])
-                                total_hotel_cost = cheapest_hotel['price'] * num_nights
-                                total_cost = total_flight + total_hotel_cost
-                                
-                                st.markdown("#### Budget Analysis")
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    st.metric("Flights (cheapest)", f"{total_flight:.2f} {currency}")
-                                with col2:
-                                    st.metric("Hotel (cheapest)", f"{total_hotel_cost:.2f} {currency}")
-                                with col3:
-                                    if total_cost <= budget:
-                                        st.metric("Total", f"{total_cost:.2f} {currency}", f"✓ Within budget")
-                                    else:
-                                        st.metric("Total", f"{total_cost:.2f} {currency}", f"Over by {total_cost - budget:.2f}")
-                    else:
-                        st.warning("No hotels found. Please try a different destination.")
-                    
-                    st.markdown("---")
-                    st.info("**Note:** Prices shown are from Amadeus API and may not reflect live rates. Click booking links for current prices.")
-            
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
-                st.info("Please check your API credentials and try again.")
-
+        user_inputs = build_trip_inputs(
+            origin, destination, currency, budget, num_people, arrival_date_str, return_date_str,
+            hotel_search_mode=hotel_search_mode, flight_search_mode=flight_search_mode
+        )
+        submit_search_job(user_inputs, search_key)
+
+if multi_city:
+    current_search_key = multi_city_search_key(trip_legs, hotel_search_mode, flight_search_mode)
+elif flexible_dates:
+    current_search_key = flexible_dates_search_key(origin, destination, arrival_date_str, return_date_str, flex_days)
+else:
+    current_search_key = search_key
+
+search_job = st.session_state.get("search_job")
+if search_job is not None and search_job["search_key"] != current_search_key:
+    # The route, dates or search mode changed: stop the search instead of finishing one nobody will see.
+    get_search_job_queue().cancel(search_job["job_id"])
+    search_job = None
+if search_job is not None and not render_search_job(search_job, currency, budget, num_people):
+    search_job = None
+if search_job is None:
+    st.session_state.pop("search_job", None)
+    if not search_clicked and not flexible_dates and not multi_city and not render_cached_trip_results(search_key, currency, budget, num_people):
+        if st.session_state.get("trip_results"):
+            st.info("Route or dates changed since your last search. Press search to see prices for this trip.")
 
 st.markdown("---")
-st.markdown("**Powered by:** Amadeus API | Built with Streamlit & LangGraph")
\ No newline at end of file
+st.markdown("**Powered by:** Amadeus API | Built with Streamlit & LangGraph")
+
+def render_search_waterfall(trace_id):
+    """Timeline of the spans recorded for one search, offset from its first span"""
+    trace_spans = get_tracer().get_trace(trace_id)
+    if not trace_spans:
+        st.caption("No spans recorded for the last search yet.")
+        return
+    
+    first_start = min(span_record["start"] for span_record in trace_spans)
+    waterfall_frame = pd.DataFrame([
+        {
+            "span": f"{span_record['kind']}: {span_record['name']}",
+            "kind": span_record["kind"],
+            "start_ms": (span_record["start"] - first_start) * 1000,
+            "end_ms": (span_record["start"] - first_start) * 1000 + span_record["duration_ms"],
+            "duration_ms": span_record["duration_ms"],
+            "status": span_record["status"]
+        }
+        for span_record in sorted(trace_spans, key=lambda span_record: span_record["start"])
+    ])
+    
+    waterfall_chart = alt.Chart(waterfall_frame).mark_bar().encode(
+        x=alt.X("start_ms:Q", title="ms since search start"),
+        x2="end_ms:Q",
+        y=alt.Y("span:N", sort=None, title=None),
+        color=alt.Color("kind:N", title="Kind"),
+        tooltip=["span", "duration_ms", "status"]
+    )
+    st.altair_chart(waterfall_chart, use_container_width=True)
+    st.download_button(
+        "Download trace (JSON)",
+        data=json.dumps(trace_spans, indent=2, default=str),
+        file_name=f"trace-{trace_id}.json",
+        mime="application/json"
+    )
+
+
+with st.sidebar:
+    if st.checkbox("Show search waterfall (debug)") and st.session_state.get("last_trace_id"):
+        with st.expander("Last search waterfall", expanded=True):
+            render_search_waterfall(st.session_state["last_trace_id"])
+    
+    with st.expander("Cache statistics"):
+        iata_stats = get_airport_code_cache().stats()
+        st.markdown("**City → IATA cache**")
+        st.markdown(f"Warm hits: {iata_stats['warm_hits']} | Cold hits: {iata_stats['cold_hits']} | Misses: {iata_stats['misses']}")
+        st.markdown(f"Negative hits: {iata_stats['negative_hits']} | Lookup errors: {iata_stats['lookup_errors']}")
+        st.markdown(f"Hit rate: {iata_stats['hit_rate']:.0%}")
+        fx_stats = get_fx_rate_table().stats()
+        st.markdown("**FX rate tables**")
+        st.markdown(f"Memory hits: {fx_stats['memory_hits']} | Disk hits: {fx_stats['disk_hits']} | Stale/fallback: {fx_stats['stale_hits'] + fx_stats['fallback_hits']}")
+        st.markdown(f"Fetches: {fx_stats['fetches']} | Fetch errors: {fx_stats['fetch_errors']}")
+        for cache_label, result_cache in (("Flight results", get_flight_result_cache()), ("Hotel results", get_hotel_result_cache())):
+            result_stats = result_cache.stats()
+            st.markdown(f"**{cache_label}** ({RESULT_CACHE_BACKEND}, {result_stats['entries']} entries)")
+            st.markdown(f"Hits: {result_stats['hits']} | Stale: {result_stats['stale_hits']} | Misses: {result_stats['misses']}")
+            st.markdown(f"Served while Amadeus was unavailable: {result_stats['fallback_hits']}")
+            st.markdown(f"Refreshes: {result_stats['refreshes']} | Evictions: {result_stats['evictions']} | Hit rate: {result_stats['hit_rate']:.0%}")
+        st.markdown("**Amadeus calls by outcome**")
+        for endpoint_name, outcome_counts in sorted(get_upstream_guard().stats().items()):
+            st.markdown(
+                f"`{endpoint_name}` ({outcome_counts.get('circuit', 'closed')}): "
+                f"OK {outcome_counts['ok']} | Empty {outcome_counts['empty']} | Throttled {outcome_counts['throttled']} | "
+                f"Failed {outcome_counts['failed']} | Short-circuited {outcome_counts['short_circuited']} | Retries {outcome_counts['retries']}"
+            )
+        history_stats = get_price_history().stats()
+        st.markdown("**Price history**")
+        st.markdown(f"Searches recorded: {history_stats['fetches']} | Offers: {history_stats['offers']} | Write errors: {history_stats['record_errors']}")
+        st.markdown(f"Answered from history: {history_stats['snapshot_hits']} | Refreshed upstream: {history_stats['snapshot_misses']}")
+        coalescer_stats = get_request_coalescer().stats()
+        st.markdown("**Upstream request coalescing**")
+        st.markdown(f"Upstream calls: {coalescer_stats['calls']} | Shared: {coalescer_stats['coalesced']} | In flight: {coalescer_stats['in_flight']}")
+        job_stats = get_search_job_queue().stats()
+        st.markdown("**Search jobs**")
+        st.markdown(
+            f"Running: {job_stats['running']}/{job_stats['max_workers']} | "
+            f"Waiting: {job_stats['queued']}/{job_stats['max_queued']} | Turned away: {job_stats['rejected']}"
+        )
+        st.markdown(
+            f"Done: {job_stats['done']} | Failed: {job_stats['failed']} | Cancelled: {job_stats['cancelled']} | "
+            f"Queue wait p50/p95: {job_stats['queue_wait_p50_ms'] if job_stats['queue_wait_p50_ms'] is not None else '–'}"
+            f"/{job_stats['queue_wait_p95_ms'] if job_stats['queue_wait_p95_ms'] is not None else '–'} ms"
+        )
+        warmer_stats = get_cache_warmer().stats()
+        calls_per_warm_hit = warmer_stats['upstream_calls_per_warm_hit']
+        st.markdown(f"**Cache warmer** ({'running' if get_cache_warmer().is_running() else 'off'})")
+        st.markdown(f"Searches: {warmer_stats['searches']} | Warm hits: {warmer_stats['warm_hits']} | Warm-hit rate: {warmer_stats['warm_hit_rate']:.0%}")
+        st.markdown(
+            f"Rounds: {warmer_stats['rounds']} | Upstream calls spent: {warmer_stats['warm_upstream_calls']} | "
+            f"Calls per warm hit: {calls_per_warm_hit if calls_per_warm_hit is not None else '–'}"
+        )
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""City name -> IATA code resolution cache.
+
+Lookups are answered, in order, by an in-process LRU, the bundled seed
+table in data/city_iata_seed.json, and a SQLite table whose rows expire
+after a TTL. Only when all three miss is the upstream lookup called.
+Keywords the upstream does not know are cached as negative entries with a
+shorter TTL so repeated typos do not keep hitting the network.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SEED_TABLE_PATH = os.path.join(PROJECT_DIRECTORY, "data", "city_iata_seed.json")
+DEFAULT_CACHE_DATABASE = os.environ.get("TRAVEL_PLANNER_CACHE_DB", "travel_planner_cache.db")
+
+# Marks a keyword the upstream answered with "no such city".
+NOT_FOUND = object()
+
+
+def normalize_city_keyword(city_name):
+    return " ".join(str(city_name).split()).casefold()
+
+
+def load_seed_table(seed_path=SEED_TABLE_PATH):
+    try:
+        with open(seed_path, encoding="utf-8") as seed_file:
+            seed_data = json.load(seed_file)
+    except (OSError, ValueError):
+        return {}
+
+    return {
+        normalize_city_keyword(city_name): iata_code.upper()
+        for city_name, iata_code in seed_data.items()
+    }
+
+
+class AirportCodeCache:
+    def __init__(
+        self,
+        database_path=DEFAULT_CACHE_DATABASE,
+        max_memory_entries=1024,
+        ttl_seconds=30 * 24 * 3600,
+        negative_ttl_seconds=24 * 3600,
+        seed_path=SEED_TABLE_PATH,
+    ):
+        self.max_memory_entries = max_memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.seed_table = load_seed_table(seed_path)
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "seed_hits": 0,
+            "disk_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "lookup_errors": 0,
+        }
+
+        self._connection = None
+        if database_path:
+            self._connection = sqlite3.connect(database_path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS city_iata_cache ("
+                "keyword TEXT PRIMARY KEY, "
+                "iata_code TEXT, "
+                "expires_at REAL NOT NULL)"
+            )
+            self._connection.commit()
+
+    def resolve(self, city_name, lookup_function=None):
+        """Return the IATA code for city_name, or None if it cannot be resolved.
+
+        lookup_function(city_name) is only called on a full cache miss. It
+        should return the code, or None when the upstream has no match.
+        Exceptions it raises are counted and not cached.
+        """
+        is_cached, iata_code = self.lookup_cached(city_name)
+        if is_cached or lookup_function is None:
+            return iata_code
+
+        try:
+            iata_code = lookup_function(city_name)
+        except Exception:
+            self._count("lookup_errors")
+            return None
+
+        return self.store(city_name, iata_code)
+
+    async def aresolve(self, city_name, async_lookup_function=None):
+        """Async counterpart of resolve() for coroutine lookup functions."""
+        is_cached, iata_code = self.lookup_cached(city_name)
+        if is_cached or async_lookup_function is None:
+            return iata_code
+
+        try:
+            iata_code = await async_lookup_function(city_name)
+        except Exception:
+            self._count("lookup_errors")
+            return None
+
+        return self.store(city_name, iata_code)
+
+    def lookup_cached(self, city_name):
+        """Return (is_cached, iata_code) without calling the upstream.
+
+        A cached negative entry is reported as (True, None); a miss is
+        counted and reported as (False, None).
+        """
+        keyword = normalize_city_keyword(city_name)
+        if not keyword:
+            return True, None
+
+        with self._lock:
+            if keyword in self._memory:
+                self._memory.move_to_end(keyword)
+                cached_value = self._memory[keyword]
+                self._counters["memory_hits"] += 1
+                if cached_value is NOT_FOUND:
+                    self._counters["negative_hits"] += 1
+                    return True, None
+                return True, cached_value
+
+        seed_code = self.seed_table.get(keyword)
+        if seed_code:
+            self._remember(keyword, seed_code)
+            self._count("seed_hits")
+            return True, seed_code
+
+        disk_value = self._read_disk(keyword)
+        if disk_value is not None:
+            self._remember(keyword, disk_value)
+            self._count("disk_hits")
+            if disk_value is NOT_FOUND:
+                self._count("negative_hits")
+                return True, None
+            return True, disk_value
+
+        self._count("misses")
+        return False, None
+
+    def store(self, city_name, iata_code):
+        """Cache an upstream answer; a falsy iata_code is stored as a negative entry."""
+        keyword = normalize_city_keyword(city_name)
+
+        if iata_code:
+            iata_code = iata_code.upper()
+            self._remember(keyword, iata_code)
+            self._write_disk(keyword, iata_code, self.ttl_seconds)
+            return iata_code
+
+        self._remember(keyword, NOT_FOUND)
+        self._write_disk(keyword, None, self.negative_ttl_seconds)
+        return None
+
+    def stats(self):
+        """Hit/miss counters. Warm hits come from the in-process LRU, cold
+        hits from the seed table or the on-disk cache."""
+        with self._lock:
+            counters = dict(self._counters)
+            counters["memory_entries"] = len(self._memory)
+
+        counters["warm_hits"] = counters["memory_hits"]
+        counters["cold_hits"] = counters["seed_hits"] + counters["disk_hits"]
+        total_lookups = counters["warm_hits"] + counters["cold_hits"] + counters["misses"]
+        counters["hit_rate"] = (
+            (counters["warm_hits"] + counters["cold_hits"]) / total_lookups
+            if total_lookups else 0.0
+        )
+        return counters
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def purge_expired(self):
+        if self._connection is None:
+            return 0
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM city_iata_cache WHERE expires_at <= ?", (time.time(),)
+            )
+            self._connection.commit()
+            return cursor.rowcount
+
+    def _count(self, counter_name):
+        with self._lock:
+            self._counters[counter_name] += 1
+
+    def _remember(self, keyword, value):
+        with self._lock:
+            self._memory[keyword] = value
+            self._memory.move_to_end(keyword)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _read_disk(self, keyword):
+        if self._connection is None:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT iata_code, expires_at FROM city_iata_cache WHERE keyword = ?",
+                (keyword,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        iata_code, expires_at = row
+        if expires_at <= time.time():
+            return None
+        if iata_code is None:
+            return NOT_FOUND
+        return iata_code
+
+    def _write_disk(self, keyword, iata_code, ttl_seconds):
+        if self._connection is None:
+            return
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO city_iata_cache (keyword, iata_code, expires_at) "
+                "VALUES (?, ?, ?)",
+                (keyword, iata_code, time.time() + ttl_seconds),
+            )
+            self._connection.commit()
@@ -0,0 +1,233 @@
+"""Bundled airport and city index for autocomplete and code resolution.
+
+data/airports.csv lists the airports the planner knows about with their
+city, metropolitan city code, country, coordinates and other names the
+city goes by. Every code, name and alias is normalized into one sorted
+array of search keys, so a prefix is answered with two binary searches
+over that array instead of a scan or a network call. Nearby airports are
+found with a vectorized haversine over the coordinate arrays.
+
+A place is what the user can pick: an airport, or a city served by
+several airports, which is searched by its city code (LON covers every
+London airport).
+"""
+import csv
+import heapq
+import os
+import re
+import unicodedata
+from bisect import bisect_left
+from dataclasses import dataclass
+
+import numpy as np
+
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+AIRPORTS_PATH = os.path.join(PROJECT_DIRECTORY, "data", "airports.csv")
+EARTH_RADIUS_KM = 6371.0
+
+# Matches the code in picked names such as "London Heathrow (LHR)".
+CODE_IN_PARENTHESES = re.compile(r"\(([A-Za-z]{3})\)")
+
+# Lower ranks sort first among suggestions for the same prefix.
+CODE_MATCH, NAME_MATCH, ALIAS_MATCH, WORD_MATCH = range(4)
+
+
+def normalize_place_text(text):
+    decomposed_text = unicodedata.normalize("NFKD", str(text))
+    without_accents = "".join(character for character in decomposed_text if not unicodedata.combining(character))
+    return " ".join(without_accents.replace("-", " ").split()).casefold()
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    latitude, longitude = np.radians(latitude), np.radians(longitude)
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    chord = (
+        np.sin((latitudes - latitude) / 2) ** 2
+        + np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(chord))
+
+
+@dataclass(frozen=True, slots=True)
+class Place:
+    code: str
+    kind: str
+    name: str
+    label: str
+    city: str
+    city_code: str
+    country: str
+    latitude: float
+    longitude: float
+
+
+class AirportIndex:
+    def __init__(self, airport_rows):
+        self.places = []
+        self._places_by_code = {}
+        search_terms = []
+
+        rows_by_city_code = {}
+        for airport_row in airport_rows:
+            rows_by_city_code.setdefault(airport_row["city_code"], []).append(airport_row)
+
+        # Cities in file order, each city before its own airports, so ties go to the busier place.
+        for city_code, city_rows in rows_by_city_code.items():
+            city_name = city_rows[0]["city"]
+            country = city_rows[0]["country"]
+            city_aliases = [alias for row in city_rows for alias in row["aliases"].split(";") if alias]
+            has_city_place = len(city_rows) > 1 or city_rows[0]["iata"] != city_code
+
+            if has_city_place:
+                city_place = self._add_place(Place(
+                    code=city_code,
+                    kind="city",
+                    name=city_name,
+                    label=f"{city_name} ({city_code}, all airports) · {country}",
+                    city=city_name,
+                    city_code=city_code,
+                    country=country,
+                    latitude=float(np.mean([float(row["latitude"]) for row in city_rows])),
+                    longitude=float(np.mean([float(row["longitude"]) for row in city_rows])),
+                ))
+                search_terms += self._city_terms(city_place, city_name, city_aliases)
+
+            for airport_row in city_rows:
+                airport_code = airport_row["iata"]
+                airport_name = airport_row["name"]
+                airport_place = self._add_place(Place(
+                    code=airport_code,
+                    kind="airport",
+                    name=f"{airport_name} ({airport_code})" if has_city_place else city_name,
+                    label=(
+                        f"{airport_name} ({airport_code}) · {city_name}, {country}" if has_city_place
+                        else f"{city_name} ({airport_code}) · {airport_name}, {country}"
+                    ),
+                    city=city_name,
+                    city_code=city_code,
+                    country=country,
+                    latitude=float(airport_row["latitude"]),
+                    longitude=float(airport_row["longitude"]),
+                ))
+                search_terms.append((airport_code.casefold(), CODE_MATCH, airport_place))
+                search_terms += self._name_terms(airport_place, airport_name, NAME_MATCH)
+                if not has_city_place:
+                    search_terms += self._city_terms(airport_place, city_name, city_aliases)
+
+        # The prefix structure: keys sorted once, with the place and match rank of each key alongside.
+        best_rank_by_term = {}
+        for term_key, match_rank, place_index in search_terms:
+            term = (term_key, place_index)
+            best_rank_by_term[term] = min(match_rank, best_rank_by_term.get(term, match_rank))
+        sorted_terms = sorted((term_key, match_rank, place_index) for (term_key, place_index), match_rank in best_rank_by_term.items())
+        self._keys = [term_key for term_key, _, _ in sorted_terms]
+        self._match_ranks = [match_rank for _, match_rank, _ in sorted_terms]
+        self._place_indexes = [place_index for _, _, place_index in sorted_terms]
+
+        self._airport_places = [place for place in self.places if place.kind == "airport"]
+        self._airport_latitudes = np.array([place.latitude for place in self._airport_places])
+        self._airport_longitudes = np.array([place.longitude for place in self._airport_places])
+
+    def __len__(self):
+        return len(self.places)
+
+    def _add_place(self, place):
+        self.places.append(place)
+        self._places_by_code.setdefault(place.code, place)
+        return len(self.places) - 1
+
+    def _name_terms(self, place_index, name, match_rank):
+        """The whole name, plus every later word onwards ("heathrow" for "London Heathrow")."""
+        name_key = normalize_place_text(name)
+        name_words = name_key.split(" ")
+        return [(name_key, match_rank, place_index)] + [
+            (" ".join(name_words[word_index:]), WORD_MATCH, place_index) for word_index in range(1, len(name_words))
+        ]
+
+    def _city_terms(self, place_index, city_name, city_aliases):
+        terms = [(self.places[place_index].city_code.casefold(), CODE_MATCH, place_index)]
+        terms += self._name_terms(place_index, city_name, NAME_MATCH)
+        for alias in city_aliases:
+            terms += self._name_terms(place_index, alias, ALIAS_MATCH)
+        return terms
+
+    def _key_range(self, key, prefix=True):
+        first_position = bisect_left(self._keys, key)
+        end_position = bisect_left(self._keys, key + "\uffff") if prefix else bisect_left(self._keys, key + "\0")
+        return range(first_position, end_position)
+
+    def suggest(self, prefix_text, limit=8):
+        """Places whose code, name or alias starts with prefix_text, best matches first"""
+        prefix_key = normalize_place_text(prefix_text)
+        if not prefix_key:
+            return []
+
+        best_scores = {}
+        for position in self._key_range(prefix_key):
+            place_index = self._place_indexes[position]
+            is_exact = self._keys[position] == prefix_key
+            match_rank = self._match_ranks[position]
+            # "b" is the start of a hundred codes; a code only ranks first when typed in full.
+            if match_rank == CODE_MATCH and not is_exact:
+                match_rank = WORD_MATCH
+            score = (not is_exact, match_rank, place_index)
+            if score < best_scores.get(place_index, (True, WORD_MATCH + 1, place_index)):
+                best_scores[place_index] = score
+        return [self.places[place_index] for place_index in heapq.nsmallest(limit, best_scores, key=best_scores.get)]
+
+    def find(self, place_text):
+        """The place place_text names exactly (a code, a name, an alias or a picked suggestion), or None"""
+        code_match = CODE_IN_PARENTHESES.search(str(place_text))
+        if code_match and code_match.group(1).upper() in self._places_by_code:
+            return self._places_by_code[code_match.group(1).upper()]
+
+        text_key = normalize_place_text(place_text)
+        matches = sorted(
+            (self._match_ranks[position], self._place_indexes[position])
+            for position in self._key_range(text_key, prefix=False)
+        )
+        if not matches:
+            return None
+        match_rank, place_index = matches[0]
+        # A trailing word alone ("international") is only an answer when it names one place.
+        if match_rank == WORD_MATCH and len({index for _, index in matches}) > 1:
+            return None
+        return self.places[place_index]
+
+    def resolve(self, place_text):
+        place = self.find(place_text)
+        return place.code if place is not None else None
+
+    def place_for_code(self, code):
+        return self._places_by_code.get(str(code).upper())
+
+    def nearby_airports(self, code, radius_km=150, limit=5):
+        """[(airport place, distance in km)] within radius_km of code, nearest first
+
+        The place itself is left out, and so are a city's own airports when
+        code is a city code: searching the city code already covers them.
+        """
+        place = self.place_for_code(code)
+        if place is None or not self._airport_places:
+            return []
+
+        distances_km = haversine_km(place.latitude, place.longitude, self._airport_latitudes, self._airport_longitudes)
+        nearby = []
+        for airport_position in np.argsort(distances_km):
+            if distances_km[airport_position] > radius_km or len(nearby) >= limit:
+                break
+            airport_place = self._airport_places[airport_position]
+            if airport_place.code == place.code or (place.kind == "city" and airport_place.city_code == place.code):
+                continue
+            nearby.append((airport_place, round(float(distances_km[airport_position]))))
+        return nearby
+
+
+def load_airport_index(airports_path=AIRPORTS_PATH):
+    try:
+        with open(airports_path, encoding="utf-8", newline="") as airports_file:
+            airport_rows = list(csv.DictReader(airports_file))
+    except OSError:
+        airport_rows = []
+    return AirportIndex(airport_rows)
@@ -0,0 +1,186 @@
+"""Asyncio transport for the Amadeus endpoints used by the planner.
+
+The synchronous amadeus.Client opens a new HTTP connection per request and
+blocks the calling thread. AsyncAmadeusTransport keeps one keep-alive
+connection pool and one OAuth access token per process, refreshed shortly
+before it expires, so concurrent Streamlit sessions share both.
+
+httpx connections and locks belong to the event loop that created them,
+while every Streamlit session runs its own loop. The transport therefore
+owns a private event loop on a daemon thread; the public coroutines hand
+their work to that loop and await the result from the caller's loop.
+"""
+import asyncio
+import threading
+import time
+
+import httpx
+
+
+AMADEUS_HOSTS = {
+    "test": "https://test.api.amadeus.com",
+    "production": "https://api.amadeus.com",
+}
+
+TOKEN_PATH = "/v1/security/oauth2/token"
+FLIGHT_OFFERS_PATH = "/v2/shopping/flight-offers"
+HOTELS_BY_CITY_PATH = "/v1/reference-data/locations/hotels/by-city"
+HOTEL_OFFERS_PATH = "/v3/shopping/hotel-offers"
+LOCATIONS_PATH = "/v1/reference-data/locations"
+
+
+class AmadeusTransportError(Exception):
+    def __init__(self, status_code, path, body=None, retry_after=None):
+        self.status_code = status_code
+        self.path = path
+        self.body = body
+        self.retry_after = retry_after
+        super().__init__(f"[{status_code}] {path}")
+
+
+class AsyncAmadeusResponse:
+    """Mirrors the .result/.data attributes of amadeus.Response."""
+
+    def __init__(self, result):
+        self.result = result
+        self.data = result.get("data", []) if isinstance(result, dict) else []
+
+
+def parse_retry_after(header_value):
+    if not header_value:
+        return None
+    try:
+        return max(0.0, float(header_value))
+    except ValueError:
+        return None
+
+
+class AsyncAmadeusTransport:
+    def __init__(
+        self,
+        client_id,
+        client_secret,
+        hostname="test",
+        max_connections=20,
+        max_keepalive_connections=10,
+        keepalive_expiry_seconds=30,
+        timeout_seconds=15,
+        token_refresh_margin_seconds=60,
+        rate_limiter=None,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.base_url = AMADEUS_HOSTS.get(hostname, hostname)
+        self.timeout_seconds = timeout_seconds
+        self.token_refresh_margin_seconds = token_refresh_margin_seconds
+        self.rate_limiter = rate_limiter
+        self.connection_limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry_seconds,
+        )
+
+        self._access_token = None
+        self._token_expires_at = 0.0
+        self._http_client = None
+        self._token_lock = None
+
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(
+            target=self._loop.run_forever, name="amadeus-async-transport", daemon=True
+        )
+        self._loop_thread.start()
+
+    async def flight_offers_search(self, **params):
+        return await self.get(FLIGHT_OFFERS_PATH, **params)
+
+    async def hotels_by_city(self, **params):
+        return await self.get(HOTELS_BY_CITY_PATH, **params)
+
+    async def hotel_offers_search(self, **params):
+        return await self.get(HOTEL_OFFERS_PATH, **params)
+
+    async def locations(self, **params):
+        return await self.get(LOCATIONS_PATH, **params)
+
+    async def get(self, path, **params):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async()
+        transport_future = asyncio.run_coroutine_threadsafe(
+            self._get_on_transport_loop(path, params), self._loop
+        )
+        return await asyncio.wrap_future(transport_future)
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        if self._http_client is not None:
+            asyncio.run_coroutine_threadsafe(self._http_client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+
+    # The methods below only ever run on the transport's own loop.
+
+    def _get_http_client(self):
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=self.connection_limits,
+                timeout=self.timeout_seconds,
+            )
+            self._token_lock = asyncio.Lock()
+        return self._http_client
+
+    async def _get_on_transport_loop(self, path, params):
+        http_client = self._get_http_client()
+
+        for attempt in range(2):
+            access_token = await self._get_access_token()
+            response = await http_client.get(
+                path, params=params, headers={"Authorization": f"Bearer {access_token}"}
+            )
+            if response.status_code == 401 and attempt == 0:
+                self._access_token = None
+                continue
+            break
+
+        if response.status_code >= 400:
+            raise AmadeusTransportError(
+                response.status_code,
+                path,
+                body=response.text,
+                retry_after=parse_retry_after(response.headers.get("Retry-After")),
+            )
+        return AsyncAmadeusResponse(response.json())
+
+    async def _get_access_token(self):
+        if self._token_is_fresh():
+            return self._access_token
+
+        async with self._token_lock:
+            # Another request may have refreshed it while we waited.
+            if self._token_is_fresh():
+                return self._access_token
+
+            response = await self._http_client.post(
+                TOKEN_PATH,
+                data={
+                    "grant_type": "client_credentials",
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                },
+            )
+            if response.status_code >= 400:
+                raise AmadeusTransportError(response.status_code, TOKEN_PATH, body=response.text)
+
+            token_data = response.json()
+            self._access_token = token_data["access_token"]
+            self._token_expires_at = time.time() + float(token_data.get("expires_in", 0))
+            return self._access_token
+
+    def _token_is_fresh(self):
+        return (
+            self._access_token is not None
+            and time.time() + self.token_refresh_margin_seconds < self._token_expires_at
+        )
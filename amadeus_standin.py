@@ -0,0 +1,356 @@
+"""Local stand-in for the Amadeus and Frankfurter endpoints the planner uses.
+
+AmadeusStandIn exposes the same attribute paths as amadeus.Client for the
+calls the planner makes:
+- shopping.flight_offers_search.get
+- shopping.hotel_offers_search.get
+- reference_data.locations.get
+- reference_data.locations.hotels.by_city.get
+
+AsyncAmadeusStandIn does the same for AsyncAmadeusTransport.
+
+Responses are replayed from a fixture file when the exact request was
+recorded there, and otherwise generated deterministically from the
+request, so any city pair and date range works offline. Every endpoint
+can be given latency, jitter and an error rate, which makes the stand-in
+usable both for UI work without credentials and for benchmarks.
+
+AmadeusRecorder wraps a live client and writes every response it sees
+into the fixture file for later replay.
+
+Environment (read by create_standin_from_environment):
+    AMADEUS_STANDIN_FIXTURES  fixture file, default data/amadeus_fixtures.json
+    AMADEUS_STANDIN_BEHAVIOR  JSON such as
+        {"*": {"latency_ms": 150}, "hotel_offers_search": {"latency_ms": 400, "error_rate": 0.05}}
+    AMADEUS_STANDIN_SEED      seed mixed into generated data, default 0
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from amadeus import ClientError, ServerError
+
+from airport_codes import load_seed_table, normalize_city_keyword
+from amadeus_async import AmadeusTransportError
+from fx_rates import load_fallback_rates, rebase_rates
+
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES_PATH = os.path.join(PROJECT_DIRECTORY, "data", "amadeus_fixtures.json")
+
+ENDPOINTS = ("flight_offers_search", "hotels_by_city", "hotel_offers_search", "locations", "fx_rates")
+AIRLINE_CODES = ("AF", "BA", "LH", "KL", "DL", "UA", "AA", "IB", "AZ", "LX", "EK", "QR")
+CONNECTING_AIRPORTS = ("AMS", "CDG", "FRA", "LHR", "IST", "DXB", "ORD", "ATL")
+
+
+@dataclass
+class EndpointBehavior:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    # Sent as Retry-After with injected errors when set, e.g. with error_status 429.
+    retry_after_seconds: float = None
+
+
+def parse_behaviors(behavior_spec):
+    """Build {endpoint: EndpointBehavior} from a JSON string or dict; "*" applies to every endpoint."""
+    if not behavior_spec:
+        return {}
+    if isinstance(behavior_spec, str):
+        behavior_spec = json.loads(behavior_spec)
+
+    default_settings = behavior_spec.get("*", {})
+    return {
+        endpoint: EndpointBehavior(**{**default_settings, **behavior_spec.get(endpoint, {})})
+        for endpoint in ENDPOINTS
+    }
+
+
+def make_fixture_key(params):
+    return json.dumps({name: str(value) for name, value in params.items()}, sort_keys=True)
+
+
+class FixtureStore:
+    """Recorded responses keyed by endpoint and request parameters, kept in one JSON file."""
+
+    def __init__(self, fixtures_path=DEFAULT_FIXTURES_PATH):
+        self.fixtures_path = fixtures_path
+        self._lock = threading.Lock()
+        self._fixtures = {}
+        if fixtures_path and os.path.exists(fixtures_path):
+            with open(fixtures_path, encoding="utf-8") as fixtures_file:
+                self._fixtures = json.load(fixtures_file)
+
+    def get(self, endpoint, params):
+        with self._lock:
+            return self._fixtures.get(endpoint, {}).get(make_fixture_key(params))
+
+    def put(self, endpoint, params, data):
+        with self._lock:
+            self._fixtures.setdefault(endpoint, {})[make_fixture_key(params)] = data
+            self._save()
+
+    def _save(self):
+        if not self.fixtures_path:
+            return
+        temporary_path = self.fixtures_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as fixtures_file:
+            json.dump(self._fixtures, fixtures_file, indent=1, sort_keys=True)
+        os.replace(temporary_path, self.fixtures_path)
+
+
+class StandInResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.result = {"data": data}
+        self.status_code = status_code
+        self.parsed = True
+        self.headers = {}
+        self.body = ""
+        self.request = None
+
+
+def build_error_response(status_code, endpoint, retry_after_seconds=None):
+    response = StandInResponse(None, status_code)
+    response.result = {"errors": [{"status": status_code, "title": f"Injected {endpoint} error"}]}
+    if retry_after_seconds is not None:
+        response.headers = {"Retry-After": str(retry_after_seconds)}
+    return response
+
+
+class _Namespace:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class _Endpoint:
+    def __init__(self, call_function, endpoint):
+        self._call_function = call_function
+        self._endpoint = endpoint
+
+    def get(self, **params):
+        return self._call_function(self._endpoint, params)
+
+
+def build_client_tree(call_function):
+    """Mirror the amadeus.Client attribute paths the planner uses onto call_function."""
+    locations = _Endpoint(call_function, "locations")
+    locations.hotels = _Namespace(by_city=_Endpoint(call_function, "hotels_by_city"))
+    return (
+        _Namespace(
+            flight_offers_search=_Endpoint(call_function, "flight_offers_search"),
+            hotel_offers_search=_Endpoint(call_function, "hotel_offers_search"),
+        ),
+        _Namespace(locations=locations),
+    )
+
+
+class AmadeusStandIn:
+    def __init__(self, fixtures=None, behaviors=None, seed=0, hotels_per_city=40):
+        self.fixtures = fixtures if fixtures is not None else FixtureStore(None)
+        self.behaviors = behaviors or {}
+        self.seed = seed
+        self.hotels_per_city = hotels_per_city
+        self.city_codes = load_seed_table()
+        self.shopping, self.reference_data = build_client_tree(self.respond)
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._counters = {endpoint: {"calls": 0, "replayed": 0, "generated": 0, "errors": 0} for endpoint in ENDPOINTS}
+
+    def respond(self, endpoint, params):
+        delay_seconds, error_status = self._plan_call(endpoint)
+        if delay_seconds:
+            time.sleep(delay_seconds)
+        if error_status:
+            error_class = ClientError if error_status < 500 else ServerError
+            raise error_class(build_error_response(error_status, endpoint, self._retry_after(endpoint)))
+        return StandInResponse(self.build_data(endpoint, params))
+
+    async def respond_async(self, endpoint, params):
+        delay_seconds, error_status = self._plan_call(endpoint)
+        if delay_seconds:
+            await asyncio.sleep(delay_seconds)
+        if error_status:
+            raise AmadeusTransportError(
+                error_status, endpoint, f"Injected {endpoint} error", retry_after=self._retry_after(endpoint)
+            )
+        return StandInResponse(self.build_data(endpoint, params))
+
+    def fetch_rates(self, base_currency, timeout=5):
+        """Drop-in for fx_rates.fetch_rates_from_frankfurter"""
+        delay_seconds, error_status = self._plan_call("fx_rates")
+        if delay_seconds:
+            time.sleep(min(delay_seconds, timeout))
+        if error_status:
+            raise ConnectionError(f"Injected fx_rates error [{error_status}]")
+        fallback_base, fallback_rates = load_fallback_rates()
+        rates = rebase_rates(fallback_rates, fallback_base, base_currency)
+        if not rates:
+            raise ConnectionError(f"No stand-in rates for {base_currency}")
+        return rates
+
+    def stats(self):
+        with self._lock:
+            return {endpoint: dict(counters) for endpoint, counters in self._counters.items()}
+
+    def build_data(self, endpoint, params):
+        recorded_data = self.fixtures.get(endpoint, params)
+        if recorded_data is not None:
+            self._count(endpoint, "replayed")
+            return recorded_data
+
+        self._count(endpoint, "generated")
+        generator = getattr(self, f"_generate_{endpoint}")
+        return generator(self._request_random(endpoint, params), **params)
+
+    def _plan_call(self, endpoint):
+        behavior = self.behaviors.get(endpoint)
+        with self._lock:
+            self._counters[endpoint]["calls"] += 1
+            if behavior is None:
+                return 0.0, None
+            delay_ms = behavior.latency_ms
+            if behavior.jitter_ms:
+                delay_ms += self._random.uniform(-behavior.jitter_ms, behavior.jitter_ms)
+            error_status = None
+            if behavior.error_rate and self._random.random() < behavior.error_rate:
+                error_status = behavior.error_status
+                self._counters[endpoint]["errors"] += 1
+        return max(delay_ms, 0.0) / 1000, error_status
+
+    def _retry_after(self, endpoint):
+        behavior = self.behaviors.get(endpoint)
+        return behavior.retry_after_seconds if behavior is not None else None
+
+    def _count(self, endpoint, counter_name):
+        with self._lock:
+            self._counters[endpoint][counter_name] += 1
+
+    def _request_random(self, endpoint, params):
+        return random.Random(zlib.crc32(f"{self.seed}|{endpoint}|{make_fixture_key(params)}".encode()))
+
+    # Generated responses carry only the fields the planner reads.
+
+    def _generate_locations(self, request_random, keyword="", subType="CITY", **params):
+        city_code = self.city_codes.get(normalize_city_keyword(keyword))
+        if city_code is None:
+            letters = [character for character in keyword.upper() if character.isalpha()]
+            if len(letters) < 3:
+                return []
+            city_code = "".join(letters[:3])
+        return [{"type": "location", "subType": subType, "name": keyword.upper(), "iataCode": city_code}]
+
+    def _generate_hotels_by_city(self, request_random, cityCode="", **params):
+        return [
+            {"hotelId": f"SI{cityCode[:3]}{index:03d}", "name": f"{cityCode} Stand-In Hotel {index + 1}", "iataCode": cityCode}
+            for index in range(self.hotels_per_city)
+        ]
+
+    def _generate_hotel_offers_search(self, request_random, hotelIds="", currency="USD", **params):
+        hotel_offers = []
+        for hotel_id in hotelIds.split(","):
+            # Like the live API, hotels without availability are left out.
+            if not hotel_id or request_random.random() < 0.15:
+                continue
+            nightly_price = request_random.uniform(60, 420)
+            hotel_offers.append({
+                "type": "hotel-offers",
+                "hotel": {"hotelId": hotel_id, "name": f"{hotel_id[2:5]} Stand-In Hotel {int(hotel_id[5:]) + 1}"},
+                "available": True,
+                "offers": [{"price": {"currency": currency, "total": f"{nightly_price:.2f}"}}],
+            })
+        return hotel_offers
+
+    def _generate_flight_offers_search(
+        self, request_random, originLocationCode="", destinationLocationCode="", departureDate="",
+        currencyCode="USD", max=5, **params
+    ):
+        flight_offers = []
+        for _ in range(int(max)):
+            departure_time = datetime.strptime(departureDate, "%Y-%m-%d") + timedelta(
+                hours=request_random.randint(5, 22), minutes=request_random.choice((0, 15, 30, 45))
+            )
+            arrival_time = departure_time + timedelta(minutes=request_random.randint(60, 14 * 60))
+            carrier_code = request_random.choice(AIRLINE_CODES)
+            # Most offers are non-stop; the rest connect once or twice, splitting the journey evenly.
+            connecting_airports = [code for code in CONNECTING_AIRPORTS if code not in (originLocationCode, destinationLocationCode)]
+            stop_codes = request_random.sample(connecting_airports, request_random.choice((0, 0, 0, 1, 1, 2)))
+            segment_airports = [originLocationCode, *stop_codes, destinationLocationCode]
+            segment_duration = (arrival_time - departure_time) / (len(segment_airports) - 1)
+            flight_offers.append({
+                "type": "flight-offer",
+                "price": {"currency": currencyCode, "total": f"{request_random.uniform(80, 1100):.2f}"},
+                "itineraries": [{"segments": [
+                    {
+                        "carrierCode": carrier_code,
+                        "departure": {"iataCode": from_code, "at": (departure_time + segment_duration * segment_index).isoformat()},
+                        "arrival": {"iataCode": to_code, "at": (departure_time + segment_duration * (segment_index + 1)).isoformat()},
+                    }
+                    for segment_index, (from_code, to_code) in enumerate(zip(segment_airports, segment_airports[1:]))
+                ]}],
+            })
+        return flight_offers
+
+
+class AsyncAmadeusStandIn:
+    """Stand-in for AsyncAmadeusTransport backed by an AmadeusStandIn"""
+
+    def __init__(self, standin, rate_limiter=None):
+        self.standin = standin
+        self.rate_limiter = rate_limiter
+
+    async def flight_offers_search(self, **params):
+        return await self._call("flight_offers_search", params)
+
+    async def hotels_by_city(self, **params):
+        return await self._call("hotels_by_city", params)
+
+    async def hotel_offers_search(self, **params):
+        return await self._call("hotel_offers_search", params)
+
+    async def locations(self, **params):
+        return await self._call("locations", params)
+
+    async def _call(self, endpoint, params):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async()
+        return await self.standin.respond_async(endpoint, params)
+
+    def close(self):
+        pass
+
+
+class AmadeusRecorder:
+    """Wraps a live amadeus.Client and saves each successful response as a fixture"""
+
+    def __init__(self, live_client, fixtures):
+        self.live_client = live_client
+        self.fixtures = fixtures
+        self._live_endpoints = {
+            "flight_offers_search": live_client.shopping.flight_offers_search,
+            "hotel_offers_search": live_client.shopping.hotel_offers_search,
+            "locations": live_client.reference_data.locations,
+            "hotels_by_city": live_client.reference_data.locations.hotels.by_city,
+        }
+        self.shopping, self.reference_data = build_client_tree(self.record)
+
+    def record(self, endpoint, params):
+        response = self._live_endpoints[endpoint].get(**params)
+        self.fixtures.put(endpoint, params, response.data)
+        return response
+
+
+def create_standin_from_environment():
+    return AmadeusStandIn(
+        fixtures=FixtureStore(os.environ.get("AMADEUS_STANDIN_FIXTURES", DEFAULT_FIXTURES_PATH)),
+        behaviors=parse_behaviors(os.environ.get("AMADEUS_STANDIN_BEHAVIOR", "")),
+        seed=int(os.environ.get("AMADEUS_STANDIN_SEED", "0")),
+    )
@@ -0,0 +1,229 @@
+"""Headless batch planner.
+
+Streams trip requests from a JSONL file through the compiled planner
+workflow and appends one result line per request to an output JSONL file
+as soon as that request finishes, so an interrupted run keeps everything
+it already wrote.
+
+Each input line is a JSON object with origin, destination, arrival_date
+and return_date (YYYY-MM-DD). currency, budget, num_people,
+hotel_search_mode ("sample" or "full_city") and flight_search_mode
+("sample" or "large") are optional. Lines without
+these fields, such as a backlog file, are written out as "invalid" and
+skipped.
+
+    python batch_planner.py trips.jsonl -o quotes.jsonl --workers 8 --rate-limit 10
+    python batch_planner.py trips.jsonl -o quotes.jsonl --resume
+
+Workers are threads: the work is almost entirely waiting on Amadeus, and
+threads let every worker draw from the same upstream rate budget.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+
+from offer_records import offer_to_dict
+from rate_limit import TokenBucket
+
+
+REQUIRED_FIELDS = ("origin", "destination", "arrival_date", "return_date")
+
+
+def iterate_trip_requests(input_path, start_offset=0):
+    """Yield (line_index, request, error) for every non-blank line from start_offset on."""
+    with open(input_path, encoding="utf-8") as input_file:
+        for line_index, line in enumerate(input_file):
+            if line_index < start_offset or not line.strip():
+                continue
+            try:
+                trip_request = json.loads(line)
+            except ValueError as error:
+                yield line_index, None, f"Invalid JSON: {error}"
+                continue
+
+            if not isinstance(trip_request, dict):
+                yield line_index, trip_request, "Request is not a JSON object"
+                continue
+
+            missing_fields = [field for field in REQUIRED_FIELDS if not trip_request.get(field)]
+            if missing_fields:
+                yield line_index, trip_request, f"Missing fields: {', '.join(missing_fields)}"
+                continue
+
+            yield line_index, trip_request, None
+
+
+def read_completed_line_indexes(output_path):
+    completed_indexes = set()
+    if not os.path.exists(output_path):
+        return completed_indexes
+
+    with open(output_path, encoding="utf-8") as output_file:
+        for line in output_file:
+            try:
+                completed_indexes.add(json.loads(line)["line_index"])
+            except (ValueError, KeyError, TypeError):
+                # A line cut short by a crash is simply re-run.
+                continue
+    return completed_indexes
+
+
+def utc_timestamp(epoch_seconds):
+    return datetime.fromtimestamp(epoch_seconds, tz=timezone.utc).isoformat()
+
+
+class BatchResultWriter:
+    def __init__(self, output_path):
+        self._output_file = open(output_path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.written = 0
+
+    def write(self, result_row):
+        line = json.dumps(result_row, default=str)
+        with self._lock:
+            self._output_file.write(line + "\n")
+            self._output_file.flush()
+            os.fsync(self._output_file.fileno())
+            self.written += 1
+
+    def close(self):
+        self._output_file.close()
+
+
+def plan_trip(planner, planner_app, checkpoint_retention, line_index, trip_request, submitted_at, run_id):
+    started_at = time.time()
+    result_row = {"line_index": line_index, "request": trip_request}
+
+    try:
+        user_inputs = planner.build_trip_inputs(
+            trip_request["origin"],
+            trip_request["destination"],
+            trip_request.get("currency", "USD"),
+            trip_request.get("budget", ""),
+            trip_request.get("num_people", 1),
+            trip_request["arrival_date"],
+            trip_request["return_date"],
+            hotel_search_mode=trip_request.get("hotel_search_mode", ""),
+            flight_search_mode=trip_request.get("flight_search_mode", ""),
+        )
+        planner_result = planner.invoke_trip_search(
+            user_inputs,
+            f"batch-{run_id}-{line_index}",
+            planner_app=planner_app,
+            checkpoint_retention=checkpoint_retention,
+        )
+
+        if planner_result.get("date_error"):
+            result_row["status"] = "invalid"
+            result_row["error"] = planner_result["date_error"]
+        else:
+            result_row["status"] = "ok"
+        result_row["flight_options"] = [offer_to_dict(offer) for offer in planner_result.get("flight_options", [])]
+        result_row["hotel_options"] = [offer_to_dict(offer) for offer in planner_result.get("hotel_options", [])]
+    except Exception as error:
+        result_row["status"] = "error"
+        result_row["error"] = f"{type(error).__name__}: {error}"
+
+    finished_at = time.time()
+    result_row["submitted_at"] = utc_timestamp(submitted_at)
+    result_row["started_at"] = utc_timestamp(started_at)
+    result_row["finished_at"] = utc_timestamp(finished_at)
+    result_row["queue_seconds"] = round(started_at - submitted_at, 4)
+    result_row["duration_seconds"] = round(finished_at - started_at, 4)
+    return result_row
+
+
+def run_batch(input_path, output_path, workers=4, rate_limit=10.0, start_offset=0, resume=False, limit=None, ephemeral=False):
+    # Imported here so --help works without loading the planner.
+    import travel_planner_engine as planner
+
+    # Set before the first search, so the Amadeus transport and retry guard are built with it.
+    planner.get_upstream_rate_limiter.override(TokenBucket(rate_limit) if rate_limit and rate_limit > 0 else None)
+    # Every worker searches both legs at once, so the shared flight pool must not queue them behind each other.
+    planner.get_flight_search_pool.override(planner.create_flight_search_pool(workers))
+
+    checkpoint_retention = "ephemeral" if ephemeral else planner.CHECKPOINT_RETENTION
+    planner_app = planner.build_workflow(checkpoint_retention)
+
+    completed_indexes = read_completed_line_indexes(output_path) if resume else set()
+    run_id = uuid.uuid4().hex[:8]
+    writer = BatchResultWriter(output_path)
+    counts = {"ok": 0, "invalid": 0, "error": 0, "skipped": len(completed_indexes)}
+    batch_started_at = time.time()
+
+    def record(result_row):
+        writer.write(result_row)
+        counts[result_row["status"]] += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-planner") as executor:
+            pending_futures = set()
+            submitted = 0
+
+            for line_index, trip_request, request_error in iterate_trip_requests(input_path, start_offset):
+                if line_index in completed_indexes:
+                    continue
+                if limit is not None and submitted >= limit:
+                    break
+                submitted += 1
+
+                if request_error:
+                    record({"line_index": line_index, "request": trip_request, "status": "invalid", "error": request_error})
+                    continue
+
+                # Keep at most two requests per worker in memory at once.
+                while len(pending_futures) >= workers * 2:
+                    finished_futures, pending_futures = wait(pending_futures, return_when=FIRST_COMPLETED)
+                    for finished_future in finished_futures:
+                        record(finished_future.result())
+
+                pending_futures.add(executor.submit(
+                    plan_trip, planner, planner_app, checkpoint_retention, line_index, trip_request, time.time(), run_id
+                ))
+
+            for finished_future in pending_futures:
+                record(finished_future.result())
+    finally:
+        writer.close()
+
+    elapsed_seconds = time.time() - batch_started_at
+    processed = counts["ok"] + counts["invalid"] + counts["error"]
+    counts["elapsed_seconds"] = round(elapsed_seconds, 2)
+    counts["requests_per_second"] = round(processed / elapsed_seconds, 3) if elapsed_seconds else 0.0
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run trip requests from a JSONL file through the travel planner.")
+    parser.add_argument("input", help="JSONL file with one trip request per line")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--workers", type=int, default=4, help="number of requests planned concurrently")
+    parser.add_argument("--rate-limit", type=float, default=10.0, help="upstream Amadeus requests per second across all workers (0 = unlimited)")
+    parser.add_argument("--start-offset", type=int, default=0, help="skip input lines before this zero-based line index")
+    parser.add_argument("--resume", action="store_true", help="skip lines that already have a result in the output file")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many requests")
+    parser.add_argument("--ephemeral", action="store_true", help="do not write planner checkpoints to SQLite")
+    args = parser.parse_args(argv)
+
+    counts = run_batch(
+        args.input,
+        args.output,
+        workers=args.workers,
+        rate_limit=args.rate_limit,
+        start_offset=args.start_offset,
+        resume=args.resume,
+        limit=args.limit,
+        ephemeral=args.ephemeral,
+    )
+    print(json.dumps(counts), file=sys.stderr)
+    return 0 if counts["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Benchmark: rank_itineraries on large synthetic offer sets.
+
+    python benchmarks/bench_itinerary_optimizer.py --offers-per-leg 500 --hotels 5000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from itinerary_optimizer import rank_itineraries
+from offer_records import FlightOption, HotelOption
+
+
+def build_flights(count, origin_code, destination_code, random_generator):
+    return [
+        FlightOption(
+            airline=random_generator.choice(["AF", "BA", "LH", "DL", "UA"]),
+            route=f"{origin_code} -> {destination_code}",
+            origin_code=origin_code,
+            destination_code=destination_code,
+            price=round(random_generator.uniform(60, 1200), 2),
+            currency="USD",
+            departure=f"{random_generator.randint(0, 23):02d}:{random_generator.choice(['00', '15', '30', '45'])}",
+            arrival="",
+            date="2026-11-02",
+            link="",
+        )
+        for _ in range(count)
+    ]
+
+
+def build_hotels(count, random_generator):
+    return [
+        HotelOption(
+            name=f"Hotel {index}",
+            price=round(random_generator.uniform(40, 900), 2) if random_generator.random() > 0.1 else None,
+            currency="USD",
+            address="Paris",
+            link="",
+        )
+        for index in range(count)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--offers-per-leg", type=int, default=500)
+    parser.add_argument("--hotels", type=int, default=5000)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    random_generator = random.Random(args.seed)
+    outbound_flights = build_flights(args.offers_per_leg, "NYC", "PAR", random_generator)
+    return_flights = build_flights(args.offers_per_leg, "PAR", "NYC", random_generator)
+    hotels = build_hotels(args.hotels, random_generator)
+
+    for budget in (None, 6000, 2500):
+        timings = []
+        for _ in range(args.repeats):
+            started_at = time.perf_counter()
+            itineraries = rank_itineraries(
+                outbound_flights, return_flights, hotels, num_people=3, num_nights=7, budget=budget, top_k=args.top_k
+            )
+            timings.append(time.perf_counter() - started_at)
+        timings.sort()
+        print(json.dumps({
+            "offers_per_leg": args.offers_per_leg,
+            "hotels": args.hotels,
+            "budget": budget,
+            "itineraries": len(itineraries),
+            "median_ms": round(timings[len(timings) // 2] * 1000, 2),
+            "max_ms": round(timings[-1] * 1000, 2),
+        }))
+
+
+if __name__ == "__main__":
+    main()
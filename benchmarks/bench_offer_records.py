@@ -0,0 +1,128 @@
+"""Micro-benchmark: offer dicts through JSON strings vs. typed offer records.
+
+Replays what one trip search does with its results:
+
+- legacy: build dicts, json.dumps them in the tool, json.loads them back in
+  the node, concatenate into state with operator.add, then serialize the
+  state for the checkpoint.
+- records: build FlightOption/HotelOption records, hand the same list to
+  state, then serialize the state for the checkpoint, which stores each
+  record as a tuple of its fields (OfferRecordSerializer).
+
+Reports wall time and allocated bytes (tracemalloc) per search, for the
+tool-to-node handoff alone and for handoff plus checkpoint serialization.
+
+    python benchmarks/bench_offer_records.py --searches 2000
+"""
+import argparse
+import json
+import operator
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkpointing import OfferRecordSerializer
+from offer_records import FlightOption, HotelOption
+
+
+FLIGHTS_PER_SEARCH = 3
+HOTELS_PER_SEARCH = 5
+
+
+def build_flight_fields(index):
+    return dict(
+        airline="LH",
+        route="FRA -> JFK",
+        origin_code="FRA",
+        destination_code="JFK",
+        price=412.5 + index,
+        currency="USD",
+        departure="Morning (09:15)",
+        arrival="Afternoon (12:40)",
+        date="2026-11-02",
+        link="https://www.skyscanner.com/transport/flights/fra/jfk/261102/?adults=1&cabinclass=economy&rtn=0",
+    )
+
+
+def build_hotel_fields(index):
+    return dict(
+        name=f"Hotel {index}",
+        price=180.0 + index,
+        currency="USD",
+        address="New York",
+        link=f"https://www.booking.com/searchresults.html?ss=Hotel+{index}+New+York",
+        distance_to_center="N/A",
+        hotel_id=f"NYC{index:05d}",
+    )
+
+
+def legacy_handoff():
+    flight_json = json.dumps([dict(build_flight_fields(i), type="flight") for i in range(FLIGHTS_PER_SEARCH)])
+    hotel_json = json.dumps([dict(build_hotel_fields(i), type="hotel") for i in range(HOTELS_PER_SEARCH)])
+
+    flight_options = operator.add([], json.loads(flight_json))
+    hotel_options = operator.add([], json.loads(hotel_json))
+    return {"flight_options": flight_options, "hotel_options": hotel_options}
+
+
+def records_handoff():
+    flight_options = operator.add([], [FlightOption(**build_flight_fields(i)) for i in range(FLIGHTS_PER_SEARCH)])
+    hotel_options = operator.add([], [HotelOption(**build_hotel_fields(i)) for i in range(HOTELS_PER_SEARCH)])
+    return {"flight_options": flight_options, "hotel_options": hotel_options}
+
+
+def measure_time(search_function, searches):
+    for _ in range(min(searches, 100)):
+        search_function()
+
+    started_at = time.perf_counter()
+    for _ in range(searches):
+        search_function()
+    return (time.perf_counter() - started_at) / searches
+
+
+def measure_allocations(search_function, searches):
+    """Average peak bytes allocated while one search runs, including memory freed again."""
+    allocated_bytes = 0
+    tracemalloc.start()
+    for _ in range(searches):
+        before_bytes, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        search_function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        allocated_bytes += peak_bytes - before_bytes
+    tracemalloc.stop()
+    return allocated_bytes / searches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--searches", type=int, default=2000, help="number of simulated searches per path")
+    args = parser.parse_args(argv)
+
+    serializer = OfferRecordSerializer()
+
+    for path_name, handoff_function in (("legacy", legacy_handoff), ("records", records_handoff)):
+        phases = {
+            "handoff": handoff_function,
+            "handoff+checkpoint": lambda: serializer.dumps_typed(handoff_function()),
+        }
+        for phase_name, search_function in phases.items():
+            seconds_per_search = measure_time(search_function, args.searches)
+            bytes_per_search = measure_allocations(search_function, min(args.searches, 500))
+            print(json.dumps({
+                "path": path_name,
+                "phase": phase_name,
+                "searches": args.searches,
+                "microseconds_per_search": round(seconds_per_search * 1e6, 2),
+                "peak_bytes_per_search": round(bytes_per_search),
+            }))
+
+        checkpoint_bytes = len(serializer.dumps_typed(handoff_function())[1])
+        print(json.dumps({"path": path_name, "checkpoint_payload_bytes": checkpoint_bytes}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Cold-start benchmark of the headless planner engine.
+
+Each run is a fresh Python process that imports travel_planner_engine,
+builds the workflow and runs two searches against the Amadeus stand-in
+(no network, no added latency). Reported per phase, median and max over
+the runs:
+
+- import: importing travel_planner_engine,
+- build: compiling the workflow (opens the checkpoint SQLite database),
+- first_search: the first search, which creates the clients and caches,
+- second_search: a different search in the same process, for comparison.
+
+Each run also records what the import alone left behind: whether it
+pulled in Streamlit, how many threads it started and which files it
+created. All three should stay empty. --budget-seconds makes the run
+fail when the median of import + build + first_search goes over it, so
+cold-start regressions show up in CI.
+
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --runs 3 --budget-seconds 6
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIRECTORY)
+
+
+PHASES = ("import", "build", "first_search", "second_search")
+
+
+def measure_cold_start(work_directory):
+    """Runs in the child process; returns seconds per phase and the import's side effects."""
+    threads_before_import = threading.active_count()
+    started_at = time.perf_counter()
+    import travel_planner_engine as planner
+    imported_at = time.perf_counter()
+    import_side_effects = {
+        "streamlit_imported": "streamlit" in sys.modules,
+        "threads_started": threading.active_count() - threads_before_import,
+        "files_created": sorted(os.listdir(work_directory)),
+    }
+
+    planner_app = planner.build_workflow()
+    built_at = time.perf_counter()
+
+    first_day = date.today() + timedelta(days=30)
+    search_seconds = []
+    for search_index, (origin, destination) in enumerate([("New York", "Paris"), ("London", "Tokyo")]):
+        trip_inputs = planner.build_trip_inputs(
+            origin, destination, "USD", 3000, 2, first_day.isoformat(), (first_day + timedelta(days=4)).isoformat()
+        )
+        search_started_at = time.perf_counter()
+        final_state = planner.invoke_trip_search(trip_inputs, f"startup-{search_index}", planner_app=planner_app)
+        search_seconds.append(time.perf_counter() - search_started_at)
+        if not final_state.get("flight_options"):
+            raise RuntimeError(f"{origin} -> {destination} returned no flights")
+
+    return {
+        "import": imported_at - started_at,
+        "build": built_at - imported_at,
+        "first_search": search_seconds[0],
+        "second_search": search_seconds[1],
+        "import_side_effects": import_side_effects,
+    }
+
+
+def run_child(work_directory):
+    child_environment = dict(
+        os.environ,
+        AMADEUS_BACKEND="standin",
+        AMADEUS_STANDIN_BEHAVIOR="",
+        AMADEUS_RATE_LIMIT_PER_SECOND="0",
+        CHECKPOINT_DB=os.path.join(work_directory, "checkpoints.db"),
+        TRAVEL_PLANNER_CACHE_DB=os.path.join(work_directory, "cache.db"),
+    )
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", work_directory],
+        env=child_environment, cwd=work_directory, capture_output=True, text=True, check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(values):
+    ordered = sorted(values)
+    return {"median_ms": round(ordered[len(ordered) // 2] * 1000, 1), "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh processes to time")
+    parser.add_argument("--budget-seconds", type=float, default=None, help="fail if median import+build+first search exceeds this")
+    parser.add_argument("--child", metavar="WORK_DIRECTORY", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure_cold_start(args.child)))
+        return 0
+
+    runs = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="planner-startup-") as work_directory:
+            runs.append(run_child(work_directory))
+
+    cold_start_seconds = [run["import"] + run["build"] + run["first_search"] for run in runs]
+    report = {
+        "runs": args.runs,
+        "phases": {phase: summarize([run[phase] for run in runs]) for phase in PHASES},
+        "cold_start": summarize(cold_start_seconds),
+        "import_side_effects": runs[-1]["import_side_effects"],
+    }
+    print(json.dumps(report))
+
+    median_cold_start = sorted(cold_start_seconds)[len(cold_start_seconds) // 2]
+    if args.budget_seconds is not None and median_cold_start > args.budget_seconds:
+        print(f"cold start {median_cold_start:.2f}s is over the {args.budget_seconds:.2f}s budget", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""End-to-end benchmark of the planner workflow against the Amadeus stand-in.
+
+Drives build_workflow() with distinct trip requests at each concurrency
+level and reports, per checkpoint retention mode:
+
+- end-to-end latency p50/p95/p99 and throughput,
+- latency p50/p95/p99 per graph node (sub-graph nodes as parent/child),
+- SQLite checkpoint writes, their total time and time per request.
+
+Result caches and price-history reuse are disabled by default so every
+request reaches the stand-in; pass --warm-cache to keep them. --same-route sends every
+request for one route and date, which with the caches off measures how
+many upstream calls request coalescing saves. Nothing here touches the
+network: Amadeus and the FX endpoint are served by amadeus_standin with
+the latency profile below (override with AMADEUS_STANDIN_BEHAVIOR).
+
+    python benchmarks/bench_workflow.py --requests 60 --concurrency 1,4,16
+    python benchmarks/bench_workflow.py --checkpoints ephemeral,final --error-rate 0.05
+    python benchmarks/bench_workflow.py --same-route --concurrency 16 --checkpoints ephemeral
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+
+DEFAULT_BEHAVIOR = {
+    "locations": {"latency_ms": 120, "jitter_ms": 40},
+    "hotels_by_city": {"latency_ms": 200, "jitter_ms": 60},
+    "hotel_offers_search": {"latency_ms": 450, "jitter_ms": 150},
+    "flight_offers_search": {"latency_ms": 400, "jitter_ms": 150},
+    "fx_rates": {"latency_ms": 80, "jitter_ms": 20},
+}
+
+BENCHMARK_CITIES = [
+    "New York", "Paris", "London", "Tokyo", "Rome", "Madrid", "Berlin", "Amsterdam",
+    "Lisbon", "Vienna", "Prague", "Dublin", "Chicago", "Toronto", "Sydney", "Singapore",
+]
+
+
+def configure_environment(args, work_directory):
+    """Must run before travel_planner_engine is imported: it reads these at import time."""
+    behavior = json.loads(os.environ.get("AMADEUS_STANDIN_BEHAVIOR", "null") or "null") or dict(DEFAULT_BEHAVIOR)
+    if args.error_rate:
+        behavior["*"] = {**behavior.get("*", {}), "error_rate": args.error_rate}
+
+    os.environ["AMADEUS_BACKEND"] = "standin"
+    os.environ["AMADEUS_STANDIN_BEHAVIOR"] = json.dumps(behavior)
+    os.environ["AMADEUS_RATE_LIMIT_PER_SECOND"] = "0"
+    os.environ["CHECKPOINT_DB"] = os.path.join(work_directory, "checkpoints.db")
+    os.environ["TRAVEL_PLANNER_CACHE_DB"] = os.path.join(work_directory, "cache.db")
+    os.environ["CHECKPOINT_MAINTENANCE_INTERVAL_SECONDS"] = "86400"
+    if not args.warm_cache:
+        for variable_name in (
+            "FLIGHT_CACHE_TTL_SECONDS", "HOTEL_CACHE_TTL_SECONDS", "RESULT_CACHE_STALE_SECONDS", "PRICE_HISTORY_FRESH_SECONDS"
+        ):
+            os.environ[variable_name] = "0"
+
+
+def build_trip_requests(planner, count, same_route=False):
+    first_day = date.today() + timedelta(days=30)
+    trip_requests = []
+    for request_index in range(count):
+        if same_route:
+            trip_requests.append(planner.build_trip_inputs(
+                "New York", "Paris", "USD", 3000, 2, first_day.isoformat(), (first_day + timedelta(days=4)).isoformat()
+            ))
+            continue
+        origin = BENCHMARK_CITIES[request_index % len(BENCHMARK_CITIES)]
+        destination = BENCHMARK_CITIES[(request_index * 7 + 3) % len(BENCHMARK_CITIES)]
+        if destination == origin:
+            destination = BENCHMARK_CITIES[(request_index + 1) % len(BENCHMARK_CITIES)]
+        arrival_day = first_day + timedelta(days=request_index)
+        return_day = arrival_day + timedelta(days=3 + request_index % 5)
+        trip_requests.append(planner.build_trip_inputs(
+            origin, destination, "USD", 3000, 2, arrival_day.isoformat(), return_day.isoformat()
+        ))
+    return trip_requests
+
+
+class CheckpointTimer:
+    """Times every put/put_writes the saver performs"""
+
+    def __init__(self, saver):
+        self.durations = []
+        self._lock = threading.Lock()
+        for method_name in ("put", "put_writes"):
+            setattr(saver, method_name, self._timed(getattr(saver, method_name)))
+
+    def _timed(self, method):
+        def timed_method(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.durations.append(time.perf_counter() - started_at)
+        return timed_method
+
+    def take(self):
+        with self._lock:
+            durations, self.durations = self.durations, []
+        return durations
+
+
+def run_one_request(planner_app, checkpoint_retention, trip_inputs):
+    """Stream one request and return (end-to-end seconds, [(node name, seconds)], outcome)
+
+    outcome is "error" when a node raised, "empty" when the search finished
+    without flights or hotels (upstream failures end up here), else "ok".
+    """
+    thread_id = f"bench-{uuid.uuid4()}"
+    config = {"configurable": {"thread_id": thread_id}}
+    task_started_at = {}
+    node_durations = []
+    failed = False
+    final_state = {}
+
+    started_at = time.perf_counter()
+    for namespace, stream_mode, task_event in planner_app.stream(
+        trip_inputs, config, stream_mode=["tasks", "values"], subgraphs=True
+    ):
+        now = time.perf_counter()
+        if stream_mode == "values":
+            if not namespace:
+                final_state = task_event
+            continue
+        if "input" in task_event:
+            task_started_at[task_event["id"]] = now
+            continue
+        node_name = task_event["name"]
+        if namespace:
+            node_name = f"{namespace[-1].split(':')[0]}/{node_name}"
+        node_durations.append((node_name, now - task_started_at.pop(task_event["id"], now)))
+        failed = failed or task_event.get("error") is not None
+    elapsed_seconds = time.perf_counter() - started_at
+
+    if planner_app.checkpointer and checkpoint_retention == "final":
+        planner_app.checkpointer.prune([thread_id], strategy="keep_final")
+
+    if failed:
+        outcome = "error"
+    elif not final_state.get("flight_options") or not final_state.get("hotel_options"):
+        outcome = "empty"
+    else:
+        outcome = "ok"
+    return elapsed_seconds, node_durations, outcome
+
+
+def percentiles_ms(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return {"p50": round(float(p50), 1), "p95": round(float(p95), 1), "p99": round(float(p99), 1)}
+
+
+def run_level(planner_app, checkpoint_retention, checkpoint_timer, trip_requests, concurrency):
+    if checkpoint_timer is not None:
+        checkpoint_timer.take()
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda trip_inputs: run_one_request(planner_app, checkpoint_retention, trip_inputs), trip_requests
+        ))
+    wall_seconds = time.perf_counter() - started_at
+
+    durations_by_node = defaultdict(list)
+    for _, node_durations, _ in results:
+        for node_name, node_seconds in node_durations:
+            durations_by_node[node_name].append(node_seconds)
+
+    report = {
+        "checkpoints": checkpoint_retention,
+        "concurrency": concurrency,
+        "requests": len(trip_requests),
+        "failed_requests": sum(1 for _, _, outcome in results if outcome == "error"),
+        "empty_results": sum(1 for _, _, outcome in results if outcome == "empty"),
+        "throughput_rps": round(len(trip_requests) / wall_seconds, 2),
+        "latency_ms": percentiles_ms([elapsed for elapsed, _, _ in results]),
+        "nodes": {node_name: percentiles_ms(durations) for node_name, durations in sorted(durations_by_node.items())},
+    }
+
+    if checkpoint_timer is not None:
+        write_durations = checkpoint_timer.take()
+        report["checkpoint"] = {
+            "writes": len(write_durations),
+            "total_ms": round(sum(write_durations) * 1000, 1),
+            "per_request_ms": round(sum(write_durations) * 1000 / len(trip_requests), 2),
+            "write_ms": percentiles_ms(write_durations),
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=40, help="requests per concurrency level")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--checkpoints", default="ephemeral,final,all", help="comma-separated retention modes to compare")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="injected error rate on every stand-in endpoint")
+    parser.add_argument("--warm-cache", action="store_true", help="keep the flight/hotel result caches enabled")
+    parser.add_argument("--same-route", action="store_true", help="send every request for the same route and dates")
+    args = parser.parse_args(argv)
+
+    work_directory = tempfile.mkdtemp(prefix="planner-bench-")
+    configure_environment(args, work_directory)
+
+    import travel_planner_engine as planner
+
+    concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+    for checkpoint_retention in args.checkpoints.split(","):
+        planner_app = planner.build_workflow(checkpoint_retention)
+        checkpoint_timer = CheckpointTimer(planner_app.checkpointer) if planner_app.checkpointer else None
+
+        for concurrency in concurrency_levels:
+            trip_requests = build_trip_requests(planner, args.requests, args.same_route)
+            report = run_level(planner_app, checkpoint_retention, checkpoint_timer, trip_requests, concurrency)
+            print(json.dumps(report), flush=True)
+
+    print(json.dumps({"standin_calls": planner.get_amadeus_client().stats()}))
+    print(json.dumps({"coalescing": planner.get_request_coalescer().stats()}))
+    print(json.dumps({"upstream_outcomes": planner.get_upstream_guard().stats()}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+"""Background cache warming for the routes and dates searched most.
+
+Every validated trip search logs one row per flight leg and hotel stay in
+search_demand (see travel_planner_engine.record_search_demand). Each
+round, the warmer ranks the most searched future queries of the last few
+days and adds the trips of an optional seed file. Within the warming
+hours it then fetches ahead of the users:
+
+- the IATA codes of their cities,
+- the FX table of their currency,
+- their flight and hotel offers, which land in the price history that
+  every process reads.
+
+The warmer's upstream calls are paced by its own budget, on top of the
+shared Amadeus rate limit, and capped per round. Each warming step is
+logged in warm_log with the upstream calls it made. A search that arrives
+while its warmed offers are still fresh counts as a warm hit. stats()
+reports the warm-hit rate and the upstream calls spent per warm hit.
+
+The seed file is JSONL in batch_planner's format: origin, destination,
+arrival_date and return_date, with optional currency, hotel_search_mode
+and flight_search_mode. A line can give days_ahead and nights instead of dates
+to describe a rolling window. Lines without origin and destination are
+ignored, so a backlog file can be passed as it is.
+
+    python cache_warmer.py --once --seed popular_trips.jsonl
+    python cache_warmer.py --daemon --hours 5-7 --calls-per-minute 30
+    python cache_warmer.py --report
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from rate_limit import TokenBucket
+from tracing import current_trace_id
+
+
+DEFAULT_CACHE_DATABASE = os.environ.get("TRAVEL_PLANNER_CACHE_DB", "travel_planner_cache.db")
+
+
+def parse_hour_windows(hour_windows_text):
+    """[(start hour, end hour)] from text like "22-24,0-6"; "22-6" wraps past midnight, "" means any hour"""
+    hour_windows = []
+    for window_text in str(hour_windows_text or "").split(","):
+        if not window_text.strip():
+            continue
+        start_hour, _, end_hour = window_text.partition("-")
+        hour_windows.append((int(start_hour), int(end_hour or int(start_hour) + 1)))
+    return hour_windows
+
+
+def is_within_hours(hour_windows, hour):
+    if not hour_windows:
+        return True
+    return any(
+        start_hour <= hour < end_hour if start_hour <= end_hour else (hour >= start_hour or hour < end_hour)
+        for start_hour, end_hour in hour_windows
+    )
+
+
+def search_travel_date(search_params):
+    return search_params.get("date") or search_params.get("checkin_date")
+
+
+def read_seed_trips(seed_path, today=None):
+    """Trip dicts (origin, destination, dates, currency and search modes) from a JSONL seed file"""
+    today = today or date.today()
+    seed_trips = []
+    try:
+        seed_file = open(seed_path, encoding="utf-8")
+    except OSError:
+        return seed_trips
+
+    with seed_file:
+        for line in seed_file:
+            try:
+                seed_line = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(seed_line, dict) or not seed_line.get("origin") or not seed_line.get("destination"):
+                continue
+
+            arrival_date, return_date = seed_line.get("arrival_date"), seed_line.get("return_date")
+            if "days_ahead" in seed_line:
+                arrival_day = today + timedelta(days=int(seed_line["days_ahead"]))
+                arrival_date = arrival_day.isoformat()
+                return_date = (arrival_day + timedelta(days=int(seed_line.get("nights", 3)))).isoformat()
+            if not arrival_date or not return_date:
+                continue
+
+            seed_trips.append({
+                "origin": seed_line["origin"],
+                "destination": seed_line["destination"],
+                "arrival_date": arrival_date,
+                "return_date": return_date,
+                "currency": seed_line.get("currency", "USD"),
+                "hotel_search_mode": seed_line.get("hotel_search_mode", ""),
+                "flight_search_mode": seed_line.get("flight_search_mode", ""),
+            })
+    return seed_trips
+
+
+class SearchDemandLog:
+    """What users searched (search_demand) and what the warmer fetched for them (warm_log)"""
+
+    def __init__(self, database_path=DEFAULT_CACHE_DATABASE):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS search_demand ("
+            "query_key TEXT NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "params_json TEXT NOT NULL, "
+            "travel_date TEXT, "
+            "searched_at REAL NOT NULL, "
+            "warm_hit INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS search_demand_time ON search_demand (searched_at);"
+            "CREATE TABLE IF NOT EXISTS warm_log ("
+            "query_key TEXT NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "warmed_at REAL NOT NULL, "
+            "upstream_calls INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS warm_log_query ON warm_log (query_key, warmed_at);"
+        )
+        self._connection.commit()
+
+    def record_searches(self, trip_searches, fresh_seconds):
+        """Log [(kind, query key, params)] searched now
+
+        A search is a warm hit when the warmer fetched its query upstream
+        less than fresh_seconds ago, so its offers were still fresh.
+        """
+        searched_at = time.time()
+        with self._lock:
+            demand_rows = []
+            for kind, query_key, search_params in trip_searches:
+                warm_row = self._connection.execute(
+                    "SELECT 1 FROM warm_log WHERE query_key = ? AND warmed_at > ? AND upstream_calls > 0 LIMIT 1",
+                    (query_key, searched_at - fresh_seconds),
+                ).fetchone()
+                demand_rows.append((
+                    query_key, kind, json.dumps(search_params), search_travel_date(search_params), searched_at, int(warm_row is not None)
+                ))
+            self._connection.executemany(
+                "INSERT INTO search_demand (query_key, kind, params_json, travel_date, searched_at, warm_hit) VALUES (?, ?, ?, ?, ?, ?)",
+                demand_rows,
+            )
+            self._connection.commit()
+
+    def record_warm(self, kind, query_key, upstream_calls):
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO warm_log (query_key, kind, warmed_at, upstream_calls) VALUES (?, ?, ?, ?)",
+                (query_key, kind, time.time(), upstream_calls),
+            )
+            self._connection.commit()
+
+    def top_searches(self, since_seconds, limit, today=None):
+        """[(kind, query key, params, searches)] searched in the last since_seconds, for today or later, most searched first"""
+        today = (today or date.today()).isoformat()
+        with self._lock:
+            demand_rows = self._connection.execute(
+                "SELECT kind, query_key, params_json, COUNT(*) AS searches FROM search_demand "
+                "WHERE searched_at >= ? AND travel_date >= ? "
+                "GROUP BY query_key ORDER BY searches DESC, MAX(searched_at) DESC LIMIT ?",
+                (time.time() - since_seconds, today, limit),
+            ).fetchall()
+        return [(kind, query_key, json.loads(params_json), searches) for kind, query_key, params_json, searches in demand_rows]
+
+    def stats(self, since_seconds=None):
+        since_timestamp = time.time() - since_seconds if since_seconds else 0
+        with self._lock:
+            searches, warm_hits = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(warm_hit), 0) FROM search_demand WHERE searched_at >= ?", (since_timestamp,)
+            ).fetchone()
+            warm_steps, warm_upstream_calls = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(upstream_calls), 0) FROM warm_log WHERE warmed_at >= ?", (since_timestamp,)
+            ).fetchone()
+        return {
+            "searches": searches,
+            "warm_hits": warm_hits,
+            "warm_hit_rate": warm_hits / searches if searches else 0.0,
+            "warm_steps": warm_steps,
+            "warm_upstream_calls": warm_upstream_calls,
+            "upstream_calls_per_warm_hit": round(warm_upstream_calls / warm_hits, 2) if warm_hits else None,
+        }
+
+
+class CacheWarmer:
+    """Fetches the most searched queries ahead of the users, within warming hours and a call budget
+
+    planner is the travel_planner_engine module; it is passed in, as in
+    batch_planner, so this module can be imported by the engine itself.
+    """
+
+    def __init__(
+        self,
+        planner,
+        demand_log,
+        seed_path=None,
+        top_searches=50,
+        lookback_days=7,
+        calls_per_minute=30.0,
+        max_calls_per_round=300,
+        hour_windows=(),
+        interval_seconds=600,
+    ):
+        self.planner = planner
+        self.demand_log = demand_log
+        self.seed_path = seed_path
+        self.top_searches = top_searches
+        self.lookback_days = lookback_days
+        self.max_calls_per_round = max_calls_per_round
+        self.hour_windows = list(hour_windows)
+        self.interval_seconds = interval_seconds
+        self.budget = TokenBucket(calls_per_minute / 60.0) if calls_per_minute > 0 else None
+
+        self.rounds = 0
+        self.last_round = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def plan_round(self, today=None):
+        """[(kind, query key, params)] to warm: the most searched queries, then the seed file's trips"""
+        planned_searches = [
+            (kind, query_key, search_params)
+            for kind, query_key, search_params, _ in self.demand_log.top_searches(self.lookback_days * 86400, self.top_searches, today)
+        ]
+        for seed_trip in read_seed_trips(self.seed_path, today) if self.seed_path else []:
+            trip_state = self.planner.build_trip_inputs(
+                seed_trip["origin"], seed_trip["destination"], seed_trip["currency"], "", 1,
+                seed_trip["arrival_date"], seed_trip["return_date"], seed_trip["hotel_search_mode"], seed_trip["flight_search_mode"]
+            )
+            planned_searches += self.planner.list_trip_searches(trip_state)
+
+        today_text = (today or date.today()).isoformat()
+        seen_keys = set()
+        unique_searches = []
+        for kind, query_key, search_params in planned_searches:
+            if query_key in seen_keys or search_travel_date(search_params) < today_text:
+                continue
+            seen_keys.add(query_key)
+            unique_searches.append((kind, query_key, search_params))
+        return unique_searches
+
+    def list_warm_steps(self, planned_searches):
+        """[(kind, key, function)]: city codes first, then FX tables, then the offer searches"""
+        location_texts = {}
+        currencies = {}
+        for kind, _, search_params in planned_searches:
+            for field_name in ("origin", "destination", "location"):
+                if search_params.get(field_name):
+                    location_texts.setdefault(search_params[field_name], None)
+            currencies.setdefault(search_params.get("currency", "USD"), None)
+
+        warm_steps = [
+            ("iata", f"iata:{location_text}", lambda location_text=location_text: self.planner.resolve_location_code(location_text))
+            for location_text in location_texts
+        ]
+        warm_steps += [
+            ("fx", f"fx:{currency}", lambda currency=currency: self.planner.get_fx_rate_table().prefetch(currency))
+            for currency in currencies
+        ]
+        for kind, query_key, search_params in planned_searches:
+            search_function = self.planner.find_flights if kind == "flight" else self.planner.find_hotels
+            warm_steps.append((kind, query_key, lambda search_function=search_function, search_params=search_params: search_function(**search_params)))
+        return warm_steps
+
+    def count_upstream_calls(self, warm_function):
+        """Run warm_function under a trace id of its own and count the upstream spans it produced"""
+        trace_id = f"warm-{uuid.uuid4().hex}"
+        trace_token = current_trace_id.set(trace_id)
+        try:
+            warm_function()
+        finally:
+            current_trace_id.reset(trace_token)
+        return sum(1 for span_record in self.planner.get_tracer().get_trace(trace_id) if span_record["kind"] == "upstream")
+
+    def run_round(self, today=None):
+        """Warm one round within the per-round call cap; returns the round's counters
+
+        Steps that needed no upstream call were already warm and are not
+        logged. The budget is paid after each step with the calls it made,
+        so the next step waits until the average rate is back under it.
+        """
+        round_counts = {"planned": 0, "warmed": 0, "already_warm": 0, "failed": 0, "over_budget": 0, "upstream_calls": 0}
+        warm_steps = self.list_warm_steps(self.plan_round(today))
+        round_counts["planned"] = len(warm_steps)
+
+        for step_index, (kind, step_key, warm_function) in enumerate(warm_steps):
+            if self._stop.is_set():
+                break
+            if round_counts["upstream_calls"] >= self.max_calls_per_round:
+                round_counts["over_budget"] = len(warm_steps) - step_index
+                break
+            if self.budget is not None:
+                self.budget.acquire(0)
+
+            try:
+                upstream_calls = self.count_upstream_calls(warm_function)
+            except Exception:
+                round_counts["failed"] += 1
+                continue
+            if self.budget is not None:
+                self.budget.charge(upstream_calls)
+
+            round_counts["upstream_calls"] += upstream_calls
+            if upstream_calls:
+                round_counts["warmed"] += 1
+                self.demand_log.record_warm(kind, step_key, upstream_calls)
+            else:
+                round_counts["already_warm"] += 1
+
+        with self._lock:
+            self.rounds += 1
+            self.last_round = {**round_counts, "finished_at": time.time()}
+        return round_counts
+
+    def start(self):
+        """Run a round every interval_seconds within the warming hours, on a daemon thread; idempotent"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_forever, name="cache-warmer", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        warmer_stats = self.demand_log.stats(self.lookback_days * 86400)
+        with self._lock:
+            warmer_stats["rounds"] = self.rounds
+            warmer_stats["last_round"] = dict(self.last_round) if self.last_round else None
+        return warmer_stats
+
+    def _run_forever(self):
+        while not self._stop.is_set():
+            if is_within_hours(self.hour_windows, datetime.now().hour):
+                try:
+                    self.run_round()
+                except Exception as error:
+                    with self._lock:
+                        self.last_round = {"error": f"{type(error).__name__}: {error}", "finished_at": time.time()}
+            self._stop.wait(self.interval_seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--once", action="store_true", help="warm one round now, whatever the hour, and exit")
+    parser.add_argument("--daemon", action="store_true", help="keep warming every --interval-seconds within --hours")
+    parser.add_argument("--report", action="store_true", help="print warm-hit statistics and exit")
+    parser.add_argument("--seed", default=None, help="JSONL file of trips to warm besides the most searched ones")
+    parser.add_argument("--hours", default=None, help='local warming hours, e.g. "5-7" or "22-24,0-6" (default CACHE_WARMER_HOURS)')
+    parser.add_argument("--calls-per-minute", type=float, default=None, help="average upstream calls per minute spent on warming")
+    parser.add_argument("--max-calls-per-round", type=int, default=None, help="stop a round after this many upstream calls")
+    parser.add_argument("--top", type=int, default=None, help="warm this many of the most searched queries")
+    parser.add_argument("--interval-seconds", type=float, default=None, help="seconds between rounds with --daemon")
+    args = parser.parse_args(argv)
+
+    # Imported here so --help works without loading the planner.
+    import travel_planner_engine as planner
+
+    cache_warmer = CacheWarmer(
+        planner,
+        planner.get_search_demand_log(),
+        seed_path=args.seed or planner.CACHE_WARMER_SEED_PATH,
+        top_searches=args.top or planner.CACHE_WARMER_TOP_SEARCHES,
+        lookback_days=planner.CACHE_WARMER_LOOKBACK_DAYS,
+        calls_per_minute=planner.CACHE_WARMER_CALLS_PER_MINUTE if args.calls_per_minute is None else args.calls_per_minute,
+        max_calls_per_round=args.max_calls_per_round or planner.CACHE_WARMER_MAX_CALLS_PER_ROUND,
+        hour_windows=parse_hour_windows(planner.CACHE_WARMER_HOURS if args.hours is None else args.hours),
+        interval_seconds=args.interval_seconds or planner.CACHE_WARMER_INTERVAL_SECONDS,
+    )
+
+    if args.once:
+        print(json.dumps({"round": cache_warmer.run_round()}))
+    elif args.daemon:
+        cache_warmer.start()
+        try:
+            while cache_warmer.is_running():
+                time.sleep(60)
+                print(json.dumps({"warmer": cache_warmer.stats()}), flush=True)
+        except KeyboardInterrupt:
+            cache_warmer.stop()
+    print(json.dumps({"warmer": cache_warmer.stats()}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
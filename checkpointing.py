@@ -0,0 +1,326 @@
+"""Checkpoint savers, serializer and retention for the travel planner workflow."""
+import asyncio
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import ormsgpack
+from langgraph.checkpoint.serde import jsonplus
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from offer_records import CHECKPOINT_ALLOWED_TYPES, FlightOption, HotelOption, offer_from_tuple, offer_to_tuple
+
+
+# Offset between the UUID epoch (1582-10-15) and the Unix epoch, in 100ns ticks.
+UUID_EPOCH_OFFSET_TICKS = 0x01B21DD213814000
+
+
+def checkpoint_id_for_time(unix_seconds):
+    """Smallest checkpoint id written at unix_seconds.
+
+    LangGraph checkpoint ids are UUIDv6, whose text form sorts by creation
+    time, so comparing ids against this string filters checkpoints by age.
+    """
+    ticks = int(unix_seconds * 10_000_000) + UUID_EPOCH_OFFSET_TICKS
+    time_high = (ticks >> 28) & 0xFFFFFFFF
+    time_mid = (ticks >> 12) & 0xFFFF
+    time_low = ticks & 0x0FFF
+    return f"{time_high:08x}-{time_mid:04x}-6{time_low:03x}-0000-000000000000"
+
+
+# msgpack ext codes for offer records; langgraph's own codes start at 0.
+OFFER_EXT_CODES = {FlightOption: 64, HotelOption: 65}
+OFFER_CLASSES_BY_EXT_CODE = {ext_code: offer_class for offer_class, ext_code in OFFER_EXT_CODES.items()}
+
+# JsonPlusSerializer's msgpack encoder hooks are private to langgraph-checkpoint
+# (pinned in requirements.txt). If a release drops them, offers are written
+# the stock way instead of failing.
+LANGGRAPH_MSGPACK_DEFAULT = getattr(jsonplus, "_msgpack_default", None)
+LANGGRAPH_MSGPACK_OPTION = getattr(jsonplus, "_option", None)
+COMPACT_OFFERS_SUPPORTED = LANGGRAPH_MSGPACK_DEFAULT is not None and LANGGRAPH_MSGPACK_OPTION is not None
+
+
+def pack_offer_or_default(value):
+    ext_code = OFFER_EXT_CODES.get(type(value))
+    if ext_code is None:
+        return LANGGRAPH_MSGPACK_DEFAULT(value)
+    return ormsgpack.Ext(ext_code, ormsgpack.packb(offer_to_tuple(value)))
+
+
+class OfferRecordSerializer(JsonPlusSerializer):
+    """JsonPlusSerializer that checkpoints FlightOption/HotelOption as bare field tuples.
+
+    The stock serializer writes every dataclass as (module, class,
+    {field: value}), which repeats each field name per offer and rebuilds
+    the record through an allowlist lookup on load. Offers here are a
+    msgpack ext value holding only the field values. Checkpoints written
+    the old way still load through the allowlist.
+
+    The encoding reuses langgraph's private msgpack hooks; without them
+    every checkpoint is written by the stock serializer.
+    """
+
+    def __init__(self):
+        super().__init__(allowed_msgpack_modules=CHECKPOINT_ALLOWED_TYPES)
+
+    def dumps_typed(self, obj):
+        if not COMPACT_OFFERS_SUPPORTED or obj is None or isinstance(obj, (bytes, bytearray)):
+            return super().dumps_typed(obj)
+        try:
+            return "msgpack", ormsgpack.packb(obj, default=pack_offer_or_default, option=LANGGRAPH_MSGPACK_OPTION)
+        except ormsgpack.MsgpackEncodeError:
+            return super().dumps_typed(obj)
+
+    def loads_typed(self, data):
+        type_name, payload = data
+        if type_name != "msgpack":
+            return super().loads_typed(data)
+        return ormsgpack.unpackb(payload, ext_hook=self._unpack_offer_ext, option=ormsgpack.OPT_NON_STR_KEYS)
+
+    def _unpack_offer_ext(self, ext_code, ext_payload):
+        offer_class = OFFER_CLASSES_BY_EXT_CODE.get(ext_code)
+        if offer_class is None:
+            return self._unpack_ext_hook(ext_code, ext_payload)
+        return offer_from_tuple(offer_class, ormsgpack.unpackb(ext_payload))
+
+
+class ThreadedSqliteSaver(SqliteSaver):
+    """SqliteSaver that also serves the async checkpoint API.
+
+    SqliteSaver only implements the sync methods, so a graph compiled with
+    it cannot be run with ainvoke/astream. The async methods here run the
+    sync ones in a worker thread, which keeps the event loop free while
+    SQLite writes and lets sync and async callers share one database.
+    """
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        checkpoint_tuples = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    async def aprune(self, thread_ids, *, strategy="keep_latest"):
+        return await asyncio.to_thread(self.prune, thread_ids, strategy=strategy)
+
+
+class PooledSqliteSaver(ThreadedSqliteSaver):
+    """Checkpoint saver with one WAL-mode SQLite connection per thread.
+
+    SqliteSaver funnels every read and write through one connection behind
+    one lock. Here each thread lazily opens its own connection, so
+    concurrent searches only contend inside SQLite itself, where WAL lets
+    readers proceed alongside the single writer.
+    """
+
+    def __init__(self, database_path, *, serde=None, busy_timeout_ms=5000):
+        self.database_path = database_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._thread_connections = threading.local()
+        super().__init__(self._open_connection(), serde=serde)
+
+    @property
+    def conn(self):
+        connection = getattr(self._thread_connections, "connection", None)
+        if connection is None:
+            connection = self._open_connection()
+            self._thread_connections.connection = connection
+        return connection
+
+    @conn.setter
+    def conn(self, connection):
+        self._thread_connections.connection = connection
+
+    def _open_connection(self):
+        connection = sqlite3.connect(
+            self.database_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return connection
+
+    def setup(self):
+        if self.is_setup:
+            return
+        with self.lock:
+            super().setup()
+
+    @contextmanager
+    def cursor(self, transaction=True):
+        self.setup()
+        connection = self.conn
+        cursor = connection.cursor()
+        try:
+            yield cursor
+        finally:
+            if transaction:
+                connection.commit()
+            cursor.close()
+
+    def prune(self, thread_ids, *, strategy="keep_latest"):
+        """Drop old checkpoints for thread_ids.
+
+        "keep_latest" keeps the newest checkpoint of every namespace,
+        "keep_final" keeps only the newest root checkpoint (sub-graph
+        namespaces of finished runs are dropped too), and "delete" removes
+        the threads entirely. The planner graph has no DeltaChannel state,
+        so no ancestor checkpoints need to survive.
+        """
+        if strategy not in ("keep_latest", "keep_final", "delete"):
+            raise ValueError(f"Unknown prune strategy: {strategy!r}")
+
+        with self.cursor() as cursor:
+            for thread_id in thread_ids:
+                thread_id = str(thread_id)
+
+                if strategy == "delete":
+                    cursor.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                    cursor.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                    continue
+
+                if strategy == "keep_final":
+                    latest_row = cursor.execute(
+                        "SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ''",
+                        (thread_id,),
+                    ).fetchone()
+                    if latest_row is None or latest_row[0] is None:
+                        continue
+                    for table_name in ("checkpoints", "writes"):
+                        cursor.execute(
+                            f"DELETE FROM {table_name} WHERE thread_id = ? "
+                            "AND NOT (checkpoint_ns = '' AND checkpoint_id = ?)",
+                            (thread_id, latest_row[0]),
+                        )
+                    continue
+
+                for table_name in ("checkpoints", "writes"):
+                    cursor.execute(
+                        f"DELETE FROM {table_name} WHERE thread_id = ? "
+                        "AND (checkpoint_ns, checkpoint_id) NOT IN ("
+                        "SELECT checkpoint_ns, MAX(checkpoint_id) FROM checkpoints "
+                        "WHERE thread_id = ? GROUP BY checkpoint_ns)",
+                        (thread_id, thread_id),
+                    )
+
+    def list_threads_with_history(self, min_idle_seconds=600):
+        """Idle thread ids that hold more than their final root checkpoint.
+
+        Threads written to within min_idle_seconds may still be running and
+        are left alone.
+        """
+        cutoff_id = checkpoint_id_for_time(time.time() - min_idle_seconds)
+        with self.cursor(transaction=False) as cursor:
+            rows = cursor.execute(
+                "SELECT thread_id FROM checkpoints GROUP BY thread_id "
+                "HAVING (COUNT(*) > 1 OR SUM(checkpoint_ns != '') > 0) AND MAX(checkpoint_id) < ?",
+                (cutoff_id,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def expire_threads(self, max_age_seconds):
+        """Delete threads whose newest checkpoint is older than max_age_seconds."""
+        cutoff_id = checkpoint_id_for_time(time.time() - max_age_seconds)
+        with self.cursor(transaction=False) as cursor:
+            expired_thread_ids = [
+                row[0] for row in cursor.execute(
+                    "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(checkpoint_id) < ?",
+                    (cutoff_id,),
+                ).fetchall()
+            ]
+        if expired_thread_ids:
+            self.prune(expired_thread_ids, strategy="delete")
+        return len(expired_thread_ids)
+
+    def compact(self, vacuum_free_fraction=0.25):
+        """Fold the WAL back into the database file; VACUUM only when it is mostly free pages.
+
+        VACUUM rewrites the whole file under an exclusive lock, so it only
+        runs once free pages exceed vacuum_free_fraction of the file
+        (None never vacuums). Returns True when a VACUUM ran.
+        """
+        self.setup()
+        connection = sqlite3.connect(self.database_path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+        try:
+            connection.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            if vacuum_free_fraction is None:
+                return False
+            free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+            total_pages = connection.execute("PRAGMA page_count").fetchone()[0]
+            if total_pages == 0 or free_pages <= total_pages * vacuum_free_fraction:
+                return False
+            connection.execute("VACUUM")
+            return True
+        finally:
+            connection.close()
+
+
+class CheckpointMaintenance:
+    """Background sweep that applies checkpoint retention and compacts the database."""
+
+    def __init__(self, saver, retention="final", max_age_days=7, interval_seconds=3600, vacuum_free_fraction=0.25):
+        self.saver = saver
+        self.retention = retention
+        self.vacuum_free_fraction = vacuum_free_fraction
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.interval_seconds = interval_seconds
+        self.last_report = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        report = {"expired_threads": 0, "pruned_threads": 0, "compacted": False, "vacuumed": False}
+
+        if self.max_age_seconds > 0:
+            report["expired_threads"] = self.saver.expire_threads(self.max_age_seconds)
+
+        if self.retention == "final":
+            threads_to_prune = self.saver.list_threads_with_history()
+            if threads_to_prune:
+                self.saver.prune(threads_to_prune, strategy="keep_final")
+            report["pruned_threads"] = len(threads_to_prune)
+
+        try:
+            report["vacuumed"] = self.saver.compact(self.vacuum_free_fraction)
+            report["compacted"] = True
+        except sqlite3.OperationalError:
+            # Another connection held the database; the next sweep retries.
+            pass
+
+        report["finished_at"] = time.time()
+        self.last_report = report
+        return report
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._run_forever, name="checkpoint-maintenance", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run_forever(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                pass
+            if self._stop_event.wait(self.interval_seconds):
+                return
@@ -0,0 +1,240 @@
+"""Daily foreign-exchange rate tables.
+
+One rate table is fetched from the Frankfurter API per base currency per
+day and kept both in memory and in SQLite. Prices are converted locally
+against that table, so a result set costs at most one HTTP request no
+matter how many offers it contains.
+
+Conversion never waits on the network: if today's table is not cached
+yet, the newest table on disk (or the bundled fallback file) is used
+while a background thread fetches today's rates.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import is_dataclass, replace
+from datetime import date
+
+import requests
+
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+FALLBACK_RATES_PATH = os.path.join(PROJECT_DIRECTORY, "data", "fx_fallback_rates.json")
+DEFAULT_CACHE_DATABASE = os.environ.get("TRAVEL_PLANNER_CACHE_DB", "travel_planner_cache.db")
+FRANKFURTER_URL = "https://api.frankfurter.app/latest"
+
+
+def fetch_rates_from_frankfurter(base_currency, timeout=5):
+    response = requests.get(FRANKFURTER_URL, params={"from": base_currency}, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+    rates = {code.upper(): float(rate) for code, rate in data.get("rates", {}).items()}
+    rates[base_currency] = 1.0
+    return rates
+
+
+def load_fallback_rates(fallback_path=FALLBACK_RATES_PATH):
+    try:
+        with open(fallback_path, encoding="utf-8") as fallback_file:
+            fallback_data = json.load(fallback_file)
+    except (OSError, ValueError):
+        return None, {}
+
+    base_currency = fallback_data.get("base", "EUR").upper()
+    rates = {code.upper(): float(rate) for code, rate in fallback_data.get("rates", {}).items()}
+    rates[base_currency] = 1.0
+    return base_currency, rates
+
+
+def rebase_rates(rates, old_base, new_base):
+    """Re-express a rate table quoted against old_base as one against new_base."""
+    if old_base == new_base:
+        return dict(rates)
+    if new_base not in rates:
+        return {}
+    new_base_rate = rates[new_base]
+    return {code: rate / new_base_rate for code, rate in rates.items()}
+
+
+class FxRateTable:
+    def __init__(
+        self,
+        database_path=DEFAULT_CACHE_DATABASE,
+        fallback_path=FALLBACK_RATES_PATH,
+        fetch_function=fetch_rates_from_frankfurter,
+        retry_after_failure_seconds=15 * 60,
+    ):
+        self.fetch_function = fetch_function
+        self.retry_after_failure_seconds = retry_after_failure_seconds
+        self.fallback_base, self.fallback_rates = load_fallback_rates(fallback_path)
+
+        self._memory = {}
+        self._refreshing = set()
+        self._last_failure = {}
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "stale_hits": 0, "fallback_hits": 0, "fetches": 0, "fetch_errors": 0}
+
+        self._connection = None
+        if database_path:
+            self._connection = sqlite3.connect(database_path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS fx_rates ("
+                "base_currency TEXT NOT NULL, "
+                "rate_date TEXT NOT NULL, "
+                "rates_json TEXT NOT NULL, "
+                "fetched_at REAL NOT NULL, "
+                "PRIMARY KEY (base_currency, rate_date))"
+            )
+            self._connection.commit()
+
+    def get_rates(self, base_currency, blocking=False):
+        """Return {currency: units per 1 base_currency} for today.
+
+        With blocking=False a missing table is served from the newest
+        stale copy or the fallback file while today's rates are fetched in
+        the background. With blocking=True the fetch happens inline.
+        """
+        base_currency = base_currency.upper()
+        today = date.today().isoformat()
+
+        with self._lock:
+            cached_rates = self._memory.get((base_currency, today))
+        if cached_rates is not None:
+            self._count("memory_hits")
+            return cached_rates
+
+        disk_date, disk_rates = self._read_disk(base_currency)
+        if disk_date == today:
+            with self._lock:
+                self._memory[(base_currency, today)] = disk_rates
+            self._count("disk_hits")
+            return disk_rates
+
+        if blocking:
+            fresh_rates = self._refresh(base_currency)
+            if fresh_rates:
+                return fresh_rates
+        else:
+            self._refresh_in_background(base_currency)
+
+        if disk_rates:
+            self._count("stale_hits")
+            return disk_rates
+
+        self._count("fallback_hits")
+        return rebase_rates(self.fallback_rates, self.fallback_base, base_currency)
+
+    def prefetch(self, base_currency):
+        return self.get_rates(base_currency, blocking=True)
+
+    def convert(self, amount, from_currency, to_currency):
+        if amount is None or from_currency == to_currency:
+            return amount
+
+        rates = self.get_rates(to_currency)
+        source_rate = rates.get(from_currency.upper())
+        if not source_rate:
+            return amount
+        return amount / source_rate
+
+    def convert_items(self, items, to_currency, price_key="price", currency_key="currency"):
+        """Convert every item's price into to_currency using one rate table.
+
+        Dicts are updated in place; frozen dataclass records are replaced by
+        converted copies. Returns the converted list either way.
+        """
+        rates = None
+        converted_items = []
+
+        for item in items:
+            is_record = is_dataclass(item)
+            item_currency = getattr(item, currency_key) if is_record else item.get(currency_key)
+            item_price = getattr(item, price_key) if is_record else item.get(price_key)
+            converted_fields = {currency_key: to_currency}
+
+            if item_price is not None and item_currency and item_currency != to_currency:
+                if rates is None:
+                    rates = self.get_rates(to_currency)
+
+                source_rate = rates.get(item_currency.upper())
+                if source_rate:
+                    converted_fields[price_key] = item_price / source_rate
+                else:
+                    converted_fields = {}
+
+            if is_record:
+                converted_items.append(replace(item, **converted_fields) if converted_fields else item)
+            else:
+                item.update(converted_fields)
+                converted_items.append(item)
+
+        return converted_items
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def _count(self, counter_name):
+        with self._lock:
+            self._counters[counter_name] += 1
+
+    def _refresh_in_background(self, base_currency):
+        with self._lock:
+            if base_currency in self._refreshing:
+                return
+            last_failure = self._last_failure.get(base_currency, 0)
+            if time.time() - last_failure < self.retry_after_failure_seconds:
+                return
+            self._refreshing.add(base_currency)
+
+        def refresh_and_release():
+            try:
+                self._refresh(base_currency)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(base_currency)
+
+        threading.Thread(target=refresh_and_release, daemon=True).start()
+
+    def _refresh(self, base_currency):
+        self._count("fetches")
+        try:
+            rates = self.fetch_function(base_currency)
+        except Exception:
+            self._count("fetch_errors")
+            with self._lock:
+                self._last_failure[base_currency] = time.time()
+            return None
+
+        today = date.today().isoformat()
+        with self._lock:
+            self._memory[(base_currency, today)] = rates
+            self._last_failure.pop(base_currency, None)
+        self._write_disk(base_currency, today, rates)
+        return rates
+
+    def _read_disk(self, base_currency):
+        if self._connection is None:
+            return None, None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT rate_date, rates_json FROM fx_rates WHERE base_currency = ? "
+                "ORDER BY rate_date DESC LIMIT 1",
+                (base_currency,),
+            ).fetchone()
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1])
+
+    def _write_disk(self, base_currency, rate_date, rates):
+        if self._connection is None:
+            return
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO fx_rates (base_currency, rate_date, rates_json, fetched_at) "
+                "VALUES (?, ?, ?, ?)",
+                (base_currency, rate_date, json.dumps(rates), time.time()),
+            )
+            self._connection.commit()
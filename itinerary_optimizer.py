@@ -0,0 +1,168 @@
+"""Top-k itinerary ranking across outbound x return x hotel offers.
+
+An itinerary's cost for the party is
+
+    (outbound price + return price) * num_people + hotel price * nights * rooms
+
+and its score is that cost plus a penalty for each hour a flight departs
+outside the preferred window. Lower scores rank first.
+
+The score is a sum of independent per-component terms, which keeps the
+search small without losing exactness:
+
+- Only the top_k cheapest hotels can appear in the answer: any other
+  hotel is beaten on both cost and score by each of them.
+- Only the top_k best-scoring flight pairs that fit the budget with the
+  cheapest hotel can appear, by the same argument.
+- Those k pairs and k hotels are merged best-first with a heap, so at
+  most O(k log k) combinations are looked at.
+
+Flight pair costs and scores are built as NumPy matrices, so hundreds of
+offers per leg and thousands of hotels still rank in milliseconds.
+"""
+import heapq
+import math
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+
+DEFAULT_PREFERRED_DEPARTURE_HOURS = (7.0, 21.0)
+DEFAULT_DEPARTURE_PENALTY_PER_HOUR = 15.0
+
+TIME_OF_DAY_PATTERN = re.compile(r"(\d{1,2}):(\d{2})")
+
+
+@dataclass(frozen=True, slots=True)
+class Itinerary:
+    outbound: object
+    return_flight: object
+    hotel: object
+    flight_cost: float
+    hotel_cost: float
+    total_cost: float
+    score: float
+
+
+def departure_hour(departure_text):
+    """Hour of day as a float from text such as "09:15"; None when it cannot be read"""
+    match = TIME_OF_DAY_PATTERN.search(departure_text or "")
+    if match is None:
+        return None
+    return int(match.group(1)) + int(match.group(2)) / 60
+
+
+def departure_penalties(flights, preferred_hours, penalty_per_hour):
+    earliest_hour, latest_hour = preferred_hours
+    hours = np.array(
+        [departure_hour(flight.departure) for flight in flights], dtype=float
+    )
+    hours_outside = np.maximum(earliest_hour - hours, 0.0) + np.maximum(hours - latest_hour, 0.0)
+    # Unreadable departure times are not penalised.
+    return np.nan_to_num(hours_outside, nan=0.0) * penalty_per_hour
+
+
+def rooms_needed(num_people, guests_per_room=2):
+    return max(1, math.ceil(num_people / guests_per_room))
+
+
+def smallest_indexes(values, count):
+    """Indexes of the `count` smallest values, in ascending order of value"""
+    if count < len(values):
+        candidate_indexes = np.argpartition(values, count)[:count]
+    else:
+        candidate_indexes = np.arange(len(values))
+    return candidate_indexes[np.argsort(values[candidate_indexes], kind="stable")]
+
+
+def rank_itineraries(
+    outbound_flights,
+    return_flights,
+    hotels,
+    num_people=1,
+    num_nights=1,
+    budget=None,
+    top_k=5,
+    guests_per_room=2,
+    preferred_departure_hours=DEFAULT_PREFERRED_DEPARTURE_HOURS,
+    departure_penalty_per_hour=DEFAULT_DEPARTURE_PENALTY_PER_HOUR,
+):
+    """Return up to top_k Itinerary records within budget, best score first.
+
+    Hotel prices are taken as per room per night; unpriced hotels are
+    skipped. With no priced hotels the itineraries are flights only
+    (hotel is None). budget=None ranks without a budget limit.
+    """
+    if top_k <= 0 or not outbound_flights or not return_flights:
+        return []
+
+    budget_limit = float("inf") if budget is None else float(budget)
+    num_people = max(1, int(num_people))
+
+    # Hotels: per-stay cost for the whole party; keep the top_k cheapest.
+    priced_hotels = [hotel for hotel in hotels if hotel.price]
+    if priced_hotels:
+        hotel_costs = np.array([hotel.price for hotel in priced_hotels], dtype=float)
+        hotel_costs *= max(1, int(num_nights)) * rooms_needed(num_people, guests_per_room)
+        hotel_order = smallest_indexes(hotel_costs, top_k)
+        candidate_hotels = [priced_hotels[index] for index in hotel_order]
+        candidate_hotel_costs = hotel_costs[hotel_order]
+    else:
+        candidate_hotels = [None]
+        candidate_hotel_costs = np.zeros(1)
+
+    # Flight pairs: outbound x return cost and score matrices for the party.
+    outbound_costs = np.array([flight.price for flight in outbound_flights], dtype=float) * num_people
+    return_costs = np.array([flight.price for flight in return_flights], dtype=float) * num_people
+    outbound_scores = outbound_costs + departure_penalties(
+        outbound_flights, preferred_departure_hours, departure_penalty_per_hour
+    )
+    return_scores = return_costs + departure_penalties(
+        return_flights, preferred_departure_hours, departure_penalty_per_hour
+    )
+
+    pair_costs = (outbound_costs[:, None] + return_costs[None, :]).ravel()
+    pair_scores = (outbound_scores[:, None] + return_scores[None, :]).ravel()
+
+    # A pair that misses the budget even with the cheapest hotel can never be used.
+    feasible_pairs = np.flatnonzero(pair_costs + candidate_hotel_costs[0] <= budget_limit)
+    if feasible_pairs.size == 0:
+        return []
+    best_pairs = feasible_pairs[smallest_indexes(pair_scores[feasible_pairs], top_k)]
+
+    # Best-first merge of the sorted pairs with the sorted hotels.
+    itineraries = []
+    visited = {(0, 0)}
+    frontier = [(pair_scores[best_pairs[0]] + candidate_hotel_costs[0], 0, 0)]
+
+    while frontier and len(itineraries) < top_k:
+        score, pair_rank, hotel_rank = heapq.heappop(frontier)
+        pair_index = best_pairs[pair_rank]
+        flight_cost = pair_costs[pair_index]
+        hotel_cost = candidate_hotel_costs[hotel_rank]
+        if flight_cost + hotel_cost > budget_limit:
+            # Pricier hotels with this pair are over budget too.
+            continue
+
+        outbound_index, return_index = divmod(int(pair_index), len(return_flights))
+        itineraries.append(Itinerary(
+            outbound=outbound_flights[outbound_index],
+            return_flight=return_flights[return_index],
+            hotel=candidate_hotels[hotel_rank],
+            flight_cost=float(flight_cost),
+            hotel_cost=float(hotel_cost),
+            total_cost=float(flight_cost + hotel_cost),
+            score=float(score),
+        ))
+
+        for next_pair_rank, next_hotel_rank in ((pair_rank + 1, hotel_rank), (pair_rank, hotel_rank + 1)):
+            if next_pair_rank >= len(best_pairs) or next_hotel_rank >= len(candidate_hotels):
+                continue
+            if (next_pair_rank, next_hotel_rank) in visited:
+                continue
+            visited.add((next_pair_rank, next_hotel_rank))
+            next_score = pair_scores[best_pairs[next_pair_rank]] + candidate_hotel_costs[next_hotel_rank]
+            heapq.heappush(frontier, (next_score, next_pair_rank, next_hotel_rank))
+
+    return itineraries
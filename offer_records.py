@@ -0,0 +1,127 @@
+"""Typed flight and hotel offer records.
+
+Searches build these records once and hand the same objects to the graph
+nodes, the result caches and the state. JSON is only produced at the
+LLM-tool boundary (offers_to_json) and in the on-disk result cache.
+Checkpoints store each record as a plain tuple of its fields
+(offer_to_tuple), see checkpointing.OfferRecordSerializer.
+"""
+import json
+from collections import defaultdict
+from dataclasses import asdict, dataclass, fields
+from operator import attrgetter
+
+
+@dataclass(frozen=True, slots=True)
+class FlightOption:
+    airline: str
+    route: str
+    origin_code: str
+    destination_code: str
+    price: float
+    currency: str
+    departure: str
+    arrival: str
+    date: str
+    link: str
+    stops: int = 0
+    type: str = "flight"
+
+
+@dataclass(frozen=True, slots=True)
+class HotelOption:
+    name: str
+    price: float | None
+    currency: str
+    address: str
+    link: str
+    distance_to_center: str = "N/A"
+    hotel_id: str = ""
+    rating: float = 0
+    rating_word: str = ""
+    stars: int = 0
+    type: str = "hotel"
+
+
+OFFER_TYPES = {"flight": FlightOption, "hotel": HotelOption}
+
+# (module, class) pairs the checkpoint serializer may rebuild from msgpack.
+CHECKPOINT_ALLOWED_TYPES = [(__name__, offer_class.__name__) for offer_class in OFFER_TYPES.values()]
+
+# Every field but the trailing "type", in declaration order; the class is implied by who reads the tuple.
+OFFER_TUPLE_GETTERS = {
+    offer_class: attrgetter(*[field.name for field in fields(offer_class) if field.name != "type"])
+    for offer_class in OFFER_TYPES.values()
+}
+
+
+def offer_to_dict(offer):
+    return asdict(offer)
+
+
+def offer_from_dict(offer_data):
+    offer_class = OFFER_TYPES[offer_data.get("type", "flight")]
+    known_fields = {field.name for field in fields(offer_class)}
+    return offer_class(**{key: value for key, value in offer_data.items() if key in known_fields})
+
+
+def offer_to_tuple(offer):
+    return OFFER_TUPLE_GETTERS[type(offer)](offer)
+
+
+def offer_from_tuple(offer_class, offer_fields):
+    return offer_class(*offer_fields)
+
+
+def offers_to_json(offers):
+    return json.dumps([offer_to_dict(offer) for offer in offers])
+
+
+def offers_from_json(json_string):
+    try:
+        offers_data = json.loads(json_string)
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(offers_data, list):
+        return []
+    return [offer_from_dict(offer_data) for offer_data in offers_data if isinstance(offer_data, dict)]
+
+
+def offer_identity(offer):
+    """What makes two offers the same offer, whatever they cost"""
+    if isinstance(offer, FlightOption):
+        return ("flight", offer.airline, offer.origin_code, offer.destination_code, offer.date, offer.departure, offer.arrival)
+    return ("hotel", offer.hotel_id or offer.name, offer.address)
+
+
+def offer_group(offer):
+    """The leg a flight flies or the city a hotel is in"""
+    if isinstance(offer, FlightOption):
+        return ("flight", offer.origin_code, offer.destination_code, offer.date)
+    return ("hotel", offer.address)
+
+
+def merge_offer_lists(current_offers, new_offers, max_offers_per_group):
+    """current_offers updated with new_offers, deduplicated and capped
+
+    A repeated offer keeps its first position and takes the newer price.
+    Each leg (or hotel city) keeps its max_offers_per_group cheapest
+    offers, unpriced ones last, in the order they were first seen.
+    """
+    offers_by_identity = {}
+    for offer in [*current_offers, *new_offers]:
+        offers_by_identity[offer_identity(offer)] = offer
+
+    identities_by_group = defaultdict(list)
+    for identity, offer in offers_by_identity.items():
+        identities_by_group[offer_group(offer)].append(identity)
+
+    kept_identities = set()
+    for group_identities in identities_by_group.values():
+        cheapest_first = sorted(
+            group_identities,
+            key=lambda identity: (offers_by_identity[identity].price is None, offers_by_identity[identity].price or 0)
+        )
+        kept_identities.update(cheapest_first[:max_offers_per_group])
+
+    return [offer for identity, offer in offers_by_identity.items() if identity in kept_identities]
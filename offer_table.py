@@ -0,0 +1,98 @@
+"""Columnar view of a flight offer list for filtering, sorting and paging.
+
+A large search returns a few hundred offers per leg. FlightOfferTable
+keeps the fields the page filters and sorts on as NumPy arrays beside the
+list of FlightOption records. A filter or a sort is one vectorized pass
+that produces a new array of row numbers, and a page is a slice of it.
+Only the records of the rows on the page are touched, so the cost of
+drawing the page does not grow with the number of offers.
+"""
+import numpy as np
+
+from itinerary_optimizer import departure_hour
+
+
+# Sort key -> column; ties are broken by price, then by the original order.
+SORT_COLUMNS = {
+    "price": "price",
+    "departure": "departure_hour",
+    "arrival": "arrival_hour",
+    "stops": "stops",
+    "airline": "airline",
+}
+
+
+class FlightOfferTable:
+    def __init__(self, flights):
+        self.flights = list(flights)
+        self.airline_names = sorted({flight.airline for flight in self.flights})
+        airline_positions = {airline_name: position for position, airline_name in enumerate(self.airline_names)}
+
+        def hour_or_nan(time_text):
+            hour = departure_hour(time_text)
+            return np.nan if hour is None else hour
+
+        self.columns = {
+            "price": np.array([np.inf if flight.price is None else flight.price for flight in self.flights], dtype=float),
+            "stops": np.array([flight.stops for flight in self.flights], dtype=np.int16),
+            "departure_hour": np.array([hour_or_nan(flight.departure) for flight in self.flights], dtype=float),
+            "arrival_hour": np.array([hour_or_nan(flight.arrival) for flight in self.flights], dtype=float),
+            "airline": np.array([airline_positions[flight.airline] for flight in self.flights], dtype=np.int32),
+        }
+        self.rows = np.arange(len(self.flights))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _with_rows(self, rows):
+        table_view = object.__new__(FlightOfferTable)
+        table_view.flights = self.flights
+        table_view.airline_names = self.airline_names
+        table_view.columns = self.columns
+        table_view.rows = rows
+        return table_view
+
+    def _column(self, column_name):
+        return self.columns[column_name][self.rows]
+
+    def filter(self, max_price=None, max_stops=None, airlines=None, departure_hours=None, arrival_hours=None):
+        """The rows that pass every given condition; hours are (earliest, latest) inclusive"""
+        keep = np.ones(len(self.rows), dtype=bool)
+        if max_price is not None:
+            keep &= self._column("price") <= max_price
+        if max_stops is not None:
+            keep &= self._column("stops") <= max_stops
+        if airlines:
+            airline_positions = [position for position, airline_name in enumerate(self.airline_names) if airline_name in set(airlines)]
+            keep &= np.isin(self._column("airline"), airline_positions)
+        for column_name, hour_window in (("departure_hour", departure_hours), ("arrival_hour", arrival_hours)):
+            if hour_window is not None:
+                hours = self._column(column_name)
+                keep &= (hours >= hour_window[0]) & (hours <= hour_window[1])
+        return self._with_rows(self.rows[keep])
+
+    def sort(self, sort_key="price"):
+        # lexsort is stable and sorts by its last key first.
+        order = np.lexsort((self._column("price"), self._column(SORT_COLUMNS[sort_key])))
+        return self._with_rows(self.rows[order])
+
+    def page_count(self, page_size):
+        return max(1, -(-len(self.rows) // page_size))
+
+    def page(self, page_index, page_size):
+        """FlightOption records of one page (zero-based)"""
+        return [self.flights[row] for row in self.rows[page_index * page_size:(page_index + 1) * page_size]]
+
+    def airlines(self):
+        return [self.airline_names[position] for position in np.unique(self._column("airline"))]
+
+    def price_range(self):
+        """(cheapest, dearest) priced offer, or None if nothing here has a price"""
+        prices = self._column("price")
+        prices = prices[np.isfinite(prices)]
+        if not len(prices):
+            return None
+        return float(prices.min()), float(prices.max())
+
+    def max_stops(self):
+        return int(self._column("stops").max()) if len(self.rows) else 0
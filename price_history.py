@@ -0,0 +1,210 @@
+"""Append-only local history of every flight and hotel offer fetched.
+
+Each upstream search appends one row per normalized offer, stamped with
+the fetch time and the query it answered, plus one row in fetch_log for
+the search itself. Rows are never updated or deleted, so the table is a
+price history as well as a store of the newest results:
+
+- latest_snapshot() returns the newest fetch for a query if it is young
+  enough, so re-checking a trip only goes upstream for the legs and
+  hotels whose data is older than the freshness threshold
+  (latest_fetch() also returns when that fetch happened);
+- price_trend() gives the cheapest and average price of every fetch of a
+  query, for trend charts that cost no API calls;
+- export() writes the table to Parquet (needs pyarrow) or CSV for
+  analysis elsewhere.
+
+    python price_history.py --export history.parquet --since-days 30
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from offer_records import FlightOption, offer_from_dict, offer_to_dict
+
+
+DEFAULT_CACHE_DATABASE = os.environ.get("TRAVEL_PLANNER_CACHE_DB", "travel_planner_cache.db")
+
+EXPORT_COLUMNS = (
+    "fetched_at", "fetch_id", "query_key", "kind", "origin", "destination", "travel_date",
+    "provider", "offer_id", "departure", "arrival", "price", "currency",
+)
+
+
+def describe_offer(offer):
+    """(origin, destination, travel date, provider, offer id, departure, arrival) columns for an offer"""
+    if isinstance(offer, FlightOption):
+        return (
+            offer.origin_code, offer.destination_code, offer.date, offer.airline,
+            f"{offer.airline}|{offer.origin_code}|{offer.destination_code}|{offer.date}|{offer.departure}",
+            offer.departure, offer.arrival,
+        )
+    return (None, offer.address, None, offer.name, offer.hotel_id or offer.name, None, None)
+
+
+class PriceHistory:
+    def __init__(self, database_path=DEFAULT_CACHE_DATABASE, busy_timeout_ms=5000):
+        self._lock = threading.Lock()
+        self._counters = {"snapshot_hits": 0, "snapshot_misses": 0, "fetches_recorded": 0, "offers_recorded": 0, "record_errors": 0}
+        # The cache database is shared with the result caches and search jobs: WAL lets
+        # their reads run alongside this writer, and the busy timeout rides out their writes.
+        self._connection = sqlite3.connect(database_path, timeout=busy_timeout_ms / 1000, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS fetch_log ("
+            "fetch_id TEXT PRIMARY KEY, "
+            "query_key TEXT NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "fetched_at REAL NOT NULL, "
+            "offer_count INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS fetch_log_query ON fetch_log (query_key, fetched_at);"
+            "CREATE TABLE IF NOT EXISTS offer_history ("
+            "fetch_id TEXT NOT NULL, "
+            "query_key TEXT NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "fetched_at REAL NOT NULL, "
+            "origin TEXT, "
+            "destination TEXT, "
+            "travel_date TEXT, "
+            "provider TEXT, "
+            "offer_id TEXT, "
+            "departure TEXT, "
+            "arrival TEXT, "
+            "price REAL, "
+            "currency TEXT, "
+            "offer_json TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS offer_history_fetch ON offer_history (fetch_id);"
+            "CREATE INDEX IF NOT EXISTS offer_history_time ON offer_history (fetched_at);"
+        )
+        self._connection.commit()
+
+    def record(self, query_key, kind, offers, fetched_at=None):
+        """Append one fetch of query_key and its offers; returns the fetch id
+
+        A failed write is rolled back whole, so no fetch is left without its
+        offers, counted as a record error, and re-raised.
+        """
+        fetch_id = uuid.uuid4().hex
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        offer_rows = [
+            (fetch_id, query_key, kind, fetched_at, *describe_offer(offer), offer.price, offer.currency, json.dumps(offer_to_dict(offer)))
+            for offer in offers
+        ]
+        with self._lock:
+            try:
+                self._connection.execute(
+                    "INSERT INTO fetch_log (fetch_id, query_key, kind, fetched_at, offer_count) VALUES (?, ?, ?, ?, ?)",
+                    (fetch_id, query_key, kind, fetched_at, len(offer_rows)),
+                )
+                self._connection.executemany(
+                    "INSERT INTO offer_history (fetch_id, query_key, kind, fetched_at, origin, destination, travel_date, "
+                    "provider, offer_id, departure, arrival, price, currency, offer_json) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    offer_rows,
+                )
+                self._connection.commit()
+            except sqlite3.Error:
+                self._connection.rollback()
+                self._counters["record_errors"] += 1
+                raise
+            self._counters["fetches_recorded"] += 1
+            self._counters["offers_recorded"] += len(offer_rows)
+        return fetch_id
+
+    def latest_snapshot(self, query_key, max_age_seconds):
+        """Offers of the newest fetch of query_key if it is younger than max_age_seconds, else None
+
+        A fetch that found nothing does not count: empty results usually
+        mean a failed search and are retried, as in the result caches.
+        """
+        latest_fetch = self.latest_fetch(query_key, max_age_seconds)
+        return None if latest_fetch is None else latest_fetch[0]
+
+    def latest_fetch(self, query_key, max_age_seconds):
+        """(offers, fetched_at) of the newest fetch latest_snapshot() would use, else None"""
+        with self._lock:
+            fetch_row = self._connection.execute(
+                "SELECT fetch_id, fetched_at FROM fetch_log WHERE query_key = ? AND offer_count > 0 AND fetched_at > ? "
+                "ORDER BY fetched_at DESC LIMIT 1",
+                (query_key, time.time() - max_age_seconds),
+            ).fetchone()
+            offer_rows = []
+            if fetch_row is not None:
+                offer_rows = self._connection.execute(
+                    "SELECT offer_json FROM offer_history WHERE fetch_id = ? ORDER BY rowid", (fetch_row[0],)
+                ).fetchall()
+            self._counters["snapshot_hits" if fetch_row is not None else "snapshot_misses"] += 1
+
+        if fetch_row is None:
+            return None
+        return [offer_from_dict(json.loads(offer_json)) for (offer_json,) in offer_rows], fetch_row[1]
+
+    def price_trend(self, query_key, since_seconds=None):
+        """[{"fetched_at", "cheapest_price", "average_price", "offers"}] per fetch of query_key, oldest first"""
+        since_timestamp = time.time() - since_seconds if since_seconds else 0
+        with self._lock:
+            trend_rows = self._connection.execute(
+                "SELECT fetch_log.fetched_at, MIN(offer_history.price), AVG(offer_history.price), COUNT(offer_history.price) "
+                "FROM fetch_log JOIN offer_history ON offer_history.fetch_id = fetch_log.fetch_id "
+                "WHERE fetch_log.query_key = ? AND fetch_log.fetched_at >= ? "
+                "GROUP BY fetch_log.fetch_id ORDER BY fetch_log.fetched_at",
+                (query_key, since_timestamp),
+            ).fetchall()
+        return [
+            {"fetched_at": fetched_at, "cheapest_price": cheapest_price, "average_price": average_price, "offers": offer_count}
+            for fetched_at, cheapest_price, average_price, offer_count in trend_rows
+            if offer_count
+        ]
+
+    def export(self, output_path, since_seconds=None):
+        """Write offer rows to output_path (.parquet needs pyarrow, anything else is CSV); returns the row count"""
+        import pandas as pd
+
+        since_timestamp = time.time() - since_seconds if since_seconds else 0
+        with self._lock:
+            history_frame = pd.read_sql_query(
+                f"SELECT {', '.join(EXPORT_COLUMNS)} FROM offer_history WHERE fetched_at >= ? ORDER BY fetched_at",
+                self._connection,
+                params=(since_timestamp,),
+            )
+        history_frame["fetched_at"] = pd.to_datetime(history_frame["fetched_at"], unit="s", utc=True)
+
+        if output_path.endswith(".parquet"):
+            history_frame.to_parquet(output_path, index=False)
+        else:
+            history_frame.to_csv(output_path, index=False)
+        return len(history_frame)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters["fetches"] = self._connection.execute("SELECT COUNT(*) FROM fetch_log").fetchone()[0]
+            counters["offers"] = self._connection.execute("SELECT COUNT(*) FROM offer_history").fetchone()[0]
+        return counters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default=DEFAULT_CACHE_DATABASE, help="SQLite file holding the history")
+    parser.add_argument("--export", metavar="PATH", required=True, help="output file, .parquet or .csv")
+    parser.add_argument("--since-days", type=float, default=None, help="only offers fetched in the last N days")
+    args = parser.parse_args(argv)
+
+    since_seconds = args.since_days * 86400 if args.since_days else None
+    try:
+        exported_rows = PriceHistory(args.database).export(args.export, since_seconds)
+    except ImportError as error:
+        print(f"Parquet export needs pyarrow ({error}); export to .csv instead", file=sys.stderr)
+        return 1
+    print(f"exported {exported_rows} offers to {args.export}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
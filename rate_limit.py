@@ -0,0 +1,283 @@
+"""Upstream request budget, retries and circuit breaking shared by every thread in the process.
+
+TokenBucket spaces requests out to the API tier's rate. UpstreamGuard
+runs each upstream call with jittered exponential retry (honoring
+Retry-After), a circuit breaker per endpoint, and outcome counters that
+tell an empty answer apart from a throttled or failed call.
+"""
+import asyncio
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """Allows `rate_per_second` requests on average, with bursts up to `capacity`."""
+
+    def __init__(self, rate_per_second, capacity=None):
+        self.rate_per_second = float(rate_per_second)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate_per_second))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens=1.0):
+        """Take tokens if available; otherwise return the seconds to wait for them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+            self._updated_at = now
+
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate_per_second
+
+    def defer(self, seconds):
+        """Hold every caller back for `seconds`, e.g. after the upstream sent Retry-After."""
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds * self.rate_per_second)
+
+    def charge(self, tokens):
+        """Take tokens already spent, going into debt if needed; later callers wait the debt off."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second) - tokens
+            self._updated_at = now
+
+    def acquire(self, tokens=1.0):
+        while True:
+            wait_seconds = self.try_acquire(tokens)
+            if wait_seconds == 0.0:
+                return
+            time.sleep(wait_seconds)
+
+    async def acquire_async(self, tokens=1.0):
+        while True:
+            wait_seconds = self.try_acquire(tokens)
+            if wait_seconds == 0.0:
+                return
+            await asyncio.sleep(wait_seconds)
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call gave up: throttled or failed after its retries, or short-circuited."""
+
+    def __init__(self, endpoint_name, reason, retry_in_seconds=None):
+        self.endpoint_name = endpoint_name
+        self.reason = reason
+        self.retry_in_seconds = retry_in_seconds
+        super().__init__(f"{endpoint_name} unavailable ({reason})")
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts=3,
+        base_delay_seconds=0.25,
+        max_delay_seconds=8.0,
+        retry_statuses=(429, 500, 502, 503, 504),
+    ):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def should_retry(self, status_code):
+        # No status code means the request never got an answer (network error, timeout).
+        return status_code is None or status_code in self.retry_statuses
+
+    def delay_for(self, attempt, retry_after=None):
+        """Seconds to wait before retry number `attempt` (1-based), or None to give up.
+
+        Without Retry-After this is "full jitter": uniform between zero and
+        an exponentially growing cap. A Retry-After beyond max_delay_seconds
+        means waiting would take longer than the caller should, so give up.
+        """
+        if retry_after is not None:
+            if retry_after > self.max_delay_seconds:
+                return None
+            return retry_after + random.uniform(0, self.base_delay_seconds)
+        return random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and fails fast for `reset_seconds`.
+
+    After that one probe call is let through (half open): success closes
+    the circuit, failure opens it again for another reset_seconds.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Return 0.0 if the call may go ahead, else the seconds until the next probe."""
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            retry_in_seconds = self._opened_at + self.reset_seconds - time.monotonic()
+            if retry_in_seconds > 0 or self._probe_in_flight:
+                return max(retry_in_seconds, 0.001)
+            self.state = "half_open"
+            self._probe_in_flight = True
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self.state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """The probe ended without telling us anything about the upstream's health."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+            self._probe_in_flight = False
+
+
+class UpstreamGuard:
+    """Runs upstream calls with retry, per-endpoint circuit breakers and outcome counters.
+
+    classify_error(error) returns (status_code, retry_after_seconds) for
+    an upstream error response or network failure (status_code None), and
+    None for any other exception, which is re-raised untouched.
+
+    Outcomes per endpoint: ok, empty (the upstream answered with no data),
+    throttled and failed (after retries), short_circuited (the circuit
+    was open), plus the number of retries made.
+    """
+
+    OUTCOMES = ("ok", "empty", "throttled", "failed", "short_circuited", "retries")
+
+    def __init__(
+        self,
+        classify_error,
+        retry_policy=None,
+        rate_limiter=None,
+        failure_threshold=5,
+        reset_seconds=30.0,
+        is_empty=None,
+    ):
+        self.classify_error = classify_error
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.is_empty = is_empty or (lambda response: not getattr(response, "data", None))
+
+        self._breakers = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def call(self, endpoint_name, function):
+        # Admitted once: retries belong to the same call, including a half-open probe's.
+        breaker = self._admit(endpoint_name)
+        attempt = 0
+        while True:
+            try:
+                response = function()
+            except Exception as error:
+                attempt += 1
+                delay_seconds = self._after_failure(endpoint_name, breaker, error, attempt)
+                time.sleep(delay_seconds)
+                continue
+            return self._after_success(endpoint_name, breaker, response)
+
+    async def acall(self, endpoint_name, async_function):
+        breaker = self._admit(endpoint_name)
+        attempt = 0
+        while True:
+            try:
+                response = await async_function()
+            except asyncio.CancelledError:
+                breaker.release_probe()
+                raise
+            except Exception as error:
+                attempt += 1
+                delay_seconds = self._after_failure(endpoint_name, breaker, error, attempt)
+                await asyncio.sleep(delay_seconds)
+                continue
+            return self._after_success(endpoint_name, breaker, response)
+
+    def circuit_state(self, endpoint_name):
+        return self._breaker(endpoint_name).state
+
+    def stats(self):
+        with self._lock:
+            endpoint_stats = {name: dict(counters) for name, counters in self._counters.items()}
+            for name, breaker in self._breakers.items():
+                endpoint_stats.setdefault(name, dict.fromkeys(self.OUTCOMES, 0))["circuit"] = breaker.state
+        return endpoint_stats
+
+    def _breaker(self, endpoint_name):
+        with self._lock:
+            breaker = self._breakers.get(endpoint_name)
+            if breaker is None:
+                breaker = self._breakers[endpoint_name] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+            return breaker
+
+    def _count(self, endpoint_name, outcome):
+        with self._lock:
+            counters = self._counters.get(endpoint_name)
+            if counters is None:
+                counters = self._counters[endpoint_name] = dict.fromkeys(self.OUTCOMES, 0)
+            counters[outcome] += 1
+
+    def _admit(self, endpoint_name):
+        breaker = self._breaker(endpoint_name)
+        retry_in_seconds = breaker.before_call()
+        if retry_in_seconds:
+            self._count(endpoint_name, "short_circuited")
+            raise UpstreamUnavailable(endpoint_name, "circuit_open", retry_in_seconds)
+        return breaker
+
+    def _after_success(self, endpoint_name, breaker, response):
+        breaker.record_success()
+        self._count(endpoint_name, "empty" if self.is_empty(response) else "ok")
+        return response
+
+    def _after_failure(self, endpoint_name, breaker, error, attempt):
+        """Return the seconds to wait before retrying, or raise to give up."""
+        classification = self.classify_error(error)
+        if classification is None:
+            breaker.release_probe()
+            self._count(endpoint_name, "failed")
+            raise error
+        status_code, retry_after = classification
+
+        if not self.retry_policy.should_retry(status_code):
+            # A rejected request (400, 404, ...) says nothing about the upstream's health.
+            breaker.release_probe()
+            self._count(endpoint_name, "failed")
+            raise error
+
+        if retry_after is not None and self.rate_limiter is not None:
+            self.rate_limiter.defer(retry_after)
+
+        delay_seconds = None
+        if attempt < self.retry_policy.max_attempts:
+            delay_seconds = self.retry_policy.delay_for(attempt, retry_after)
+        if delay_seconds is None:
+            breaker.record_failure()
+            reason = "throttled" if status_code == 429 else "failed"
+            self._count(endpoint_name, reason)
+            raise UpstreamUnavailable(endpoint_name, reason, retry_after) from error
+
+        self._count(endpoint_name, "retries")
+        return delay_seconds
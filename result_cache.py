@@ -0,0 +1,292 @@
+"""Query-level cache for search tool results with stale-while-revalidate.
+
+An entry younger than fresh_ttl_seconds is returned as is. An entry older
+than that but still inside the stale window is returned immediately while
+a background thread refetches it. Anything older is fetched inline.
+If that fetch raises one of fallback_errors (the upstream is unhealthy),
+an entry up to max_fallback_age_seconds old is served instead.
+
+The memory backend holds the caller's objects as they are; the SQLite
+backend stores them through the encode/decode functions it is given.
+
+A fetch function that hands back an older result (say, one read from a
+local history) returns it as FetchedResult(value, fetched_at); the entry
+is then dated by fetched_at, so its age still counts from the real fetch.
+A background refresh calls refresh_function when one is given, which
+should go to the source rather than to such a copy.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_CACHE_DATABASE = os.environ.get("TRAVEL_PLANNER_CACHE_DB", "travel_planner_cache.db")
+
+
+class FetchedResult:
+    __slots__ = ("value", "fetched_at")
+
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+
+
+def unwrap_fetched_result(fetched_value):
+    """(value, fetched_at); fetched_at is now unless the fetch said otherwise"""
+    if isinstance(fetched_value, FetchedResult):
+        return fetched_value.value, fetched_value.fetched_at
+    return fetched_value, time.time()
+
+
+def make_query_key(kind, *query_parts):
+    normalized_parts = [" ".join(str(part).split()).casefold() for part in query_parts]
+    return json.dumps([kind] + normalized_parts)
+
+
+class MemoryCacheBackend:
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        """Store an entry and return how many entries were evicted to make room."""
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SqliteCacheBackend:
+    def __init__(
+        self,
+        database_path=DEFAULT_CACHE_DATABASE,
+        max_entries=5000,
+        table_name="search_result_cache",
+        encode=json.dumps,
+        decode=json.loads,
+    ):
+        self.max_entries = max_entries
+        self.table_name = table_name
+        self.encode = encode
+        self.decode = decode
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table_name} ("
+            "query_key TEXT PRIMARY KEY, "
+            "value TEXT NOT NULL, "
+            "stored_at REAL NOT NULL, "
+            "last_used_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {table_name}_last_used ON {table_name} (last_used_at)"
+        )
+        self._connection.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT value, stored_at FROM {self.table_name} WHERE query_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                f"UPDATE {self.table_name} SET last_used_at = ? WHERE query_key = ?", (time.time(), key)
+            )
+            self._connection.commit()
+        return self.decode(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        encoded_value = self.encode(value)
+        with self._lock:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self.table_name} (query_key, value, stored_at, last_used_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, encoded_value, stored_at, time.time()),
+            )
+            cursor = self._connection.execute(
+                f"DELETE FROM {self.table_name} WHERE query_key IN ("
+                f"SELECT query_key FROM {self.table_name} ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._connection.commit()
+            return max(cursor.rowcount, 0)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM {self.table_name}").fetchone()[0]
+
+
+def create_cache_backend(
+    backend_name,
+    max_entries,
+    database_path=DEFAULT_CACHE_DATABASE,
+    table_name="search_result_cache",
+    encode=json.dumps,
+    decode=json.loads,
+):
+    if backend_name == "sqlite":
+        return SqliteCacheBackend(
+            database_path, max_entries=max_entries, table_name=table_name, encode=encode, decode=decode
+        )
+    if backend_name == "memory":
+        return MemoryCacheBackend(max_entries=max_entries)
+    raise ValueError(f"Unknown result cache backend: {backend_name!r}")
+
+
+class QueryResultCache:
+    def __init__(
+        self,
+        backend,
+        fresh_ttl_seconds=300,
+        stale_ttl_seconds=1800,
+        should_cache=None,
+        max_refresh_workers=2,
+        fallback_errors=(),
+        max_fallback_age_seconds=24 * 3600,
+    ):
+        self.backend = backend
+        self.fresh_ttl_seconds = fresh_ttl_seconds
+        self.stale_ttl_seconds = stale_ttl_seconds
+        self.should_cache = should_cache or (lambda value: True)
+        self.fallback_errors = tuple(fallback_errors)
+        self.max_fallback_age_seconds = max_fallback_age_seconds
+
+        self._refresh_executor = ThreadPoolExecutor(
+            max_workers=max_refresh_workers, thread_name_prefix="result-cache-refresh"
+        )
+        self._refreshing_keys = set()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "fallback_hits": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+    def get_or_fetch(self, key, fetch_function, refresh_function=None):
+        cached_value, is_stale = self._lookup(key)
+        if cached_value is not None:
+            if is_stale:
+                self._refresh_in_background(key, refresh_function or fetch_function)
+            return cached_value
+
+        try:
+            fetched_value = fetch_function()
+        except self.fallback_errors:
+            return self._serve_fallback(key)
+        return self.store(key, fetched_value)
+
+    async def aget_or_fetch(self, key, async_fetch_function, async_refresh_function=None):
+        cached_value, is_stale = self._lookup(key)
+        if cached_value is not None:
+            if is_stale:
+                # The refresh outlives the caller's event loop, so it gets its own.
+                refresh_function = async_refresh_function or async_fetch_function
+                self._refresh_in_background(key, lambda: asyncio.run(refresh_function()))
+            return cached_value
+
+        try:
+            fetched_value = await async_fetch_function()
+        except self.fallback_errors:
+            return self._serve_fallback(key)
+        return self.store(key, fetched_value)
+
+    def peek(self, key):
+        """Return the cached value, fresh or stale, without counting or refreshing."""
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        value, stored_at = entry
+        if time.time() - stored_at >= self.fresh_ttl_seconds + self.stale_ttl_seconds:
+            return None
+        return value
+
+    def store(self, key, value):
+        """Cache value (or a FetchedResult) under key and return the plain value"""
+        value, fetched_at = unwrap_fetched_result(value)
+        if not self.should_cache(value):
+            return value
+        evicted = self.backend.set(key, value, fetched_at)
+        with self._lock:
+            self._counters["stores"] += 1
+            self._counters["evictions"] += evicted
+        return value
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters["entries"] = len(self.backend)
+        lookups = counters["hits"] + counters["stale_hits"] + counters["misses"]
+        counters["hit_rate"] = (counters["hits"] + counters["stale_hits"]) / lookups if lookups else 0.0
+        return counters
+
+    def _lookup(self, key):
+        entry = self.backend.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age_seconds = time.time() - stored_at
+            if age_seconds < self.fresh_ttl_seconds:
+                self._count("hits")
+                return value, False
+            if age_seconds < self.fresh_ttl_seconds + self.stale_ttl_seconds:
+                self._count("stale_hits")
+                return value, True
+
+        self._count("misses")
+        return None, False
+
+    def _serve_fallback(self, key):
+        """Serve an expired entry for key, or re-raise the fetch error when there is none."""
+        entry = self.backend.get(key)
+        if entry is None or time.time() - entry[1] >= self.max_fallback_age_seconds:
+            raise
+        self._count("fallback_hits")
+        return entry[0]
+
+    def _count(self, counter_name):
+        with self._lock:
+            self._counters[counter_name] += 1
+
+    def _refresh_in_background(self, key, fetch_function):
+        with self._lock:
+            if key in self._refreshing_keys:
+                return
+            self._refreshing_keys.add(key)
+
+        def refresh():
+            try:
+                self.store(key, fetch_function())
+                self._count("refreshes")
+            except Exception:
+                self._count("refresh_errors")
+            finally:
+                with self._lock:
+                    self._refreshing_keys.discard(key)
+
+        self._refresh_executor.submit(refresh)
@@ -0,0 +1,279 @@
+"""Trip searches run as jobs on a bounded worker pool, with progress in SQLite.
+
+submit() answers at once with a job id. A worker thread later runs the
+search generator registered for the job's kind (for a trip that is
+travel_planner_engine.stream_trip_search) and appends every
+(event, payload) it yields to search_job_events, so whoever holds the id
+can poll get() for the status and the partial results. A Streamlit
+script run therefore never waits on Amadeus itself.
+
+Admission control: at most max_workers searches run at once in the
+process, which caps its concurrent upstream work. At most max_queued
+more may wait for a worker. Past that, submit() raises SearchQueueFull
+rather than letting threads pile up. Queue depth is exported as the
+travel_planner_search_jobs gauge. Queue waits and run times are recorded
+as "job" spans on the tracer.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import is_dataclass
+
+from offer_records import OFFER_TYPES, offer_from_dict, offer_to_dict
+
+
+DEFAULT_CACHE_DATABASE = os.environ.get("TRAVEL_PLANNER_CACHE_DB", "travel_planner_cache.db")
+
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+
+class SearchQueueFull(Exception):
+    """Every worker is busy and the waiting line is full"""
+
+    def __init__(self, queued, capacity):
+        super().__init__(f"search queue is full ({queued} waiting, capacity {capacity})")
+        self.queued = queued
+        self.capacity = capacity
+
+
+def to_json_value(value):
+    """Offers become dicts and tuples become lists, recursively"""
+    if is_dataclass(value):
+        return offer_to_dict(value)
+    if isinstance(value, dict):
+        return {key: to_json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(item) for item in value]
+    return value
+
+
+def from_json_value(value):
+    if isinstance(value, dict):
+        if value.get("type") in OFFER_TYPES and "price" in value:
+            return offer_from_dict(value)
+        return {key: from_json_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_json_value(item) for item in value]
+    return value
+
+
+class SearchJobQueue:
+    def __init__(
+        self,
+        search_functions,
+        database_path=DEFAULT_CACHE_DATABASE,
+        max_workers=4,
+        max_queued=16,
+        retention_seconds=24 * 3600,
+        tracer=None,
+    ):
+        """search_functions maps a job kind to f(user_inputs, job_id) -> iterator of (event, payload)"""
+        self.search_functions = dict(search_functions)
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+        self.tracer = tracer
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="search-job")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._active_job_ids = set()
+        self._cancelled_job_ids = set()
+        self._queue_waits = deque(maxlen=500)
+        self._counters = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "cancelled": 0}
+        self._last_purge = 0.0
+
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS search_jobs ("
+            "job_id TEXT PRIMARY KEY, "
+            "status TEXT NOT NULL, "
+            "request_json TEXT NOT NULL, "
+            "submitted_at REAL NOT NULL, "
+            "started_at REAL, "
+            "finished_at REAL, "
+            "error TEXT);"
+            "CREATE INDEX IF NOT EXISTS search_jobs_time ON search_jobs (submitted_at);"
+            "CREATE TABLE IF NOT EXISTS search_job_events ("
+            "job_id TEXT NOT NULL, "
+            "sequence INTEGER NOT NULL, "
+            "event TEXT NOT NULL, "
+            "payload_json TEXT NOT NULL, "
+            "recorded_at REAL NOT NULL, "
+            "PRIMARY KEY (job_id, sequence));"
+        )
+        self._connection.commit()
+
+        if tracer is not None:
+            tracer.add_gauge(
+                "travel_planner_search_jobs", "Search jobs in this process by state.", "state",
+                lambda: {"queued": self._queued, "running": self._running, "capacity": self.max_workers + self.max_queued}
+            )
+
+    def submit(self, user_inputs, kind="trip"):
+        """Queue a search and return its job id; raises SearchQueueFull when the line is full"""
+        search_function = self.search_functions[kind]
+        with self._lock:
+            # Jobs waiting for a worker are counted in _queued until they start.
+            if self._running + self._queued >= self.max_workers + self.max_queued:
+                self._counters["rejected"] += 1
+                queued = self._queued
+                rejected = True
+            else:
+                self._queued += 1
+                self._counters["submitted"] += 1
+                rejected = False
+        if rejected:
+            if self.tracer is not None:
+                self.tracer.record("job", "admission", time.time(), 0.0, "rejected", None)
+            raise SearchQueueFull(queued, self.max_workers + self.max_queued)
+
+        job_id = f"job-{uuid.uuid4().hex}"
+        submitted_at = time.time()
+        with self._lock:
+            self._active_job_ids.add(job_id)
+        try:
+            self._execute(
+                "INSERT INTO search_jobs (job_id, status, request_json, submitted_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps({"kind": kind, "inputs": to_json_value(user_inputs)}, default=str), submitted_at),
+            )
+            self._executor.submit(self._run_job, job_id, search_function, user_inputs, submitted_at)
+        except Exception:
+            # Give the slot back, or every failed submit would shrink the queue for good.
+            with self._lock:
+                self._queued -= 1
+                self._counters["submitted"] -= 1
+                self._active_job_ids.discard(job_id)
+            raise
+        self._purge_old_jobs()
+        return job_id
+
+    def cancel(self, job_id):
+        """Stop a job at its next event; a job still waiting never starts. Finished jobs are left alone"""
+        with self._lock:
+            if job_id in self._active_job_ids:
+                self._cancelled_job_ids.add(job_id)
+
+    def get(self, job_id):
+        """{"job_id", "status", "submitted_at", "started_at", "finished_at", "error", "events"}, or None"""
+        with self._lock:
+            job_row = self._connection.execute(
+                "SELECT status, submitted_at, started_at, finished_at, error FROM search_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            event_rows = self._connection.execute(
+                "SELECT event, payload_json, recorded_at FROM search_job_events WHERE job_id = ? ORDER BY sequence", (job_id,)
+            ).fetchall() if job_row is not None else []
+
+        if job_row is None:
+            return None
+        status, submitted_at, started_at, finished_at, error = job_row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "submitted_at": submitted_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "error": error,
+            "events": [(event, from_json_value(json.loads(payload_json))) for event, payload_json, _ in event_rows],
+            "first_event_at": event_rows[0][2] if event_rows else None,
+        }
+
+    def stats(self):
+        with self._lock:
+            job_stats = dict(self._counters)
+            job_stats.update(queued=self._queued, running=self._running, max_workers=self.max_workers, max_queued=self.max_queued)
+            queue_waits = sorted(self._queue_waits)
+        job_stats["queue_wait_p50_ms"] = round(queue_waits[len(queue_waits) // 2] * 1000, 1) if queue_waits else None
+        job_stats["queue_wait_p95_ms"] = round(queue_waits[int(len(queue_waits) * 0.95)] * 1000, 1) if queue_waits else None
+        return job_stats
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _execute(self, statement, parameters):
+        with self._lock:
+            try:
+                self._connection.execute(statement, parameters)
+                self._connection.commit()
+            except sqlite3.Error:
+                self._connection.rollback()
+                raise
+
+    def _finish(self, job_id, status, error=None):
+        # In-memory bookkeeping first, so a failed UPDATE cannot leak the job's slot.
+        with self._lock:
+            self._counters[status] += 1
+            self._active_job_ids.discard(job_id)
+            self._cancelled_job_ids.discard(job_id)
+        self._execute(
+            "UPDATE search_jobs SET status = ?, finished_at = ?, error = ? WHERE job_id = ?",
+            (status, time.time(), error, job_id),
+        )
+
+    def _is_cancelled(self, job_id):
+        with self._lock:
+            return job_id in self._cancelled_job_ids
+
+    def _run_job(self, job_id, search_function, user_inputs, submitted_at):
+        started_at = time.time()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._queue_waits.append(started_at - submitted_at)
+        if self.tracer is not None:
+            self.tracer.record("job", "queue_wait", submitted_at, started_at - submitted_at, "ok", job_id)
+
+        status, error = "done", None
+        try:
+            if self._is_cancelled(job_id):
+                status = "cancelled"
+                return
+            self._execute("UPDATE search_jobs SET status = 'running', started_at = ? WHERE job_id = ?", (started_at, job_id))
+
+            search_events = search_function(user_inputs, job_id)
+            try:
+                for sequence, (event, payload) in enumerate(search_events):
+                    self._execute(
+                        "INSERT INTO search_job_events (job_id, sequence, event, payload_json, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                        (job_id, sequence, event, json.dumps(to_json_value(payload), default=str), time.time()),
+                    )
+                    if self._is_cancelled(job_id):
+                        status = "cancelled"
+                        break
+            finally:
+                close_events = getattr(search_events, "close", None)
+                if close_events is not None:
+                    close_events()
+        except Exception as exception:
+            status, error = "failed", f"{type(exception).__name__}: {exception}"
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._finish(job_id, status, error)
+            if self.tracer is not None:
+                self.tracer.record("job", "run", started_at, time.time() - started_at, "error" if status == "failed" else "ok", job_id)
+
+    def _purge_old_jobs(self):
+        now = time.time()
+        if now - self._last_purge < 600:
+            return
+        self._last_purge = now
+        expired_before = now - self.retention_seconds
+        with self._lock:
+            try:
+                self._connection.execute(
+                    "DELETE FROM search_job_events WHERE job_id IN (SELECT job_id FROM search_jobs WHERE submitted_at < ?)",
+                    (expired_before,),
+                )
+                self._connection.execute("DELETE FROM search_jobs WHERE submitted_at < ?", (expired_before,))
+                self._connection.commit()
+            except sqlite3.Error:
+                # Best effort: the next submit tries again.
+                self._connection.rollback()
+                self._last_purge = 0.0
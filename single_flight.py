@@ -0,0 +1,95 @@
+"""Coalescing of identical concurrent upstream calls.
+
+While a call for a key is in flight, later callers with the same key wait
+for it and get the same result (or exception) instead of issuing their
+own request. The key is forgotten as soon as the call finishes, so
+nothing is served that is older than a request already running: this
+removes duplicate traffic during spikes without adding staleness.
+
+Sync and async callers share the same in-flight table. Each call is a
+concurrent.futures.Future, which threads wait on directly and coroutines
+await through asyncio.wrap_future, whichever event loop they run on.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class LeaderCancelled(Exception):
+    """The coroutine running a shared call was cancelled before it finished."""
+
+
+class SingleFlight:
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "coalesced": 0, "errors": 0}
+
+    def do(self, key, function):
+        """Return function() for key, sharing the result with concurrent callers."""
+        call_future, is_leader = self._join(key)
+        if not is_leader:
+            try:
+                return call_future.result()
+            except LeaderCancelled:
+                return self.do(key, function)
+
+        try:
+            result = function()
+        except BaseException as error:
+            self._finish(key, call_future, error=error)
+            raise
+        self._finish(key, call_future, result=result)
+        return result
+
+    async def ado(self, key, async_function):
+        """Async counterpart of do() for coroutine functions."""
+        call_future, is_leader = self._join(key)
+        if not is_leader:
+            try:
+                return await asyncio.wrap_future(call_future)
+            except LeaderCancelled:
+                # The leader's caller went away; the call was never made for us, so make it.
+                return await self.ado(key, async_function)
+
+        try:
+            result = await async_function()
+        except asyncio.CancelledError:
+            self._finish(key, call_future, error=LeaderCancelled(key))
+            raise
+        except BaseException as error:
+            self._finish(key, call_future, error=error)
+            raise
+        self._finish(key, call_future, result=result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters["in_flight"] = len(self._in_flight)
+        total_callers = counters["calls"] + counters["coalesced"]
+        counters["coalesced_rate"] = counters["coalesced"] / total_callers if total_callers else 0.0
+        return counters
+
+    def _join(self, key):
+        with self._lock:
+            call_future = self._in_flight.get(key)
+            if call_future is not None:
+                self._counters["coalesced"] += 1
+                return call_future, False
+
+            call_future = self._in_flight[key] = Future()
+            self._counters["calls"] += 1
+            return call_future, True
+
+    def _finish(self, key, call_future, result=None, error=None):
+        with self._lock:
+            if self._in_flight.get(key) is call_future:
+                del self._in_flight[key]
+            if error is not None and not isinstance(error, LeaderCancelled):
+                self._counters["errors"] += 1
+
+        if error is not None:
+            call_future.set_exception(error)
+        else:
+            call_future.set_result(result)
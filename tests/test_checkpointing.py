@@ -0,0 +1,61 @@
+import sqlite3
+from typing import TypedDict
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, START, StateGraph
+
+from checkpointing import OfferRecordSerializer, PooledSqliteSaver
+from offer_records import FlightOption, HotelOption
+
+
+FLIGHTS = [
+    FlightOption(
+        airline="LH", route="FRA -> JFK", origin_code="FRA", destination_code="JFK", price=412.5, currency="USD",
+        departure="Morning (09:15)", arrival="Afternoon (12:40)", date="2026-11-02", link="https://example.com/flight",
+    ),
+]
+HOTELS = [
+    HotelOption(name="Hotel A", price=180.0, currency="USD", address="New York", link="https://example.com/a", hotel_id="A"),
+    HotelOption(name="Hotel B", price=None, currency="USD", address="New York", link="https://example.com/b", hotel_id="B"),
+]
+
+
+class TripState(TypedDict):
+    flight_options: list
+    hotel_options: list
+
+
+def build_graph(checkpointer):
+    graph_builder = StateGraph(TripState)
+    graph_builder.add_node("flights", lambda state: {"flight_options": FLIGHTS})
+    graph_builder.add_node("hotels", lambda state: {"hotel_options": HOTELS})
+    graph_builder.add_edge(START, "flights")
+    graph_builder.add_edge("flights", "hotels")
+    graph_builder.add_edge("hotels", END)
+    return graph_builder.compile(checkpointer=checkpointer)
+
+
+def test_offers_round_trip_through_a_sqlite_checkpoint(tmp_path):
+    database_path = str(tmp_path / "checkpoints.db")
+    config = {"configurable": {"thread_id": "trip"}}
+    build_graph(PooledSqliteSaver(database_path, serde=OfferRecordSerializer())).invoke({"flight_options": [], "hotel_options": []}, config)
+
+    reader = SqliteSaver(sqlite3.connect(database_path, check_same_thread=False), serde=OfferRecordSerializer())
+    channel_values = reader.get_tuple(config).checkpoint["channel_values"]
+
+    assert channel_values["flight_options"] == FLIGHTS
+    assert channel_values["hotel_options"] == HOTELS
+    assert all(type(offer) is FlightOption for offer in channel_values["flight_options"])
+
+
+def test_checkpoints_store_offers_without_field_names(tmp_path):
+    database_path = str(tmp_path / "checkpoints.db")
+    config = {"configurable": {"thread_id": "trip"}}
+    build_graph(PooledSqliteSaver(database_path, serde=OfferRecordSerializer())).invoke({"flight_options": [], "hotel_options": []}, config)
+
+    with sqlite3.connect(database_path) as connection:
+        blobs = [row[0] for row in connection.execute("SELECT checkpoint FROM checkpoints")]
+        blobs += [row[0] for row in connection.execute("SELECT value FROM writes")]
+
+    assert any(b"Hotel A" in blob for blob in blobs)
+    assert not any(b"destination_code" in blob or b"offer_records" in blob for blob in blobs)
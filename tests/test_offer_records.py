@@ -0,0 +1,92 @@
+import operator
+from typing import Annotated, TypedDict
+
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import Overwrite
+
+from checkpointing import OfferRecordSerializer
+from offer_records import FlightOption, HotelOption, merge_offer_lists
+
+
+def make_flight(price, departure="Morning (09:15)", origin_code="FRA", destination_code="JFK", airline="LH"):
+    return FlightOption(
+        airline=airline,
+        route=f"{origin_code} -> {destination_code}",
+        origin_code=origin_code,
+        destination_code=destination_code,
+        price=price,
+        currency="USD",
+        departure=departure,
+        arrival="Afternoon (12:40)",
+        date="2026-11-02",
+        link="https://example.com/flight",
+    )
+
+
+def make_hotel(hotel_id, price, address="New York"):
+    return HotelOption(name=f"Hotel {hotel_id}", price=price, currency="USD", address=address, link="https://example.com/hotel", hotel_id=hotel_id)
+
+
+def test_repeated_offer_keeps_first_position_and_takes_newer_price():
+    first = make_flight(400.0, departure="Morning (09:15)")
+    second = make_flight(300.0, departure="Evening (19:00)")
+    repriced_first = make_flight(450.0, departure="Morning (09:15)")
+
+    merged = merge_offer_lists([first, second], [repriced_first], max_offers_per_group=10)
+
+    assert merged == [repriced_first, second]
+
+
+def test_hotels_are_deduplicated_by_hotel_id():
+    merged = merge_offer_lists([make_hotel("A", 100.0)], [make_hotel("A", 90.0), make_hotel("B", 120.0)], max_offers_per_group=10)
+
+    assert [(hotel.hotel_id, hotel.price) for hotel in merged] == [("A", 90.0), ("B", 120.0)]
+
+
+def test_each_group_keeps_its_cheapest_offers_in_first_seen_order():
+    outbound = [make_flight(price, departure=f"Morning (0{hour}:00)") for hour, price in enumerate([500.0, 200.0, 300.0, 100.0])]
+    inbound = [make_flight(price, departure=f"Evening (1{hour}:00)", origin_code="JFK", destination_code="FRA") for hour, price in enumerate([50.0, 60.0, 70.0])]
+
+    merged = merge_offer_lists([], outbound + inbound, max_offers_per_group=2)
+
+    assert [flight.price for flight in merged] == [200.0, 100.0, 50.0, 60.0]
+
+
+def test_unpriced_offers_are_dropped_before_priced_ones():
+    merged = merge_offer_lists([], [make_hotel("A", None), make_hotel("B", 150.0), make_hotel("C", 90.0)], max_offers_per_group=2)
+
+    assert [hotel.hotel_id for hotel in merged] == ["B", "C"]
+
+
+def test_overwrite_resets_a_merged_channel():
+    class OfferState(TypedDict):
+        offers: Annotated[list, lambda old, new: merge_offer_lists(old, new, 5)]
+        step: Annotated[int, operator.add]
+
+    def add_offers(state):
+        return {"offers": [make_hotel(f"H{state['step']}", 100.0)], "step": 1}
+
+    graph_builder = StateGraph(OfferState)
+    graph_builder.add_node("reset", lambda state: {"offers": Overwrite([])})
+    graph_builder.add_node("add_offers", add_offers)
+    graph_builder.add_edge(START, "reset")
+    graph_builder.add_edge("reset", "add_offers")
+    graph_builder.add_edge("add_offers", END)
+    graph = graph_builder.compile()
+
+    final_state = graph.invoke({"offers": [make_hotel("old", 50.0)], "step": 0})
+
+    assert [hotel.hotel_id for hotel in final_state["offers"]] == ["H0"]
+
+
+def test_checkpoint_serializer_round_trips_offers_compactly():
+    state = {"flight_options": [make_flight(412.5)], "hotel_options": [make_hotel("A", None)], "reset": Overwrite([make_hotel("B", 1.0)])}
+    serializer = OfferRecordSerializer()
+
+    type_name, payload = serializer.dumps_typed(state)
+    restored = serializer.loads_typed((type_name, payload))
+
+    assert restored["flight_options"] == state["flight_options"]
+    assert restored["hotel_options"] == state["hotel_options"]
+    assert restored["reset"].value == state["reset"].value
+    assert b"destination_code" not in payload
@@ -0,0 +1,248 @@
+"""Timing spans for graph nodes, upstream calls and checkpoint writes.
+
+Every span carries a trace id, which is the LangGraph thread id of the
+search it belongs to. Graph nodes set it from their config; code called
+from a node picks it up through a context variable, so upstream calls
+and lookups land in the right trace without passing ids around. Work
+handed to our own thread pools must be submitted with
+contextvars.copy_context().run to keep it.
+
+Spans are kept in memory for the last few traces (for the Streamlit
+waterfall), optionally appended to a JSONL file, and aggregated into
+Prometheus counters and histograms that can be written to a textfile
+collector file and/or served over HTTP. Other components can add gauges
+(queue depths and the like) that are read at every export.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+current_trace_id = contextvars.ContextVar("current_trace_id", default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def thread_id_from_config(config):
+    return ((config or {}).get("configurable") or {}).get("thread_id")
+
+
+def format_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Tracer:
+    def __init__(self, jsonl_path=None, max_traces=50, buckets=DEFAULT_BUCKETS):
+        self.jsonl_path = jsonl_path
+        self.max_traces = max_traces
+        self.buckets = tuple(buckets)
+
+        self._lock = threading.Lock()
+        self._traces = OrderedDict()
+        self._call_counts = defaultdict(int)
+        self._bucket_counts = defaultdict(lambda: [0] * len(self.buckets))
+        self._duration_sums = defaultdict(float)
+        self._duration_counts = defaultdict(int)
+        self._gauges = {}
+        self._jsonl_file = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+        self._exporter_stop = threading.Event()
+
+    @contextmanager
+    def span(self, kind, name, trace_id=None, **attributes):
+        """Time the enclosed block; the span is recorded as "error" if it raises."""
+        started_at = time.time()
+        started_counter = time.perf_counter()
+        status = "ok"
+        try:
+            yield attributes
+        except BaseException as error:
+            status = "cancelled" if isinstance(error, (asyncio.CancelledError, GeneratorExit)) else "error"
+            attributes["error"] = type(error).__name__
+            raise
+        finally:
+            self.record(
+                kind,
+                name,
+                started_at,
+                time.perf_counter() - started_counter,
+                status,
+                trace_id if trace_id is not None else current_trace_id.get(),
+                attributes,
+            )
+
+    def record(self, kind, name, started_at, duration_seconds, status, trace_id, attributes=None):
+        span_record = {
+            "trace_id": trace_id,
+            "kind": kind,
+            "name": name,
+            "start": started_at,
+            "duration_ms": round(duration_seconds * 1000, 3),
+            "status": status,
+            "thread": threading.current_thread().name,
+        }
+        if attributes:
+            span_record["attributes"] = attributes
+
+        metric_key = (kind, name)
+        with self._lock:
+            if trace_id is not None:
+                trace_spans = self._traces.get(trace_id)
+                if trace_spans is None:
+                    trace_spans = self._traces[trace_id] = []
+                    while len(self._traces) > self.max_traces:
+                        self._traces.popitem(last=False)
+                trace_spans.append(span_record)
+
+            self._call_counts[(kind, name, status)] += 1
+            bucket_counts = self._bucket_counts[metric_key]
+            for bucket_index, upper_bound in enumerate(self.buckets):
+                if duration_seconds <= upper_bound:
+                    bucket_counts[bucket_index] += 1
+            self._duration_sums[metric_key] += duration_seconds
+            self._duration_counts[metric_key] += 1
+
+            if self._jsonl_file is not None:
+                self._jsonl_file.write(json.dumps(span_record, default=str) + "\n")
+                self._jsonl_file.flush()
+
+    def get_trace(self, trace_id):
+        with self._lock:
+            return [dict(span_record) for span_record in self._traces.get(trace_id, [])]
+
+    # Hooks
+
+    def trace_node(self, node_name, node_function):
+        """Wrap a graph node so it runs inside a "node" span tagged with its thread id.
+
+        The wrapper takes `config`, which LangGraph only passes to functions
+        whose own signature names it, so functools.wraps is not used here.
+        """
+        if asyncio.iscoroutinefunction(node_function):
+            async def traced_async_node(state, config):
+                trace_token = current_trace_id.set(thread_id_from_config(config))
+                try:
+                    with self.span("node", node_name):
+                        return await node_function(state)
+                finally:
+                    current_trace_id.reset(trace_token)
+
+            traced_async_node.__name__ = node_function.__name__
+            return traced_async_node
+
+        def traced_node(state, config):
+            trace_token = current_trace_id.set(thread_id_from_config(config))
+            try:
+                with self.span("node", node_name):
+                    return node_function(state)
+            finally:
+                current_trace_id.reset(trace_token)
+
+        traced_node.__name__ = node_function.__name__
+        return traced_node
+
+    def wrap(self, kind, name, function):
+        def traced_function(*args, **kwargs):
+            with self.span(kind, name):
+                return function(*args, **kwargs)
+
+        traced_function.__name__ = getattr(function, "__name__", name)
+        return traced_function
+
+    def trace_checkpoint_writes(self, saver):
+        """Time the saver's put/put_writes calls, tagged with the thread id from their config."""
+        for method_name in ("put", "put_writes"):
+            original_method = getattr(saver, method_name)
+
+            def traced_method(config, *args, _original_method=original_method, _method_name=method_name, **kwargs):
+                with self.span("checkpoint", _method_name, trace_id=thread_id_from_config(config)):
+                    return _original_method(config, *args, **kwargs)
+
+            setattr(saver, method_name, traced_method)
+        return saver
+
+    # Export
+
+    def add_gauge(self, metric_name, help_text, label_name, read_values):
+        """Export read_values() -> {label value: number} as a gauge, read at every scrape"""
+        with self._lock:
+            self._gauges[metric_name] = (help_text, label_name, read_values)
+
+    def prometheus_text(self):
+        with self._lock:
+            call_counts = dict(self._call_counts)
+            bucket_counts = {key: list(counts) for key, counts in self._bucket_counts.items()}
+            duration_sums = dict(self._duration_sums)
+            duration_counts = dict(self._duration_counts)
+            gauges = dict(self._gauges)
+
+        lines = [
+            "# HELP travel_planner_calls_total Traced calls by kind, name and status.",
+            "# TYPE travel_planner_calls_total counter",
+        ]
+        for (kind, name, status), count in sorted(call_counts.items()):
+            lines.append(
+                f'travel_planner_calls_total{{kind="{format_label_value(kind)}",'
+                f'name="{format_label_value(name)}",status="{status}"}} {count}'
+            )
+
+        lines += [
+            "# HELP travel_planner_duration_seconds Traced call duration in seconds.",
+            "# TYPE travel_planner_duration_seconds histogram",
+        ]
+        for kind, name in sorted(bucket_counts):
+            labels = f'kind="{format_label_value(kind)}",name="{format_label_value(name)}"'
+            for upper_bound, count in zip(self.buckets, bucket_counts[(kind, name)]):
+                lines.append(f'travel_planner_duration_seconds_bucket{{{labels},le="{upper_bound}"}} {count}')
+            lines.append(f'travel_planner_duration_seconds_bucket{{{labels},le="+Inf"}} {duration_counts[(kind, name)]}')
+            lines.append(f"travel_planner_duration_seconds_sum{{{labels}}} {duration_sums[(kind, name)]:.6f}")
+            lines.append(f"travel_planner_duration_seconds_count{{{labels}}} {duration_counts[(kind, name)]}")
+
+        for metric_name, (help_text, label_name, read_values) in sorted(gauges.items()):
+            lines += [f"# HELP {metric_name} {help_text}", f"# TYPE {metric_name} gauge"]
+            for label_value, value in sorted(read_values().items()):
+                lines.append(f'{metric_name}{{{label_name}="{format_label_value(label_value)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_file(self, textfile_path):
+        temporary_path = textfile_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as textfile:
+            textfile.write(self.prometheus_text())
+        # Renamed into place so a scraper never reads a half-written file.
+        os.replace(temporary_path, textfile_path)
+
+    def start_exporters(self, textfile_path=None, interval_seconds=15, port=None):
+        """Write the textfile every interval_seconds and/or serve /metrics on port."""
+        if textfile_path:
+            def write_forever():
+                while not self._exporter_stop.wait(interval_seconds):
+                    try:
+                        self.write_prometheus_file(textfile_path)
+                    except OSError:
+                        pass
+
+            threading.Thread(target=write_forever, name="metrics-textfile", daemon=True).start()
+
+        if port:
+            tracer = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = tracer.prometheus_text().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            metrics_server = ThreadingHTTPServer(("127.0.0.1", int(port)), MetricsHandler)
+            threading.Thread(target=metrics_server.serve_forever, name="metrics-http", daemon=True).start()
+        return self
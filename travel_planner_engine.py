@@ -0,0 +1,1817 @@
+"""Headless travel planner engine: Amadeus access, search tools and LangGraph workflows.
+
+Importing this module only reads configuration from the environment. The
+Amadeus client, caches, thread pools, tracer and compiled graphs are
+created on first use by their get_*/build_* functions and then shared by
+every caller in the process, so a worker, a test or a batch job can
+import it without Streamlit and only pays for what it uses.
+TravelPlannerWebAPP.py is the Streamlit page on top of it.
+
+    from travel_planner_engine import build_trip_inputs, invoke_trip_search
+    final_state = invoke_trip_search(build_trip_inputs("Paris", "Rome", "EUR", 1500, 2, "2026-11-02", "2026-11-06"), "trip-1")
+"""
+# 1. Environment And Lazily Created Resources
+from dotenv import load_dotenv
+load_dotenv()
+
+import asyncio
+import contextvars
+import inspect
+import os
+import sqlite3
+import sys
+import threading
+import time
+import httpx
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Annotated, TypedDict
+from datetime import datetime, timedelta
+from langchain_core.messages import AnyMessage, AIMessage, RemoveMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import tool
+from langgraph.graph import StateGraph, END, START
+from langgraph.config import get_stream_writer
+from langgraph.graph.message import REMOVE_ALL_MESSAGES, add_messages
+from langgraph.types import Overwrite, Send
+from amadeus import Client, ResponseError
+from airport_codes import AirportCodeCache, normalize_city_keyword
+from airport_index import load_airport_index
+from amadeus_async import AsyncAmadeusTransport, AmadeusTransportError, parse_retry_after
+from amadeus_standin import AmadeusRecorder, AsyncAmadeusStandIn, FixtureStore, DEFAULT_FIXTURES_PATH, create_standin_from_environment
+from checkpointing import CheckpointMaintenance, OfferRecordSerializer, PooledSqliteSaver
+from rate_limit import RetryPolicy, TokenBucket, UpstreamGuard, UpstreamUnavailable
+from result_cache import FetchedResult, QueryResultCache, create_cache_backend, make_query_key
+from single_flight import SingleFlight
+from price_history import PriceHistory
+from cache_warmer import CacheWarmer, SearchDemandLog, parse_hour_windows
+from search_jobs import SearchJobQueue
+from offer_records import FlightOption, HotelOption, merge_offer_lists, offers_to_json, offers_from_json
+from fx_rates import FxRateTable, fetch_rates_from_frankfurter
+from tracing import Tracer
+
+
+def lazy_resource(create_function):
+    """Create the resource on its first call, once per process and arguments, then keep returning it
+
+    The headless counterpart of st.cache_resource. Several threads asking
+    at once still get a single instance. get_x.override(resource) swaps
+    in a replacement (a fake client in a test, a different rate limit in a
+    batch job) before anything else has used it.
+    """
+    create_signature = inspect.signature(create_function)
+    created_resources = {}
+    creation_lock = threading.RLock()
+    
+    def resource_key(args, kwargs):
+        bound_arguments = create_signature.bind(*args, **kwargs)
+        bound_arguments.apply_defaults()
+        return bound_arguments.args
+    
+    def get_resource(*args, **kwargs):
+        key = resource_key(args, kwargs)
+        if key not in created_resources:
+            with creation_lock:
+                if key not in created_resources:
+                    created_resources[key] = create_function(*args, **kwargs)
+        return created_resources[key]
+    
+    def override(resource, *args, **kwargs):
+        with creation_lock:
+            created_resources[resource_key(args, kwargs)] = resource
+    
+    get_resource.__name__ = create_function.__name__
+    get_resource.__doc__ = create_function.__doc__
+    get_resource.override = override
+    return get_resource
+
+
+# 2. AMADEUS API Setup
+
+# "live" calls Amadeus, "standin" replays fixtures / generates offers locally
+# (see amadeus_standin.py), "record" calls Amadeus and saves fixtures.
+AMADEUS_BACKEND = os.environ.get('AMADEUS_BACKEND', 'live')
+
+# Requests per second per API key allowed by each Amadeus Self-Service tier.
+AMADEUS_TIER_RATE_LIMITS = {'test': 10, 'production': 40}
+
+@lazy_resource
+def get_upstream_rate_limiter():
+    tier_rate_limit = AMADEUS_TIER_RATE_LIMITS.get(os.environ.get('AMADEUS_HOSTNAME', 'test'), 10)
+    requests_per_second = float(os.environ.get('AMADEUS_RATE_LIMIT_PER_SECOND', tier_rate_limit))
+    if requests_per_second <= 0:
+        return None
+    burst_capacity = os.environ.get('AMADEUS_RATE_LIMIT_BURST')
+    return TokenBucket(requests_per_second, float(burst_capacity) if burst_capacity else None)
+
+
+def classify_amadeus_error(error):
+    """(status code, Retry-After seconds) for an Amadeus error; status None means no answer arrived"""
+    if isinstance(error, AmadeusTransportError):
+        return error.status_code, error.retry_after
+    if isinstance(error, ResponseError):
+        response = error.response
+        response_headers = getattr(response, 'headers', None) or {}
+        retry_after = next(
+            (value for name, value in response_headers.items() if name.lower() == 'retry-after'), None
+        )
+        return getattr(response, 'status_code', None), parse_retry_after(retry_after)
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return None, None
+    return None
+
+
+@lazy_resource
+def get_upstream_guard():
+    retry_policy = RetryPolicy(
+        max_attempts=int(os.environ.get('AMADEUS_RETRY_MAX_ATTEMPTS', '3')),
+        base_delay_seconds=float(os.environ.get('AMADEUS_RETRY_BASE_DELAY_SECONDS', '0.25')),
+        max_delay_seconds=float(os.environ.get('AMADEUS_RETRY_MAX_DELAY_SECONDS', '8'))
+    )
+    return UpstreamGuard(
+        classify_amadeus_error,
+        retry_policy=retry_policy,
+        rate_limiter=get_upstream_rate_limiter(),
+        failure_threshold=int(os.environ.get('AMADEUS_CIRCUIT_FAILURE_THRESHOLD', '5')),
+        reset_seconds=float(os.environ.get('AMADEUS_CIRCUIT_RESET_SECONDS', '30'))
+    )
+
+
+@lazy_resource
+def get_amadeus_client():
+    if AMADEUS_BACKEND == 'standin':
+        return create_standin_from_environment()
+    
+    try:
+        client = Client(
+            client_id=os.environ.get('AMADEUS_CLIENT_ID'),
+            client_secret=os.environ.get('AMADEUS_CLIENT_SECRET')
+        )
+    except Exception:
+        return None
+    
+    if AMADEUS_BACKEND == 'record':
+        fixtures_path = os.environ.get('AMADEUS_STANDIN_FIXTURES', DEFAULT_FIXTURES_PATH)
+        return AmadeusRecorder(client, FixtureStore(fixtures_path))
+    return client
+
+
+@lazy_resource
+def get_amadeus_transport():
+    if AMADEUS_BACKEND == 'standin':
+        return AsyncAmadeusStandIn(get_amadeus_client(), rate_limiter=get_upstream_rate_limiter())
+    if AMADEUS_BACKEND == 'record':
+        # Recording goes through the synchronous client only.
+        return None
+    
+    client_id = os.environ.get('AMADEUS_CLIENT_ID')
+    client_secret = os.environ.get('AMADEUS_CLIENT_SECRET')
+    
+    if not client_id or not client_secret:
+        return None
+    
+    return AsyncAmadeusTransport(
+        client_id=client_id,
+        client_secret=client_secret,
+        hostname=os.environ.get('AMADEUS_HOSTNAME', 'test'),
+        rate_limiter=get_upstream_rate_limiter()
+    )
+
+
+@lazy_resource
+def get_tracer():
+    planner_tracer = Tracer(jsonl_path=os.environ.get('TRACE_JSONL_PATH') or None)
+    return planner_tracer.start_exporters(
+        textfile_path=os.environ.get('METRICS_TEXTFILE_PATH') or None,
+        interval_seconds=float(os.environ.get('METRICS_EXPORT_INTERVAL_SECONDS', '15')),
+        port=int(os.environ.get('METRICS_PORT', '0')) or None
+    )
+
+
+@lazy_resource
+def get_request_coalescer():
+    # Shared by every session, so concurrent identical searches make one upstream call.
+    return SingleFlight()
+
+
+def call_amadeus(endpoint_name, api_method, **params):
+    """Every synchronous Amadeus request goes through here so it is rate limited, retried and traced
+
+    Raises UpstreamUnavailable when the endpoint is throttling or failing
+    after retries, or its circuit is open.
+    """
+    rate_limiter = get_upstream_rate_limiter()
+    
+    def attempt_call():
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        with get_tracer().span("upstream", endpoint_name):
+            return api_method(**params)
+    
+    return get_upstream_guard().call(endpoint_name, attempt_call)
+
+
+async def call_amadeus_async(endpoint_name, **params):
+    """Async counterpart of call_amadeus; the transport applies the rate budget itself"""
+    async def attempt_call():
+        with get_tracer().span("upstream", endpoint_name):
+            return await getattr(get_amadeus_transport(), endpoint_name)(**params)
+    
+    return await get_upstream_guard().acall(endpoint_name, attempt_call)
+
+# 3. Helping Functions
+
+@lazy_resource
+def get_airport_code_cache():
+    return AirportCodeCache()
+
+
+def look_up_airport_code_upstream(city_name):
+    api_response = get_request_coalescer().do(
+        make_query_key("locations", normalize_city_keyword(city_name)),
+        lambda: call_amadeus(
+            'locations', get_amadeus_client().reference_data.locations.get,
+            keyword=city_name, 
+            subType='CITY'
+        )
+    )
+    
+    if api_response.data:
+        return api_response.data[0]['iataCode']
+    return None
+
+
+@lazy_resource
+def get_airport_index():
+    return load_airport_index()
+
+
+def resolve_location_code(location_text):
+    """IATA code for a city or airport as typed or picked from the suggestions, or None
+
+    The bundled airport index answers first, then the code cache, then Amadeus.
+    """
+    indexed_code = get_airport_index().resolve(location_text)
+    if indexed_code:
+        return indexed_code
+    lookup_function = look_up_airport_code_upstream if get_amadeus_client() is not None else None
+    return get_airport_code_cache().resolve(location_text, lookup_function)
+
+
+def convert_city_to_airport_code(city_name):
+    with get_tracer().span("lookup", "iata_code", city=city_name):
+        airport_code = resolve_location_code(city_name)
+    
+    if airport_code:
+        return airport_code
+    return city_name
+
+
+@lazy_resource
+def get_fx_rate_table():
+    fetch_function = get_amadeus_client().fetch_rates if AMADEUS_BACKEND == 'standin' else fetch_rates_from_frankfurter
+    return FxRateTable(fetch_function=get_tracer().wrap("upstream", "fx_rates", fetch_function))
+
+
+def convert_currency(amount, from_currency, to_currency):
+    """Convert currency using the daily Frankfurter rate table (free, no API key needed)"""
+    return get_fx_rate_table().convert(amount, from_currency, to_currency)
+
+
+def convert_prices_to_currency(options, to_currency):
+    """Convert every option's price into to_currency with a single rate table lookup"""
+    return get_fx_rate_table().convert_items(options, to_currency)
+
+
+def check_if_dates_are_valid(arrival_date_string, return_date_string):
+    try:
+        today = datetime.now().date()
+        arrival_date = datetime.strptime(arrival_date_string, "%Y-%m-%d").date()
+        return_date = datetime.strptime(return_date_string, "%Y-%m-%d").date()
+        
+        if arrival_date < today:
+            error_message = "Arrival date cannot be in the past. Please select a future date."
+            return False, error_message
+        
+        if return_date < today:
+            error_message = "Return date cannot be in the past. Please select a future date."
+            return False, error_message
+        
+        if return_date <= arrival_date:
+            error_message = "Return date must be after arrival date."
+            return False, error_message
+        
+        return True, "Dates are valid"
+    except ValueError:
+        error_message = "Invalid date format. Please use YYYY-MM-DD format."
+        return False, error_message
+
+
+MAX_TRIP_LEGS = int(os.environ.get("MAX_TRIP_LEGS", "6"))
+
+
+def check_if_legs_are_valid(legs):
+    if not 1 <= len(legs) <= MAX_TRIP_LEGS:
+        return False, f"A multi-city trip needs between 1 and {MAX_TRIP_LEGS} legs."
+    
+    today = datetime.now().date()
+    previous_date = None
+    for leg_number, leg in enumerate(legs, start=1):
+        if not leg.get('origin') or not leg.get('destination'):
+            return False, f"Leg {leg_number} needs both an origin and a destination."
+        try:
+            leg_date = datetime.strptime(leg.get('date', ''), "%Y-%m-%d").date()
+        except ValueError:
+            return False, f"Leg {leg_number} has an invalid date. Please use YYYY-MM-DD format."
+        if leg_date < today:
+            return False, f"Leg {leg_number} departs in the past. Please select a future date."
+        if previous_date is not None and leg_date < previous_date:
+            return False, f"Leg {leg_number} departs before leg {leg_number - 1}."
+        previous_date = leg_date
+    
+    return True, "Legs are valid"
+
+
+def replace_old_value_with_new(old_value, new_value):
+    return new_value
+
+
+def merge_dictionaries(old_value, new_value):
+    return {**old_value, **new_value}
+
+
+# Offers kept in the graph state per leg / per hotel city. Repeated offers are
+# merged, so a reused or resumed thread keeps a constant-size state and checkpoint.
+# Larger result sets (large flight mode, full-city hotels) reach the page on the
+# "custom" stream instead; see keep_best_offers.
+MAX_FLIGHTS_PER_LEG = int(os.environ.get("MAX_FLIGHTS_PER_LEG", "20"))
+MAX_HOTELS_PER_CITY = int(os.environ.get("MAX_HOTELS_PER_CITY", "50"))
+
+
+def merge_flight_options(old_flights, new_flights):
+    return merge_offer_lists(old_flights, new_flights, MAX_FLIGHTS_PER_LEG)
+
+
+def merge_hotel_options(old_hotels, new_hotels):
+    return merge_offer_lists(old_hotels, new_hotels, MAX_HOTELS_PER_CITY)
+
+
+def keep_best_offers(channel_name, offers, max_offers_per_group):
+    """The part of a node's offers that goes into state: the cheapest max_offers_per_group per leg or city
+
+    Node updates are checkpointed before any reducer runs, so the node
+    caps them itself. If that drops offers, the full list is published on
+    the "custom" stream, which stream_trip_search hands to the page and
+    no checkpoint stores.
+    """
+    best_offers = merge_offer_lists([], offers, max_offers_per_group)
+    if len(best_offers) < len(offers):
+        get_stream_writer()({"full_offers": (channel_name, offers)})
+    return best_offers
+
+
+def build_trip_inputs(origin, destination, currency, budget, num_people, arrival_date_str, return_date_str, hotel_search_mode="", flight_search_mode=""):
+    try:
+        arrival_day = datetime.strptime(arrival_date_str, "%Y-%m-%d").date()
+        return_day = datetime.strptime(return_date_str, "%Y-%m-%d").date()
+        stay_duration = str((return_day - arrival_day).days)
+    except ValueError:
+        stay_duration = ""
+    
+    return {
+        "messages": [],
+        "origin": origin,
+        "destination": destination,
+        "currency": currency,
+        "budget": str(budget),
+        "num_people": str(num_people),
+        "arrival_date": arrival_date_str,
+        "return_date": return_date_str,
+        "stay_duration": stay_duration,
+        "flight_options": [],
+        "hotel_options": [],
+        "hotel_search_mode": hotel_search_mode,
+        "flight_search_mode": flight_search_mode,
+        "date_error": "",
+        "legs": [],
+        "leg_flights": {},
+        "stay_hotels": {},
+        "itinerary": []
+    }
+
+
+def build_multi_city_inputs(legs, currency, budget, num_people, hotel_search_mode="", flight_search_mode=""):
+    """Inputs for an ordered list of {"origin", "destination", "date"} legs with a hotel at every stop
+
+    origin/destination/dates are filled from the first and last legs so
+    code that only knows round trips still sees a sensible trip.
+    """
+    legs = [
+        {"origin": leg['origin'], "destination": leg['destination'], "date": leg['date']}
+        for leg in legs
+    ]
+    first_leg, last_leg = legs[0], legs[-1]
+    return {
+        **build_trip_inputs(
+            first_leg['origin'], first_leg['destination'], currency, budget, num_people,
+            first_leg['date'], last_leg['date'], hotel_search_mode, flight_search_mode
+        ),
+        "legs": legs
+    }
+
+# 4. Defining the State Schema
+
+class TravelAgentState(TypedDict):
+    messages: Annotated[List[AnyMessage], add_messages]
+    origin: Annotated[str, replace_old_value_with_new]
+    destination: Annotated[str, replace_old_value_with_new]
+    currency: Annotated[str, replace_old_value_with_new]
+    budget: Annotated[str, replace_old_value_with_new]
+    num_people: Annotated[str, replace_old_value_with_new]
+    arrival_date: Annotated[str, replace_old_value_with_new]
+    stay_duration: Annotated[str, replace_old_value_with_new]
+    return_date: Annotated[str, replace_old_value_with_new]
+    flight_options: Annotated[List[FlightOption], merge_flight_options]
+    hotel_options: Annotated[List[HotelOption], merge_hotel_options]
+    hotel_search_mode: Annotated[str, replace_old_value_with_new]
+    flight_search_mode: Annotated[str, replace_old_value_with_new]
+    date_error: Annotated[str, replace_old_value_with_new]
+    # Multi-city trips: the legs in order, each leg's flights and each stop's
+    # hotels keyed by position (as strings), and the itinerary built from them.
+    legs: Annotated[List[dict], replace_old_value_with_new]
+    leg_flights: Annotated[dict, merge_dictionaries]
+    stay_hotels: Annotated[dict, merge_dictionaries]
+    itinerary: Annotated[List[dict], replace_old_value_with_new]
+
+# 5. Implementing The Core Tools
+
+def format_time_of_day(timestamp):
+    if 'T' in timestamp:
+        return timestamp.split('T')[1][:5]
+    return timestamp
+
+
+def build_flight_results(flight_offers, origin_airport_code, destination_airport_code, date, currency, max_results=3):
+    flight_results = []
+    
+    for flight in flight_offers[:max_results]:
+        flight_price = float(flight['price']['total'])
+        flight_currency = flight['price']['currency']
+        
+        flight_segments = flight['itineraries'][0]['segments']
+        airline_code = flight_segments[0]['carrierCode']
+        
+        departure_time = format_time_of_day(flight_segments[0]['departure']['at'])
+        arrival_time = format_time_of_day(flight_segments[-1]['arrival']['at'])
+        
+        try:
+            date_object = datetime.strptime(date, "%Y-%m-%d")
+            formatted_date = date_object.strftime("%y%m%d")
+        except:
+            formatted_date = date.replace("-", "")[2:]
+        
+        skyscanner_url = (
+            f"https://www.skyscanner.com/transport/flights/"
+            f"{origin_airport_code.lower()}/{destination_airport_code.lower()}/{formatted_date}/"
+            f"?adults=1&cabinclass=economy&rtn=0"
+        )
+        
+        flight_info = FlightOption(
+            airline=airline_code,
+            route=f"{origin_airport_code} -> {destination_airport_code}",
+            origin_code=origin_airport_code,
+            destination_code=destination_airport_code,
+            price=flight_price,
+            currency=flight_currency,
+            departure=departure_time,
+            arrival=arrival_time,
+            date=date,
+            link=skyscanner_url,
+            stops=len(flight_segments) - 1
+        )
+        
+        flight_results.append(flight_info)
+    
+    return convert_prices_to_currency(flight_results, currency)
+
+
+def build_booking_url(search_text, checkin_date, checkout_date, currency):
+    search_text_url_encoded = search_text.replace(" ", "+")
+    return f"https://www.booking.com/searchresults.html?ss={search_text_url_encoded}&checkin={checkin_date}&checkout={checkout_date}&selected_currency={currency}"
+
+
+def build_hotel_info(hotel_name, location, price, currency, booking_url, distance_to_center="N/A", hotel_id=""):
+    return HotelOption(
+        name=hotel_name,
+        price=price,
+        currency=currency,
+        address=location,
+        link=booking_url,
+        distance_to_center=distance_to_center,
+        hotel_id=hotel_id
+    )
+
+
+def build_city_fallback_hotel(location, checkin_date, checkout_date, currency):
+    fallback_url = build_booking_url(location, checkin_date, checkout_date, currency)
+    return build_hotel_info(f"Hotels in {location}", location, None, currency, fallback_url, "Various")
+
+
+def build_hotel_results(hotel_offers, location, checkin_date, checkout_date, currency):
+    hotel_results = []
+    
+    for hotel_offer in hotel_offers:
+        hotel_name = hotel_offer['hotel']['name']
+        hotel_id = hotel_offer['hotel'].get('hotelId', '')
+        
+        hotel_price = None
+        hotel_currency = currency
+        
+        if hotel_offer.get('offers') and len(hotel_offer['offers']) > 0:
+            hotel_price = float(hotel_offer['offers'][0]['price']['total'])
+            hotel_currency = hotel_offer['offers'][0]['price']['currency']
+        
+        booking_url = build_booking_url(f"{hotel_name} {location}", checkin_date, checkout_date, currency)
+        hotel_results.append(
+            build_hotel_info(hotel_name, location, hotel_price, hotel_currency, booking_url, hotel_id=hotel_id)
+        )
+    
+    return convert_prices_to_currency(hotel_results, currency)
+
+
+def build_unpriced_hotel_results(hotels, location, checkin_date, checkout_date, currency):
+    hotel_results = []
+    
+    for hotel in hotels:
+        hotel_name = hotel.get('name', 'Unknown Hotel')
+        booking_url = build_booking_url(f"{hotel_name} {location}", checkin_date, checkout_date, currency)
+        hotel_results.append(
+            build_hotel_info(hotel_name, location, None, currency, booking_url, hotel_id=hotel.get('hotelId', ''))
+        )
+    
+    return hotel_results
+
+
+RESULT_CACHE_BACKEND = os.environ.get("RESULT_CACHE_BACKEND", "memory")
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "500"))
+FLIGHT_CACHE_TTL_SECONDS = float(os.environ.get("FLIGHT_CACHE_TTL_SECONDS", "300"))
+HOTEL_CACHE_TTL_SECONDS = float(os.environ.get("HOTEL_CACHE_TTL_SECONDS", "900"))
+RESULT_CACHE_STALE_SECONDS = float(os.environ.get("RESULT_CACHE_STALE_SECONDS", "1800"))
+
+# "sample" prices the first 5 hotels of the city; "full_city" prices every hotel in chunks.
+HOTEL_SEARCH_MODE = os.environ.get("HOTEL_SEARCH_MODE", "sample")
+HOTEL_OFFERS_CHUNK_SIZE = int(os.environ.get("HOTEL_OFFERS_CHUNK_SIZE", "20"))
+HOTEL_OFFERS_MAX_CONCURRENCY = int(os.environ.get("HOTEL_OFFERS_MAX_CONCURRENCY", "4"))
+HOTEL_FULL_CITY_MAX_HOTELS = int(os.environ.get("HOTEL_FULL_CITY_MAX_HOTELS", "300"))
+
+# "sample" asks Amadeus for the first 3 offers of a leg; "large" for up to
+# FLIGHT_LARGE_MAX_RESULTS (Amadeus allows 250), which the page filters,
+# sorts and pages through with offer_table.FlightOfferTable.
+FLIGHT_SEARCH_MODE = os.environ.get("FLIGHT_SEARCH_MODE", "sample")
+FLIGHT_SAMPLE_MAX_RESULTS = 3
+FLIGHT_LARGE_MAX_RESULTS = min(int(os.environ.get("FLIGHT_LARGE_MAX_RESULTS", "250")), 250)
+
+
+def flight_max_results(search_mode=None):
+    return FLIGHT_LARGE_MAX_RESULTS if (search_mode or FLIGHT_SEARCH_MODE) == "large" else FLIGHT_SAMPLE_MAX_RESULTS
+
+
+def has_search_results(offers):
+    # Failed searches come back empty and must not be served from the cache.
+    return bool(offers)
+
+
+def create_offer_result_cache(table_name, fresh_ttl_seconds):
+    return QueryResultCache(
+        create_cache_backend(
+            RESULT_CACHE_BACKEND, RESULT_CACHE_MAX_ENTRIES, table_name=table_name,
+            encode=offers_to_json, decode=offers_from_json
+        ),
+        fresh_ttl_seconds=fresh_ttl_seconds,
+        stale_ttl_seconds=RESULT_CACHE_STALE_SECONDS,
+        should_cache=has_search_results,
+        fallback_errors=(UpstreamUnavailable,)
+    )
+
+
+# Every upstream search is appended to the price history. A leg or hotel
+# search whose newest recorded fetch is younger than this is answered from
+# the history instead, so re-checking a trip only refreshes what went stale.
+PRICE_HISTORY_FRESH_SECONDS = float(os.environ.get("PRICE_HISTORY_FRESH_SECONDS", "900"))
+
+
+@lazy_resource
+def get_price_history():
+    return PriceHistory()
+
+
+def flight_query_key(origin, destination, date, currency, search_mode=None):
+    flight_query_kind = "flight_large" if (search_mode or FLIGHT_SEARCH_MODE) == "large" else "flight"
+    return make_query_key(flight_query_kind, origin, destination, date, currency)
+
+
+def hotel_query_key(location, checkin_date, checkout_date, currency, search_mode=None):
+    hotel_query_kind = "hotel_full_city" if (search_mode or HOTEL_SEARCH_MODE) == "full_city" else "hotel"
+    return make_query_key(hotel_query_kind, location, checkin_date, checkout_date, currency)
+
+
+def record_price_history(query_key, offer_kind, fetched_offers):
+    """Append a fetch to the price history; a failed write is traced and never loses the offers"""
+    try:
+        with get_tracer().span("history", "record", query=query_key):
+            get_price_history().record(query_key, offer_kind, fetched_offers)
+    except sqlite3.Error:
+        # The search itself succeeded; a locked or full cache database only costs this history row.
+        pass
+
+
+def fetch_with_price_history(query_key, offer_kind, fetch_function, use_history=True):
+    """Recorded offers for query_key if fresh enough, else fetch_function() appended to the history
+
+    Recorded offers come back as a FetchedResult dated by their fetch, so
+    the result cache ages them from then and not from now.
+    """
+    recorded_fetch = get_price_history().latest_fetch(query_key, PRICE_HISTORY_FRESH_SECONDS) if use_history else None
+    if recorded_fetch is not None:
+        return FetchedResult(*recorded_fetch)
+    
+    fetched_offers = fetch_function()
+    record_price_history(query_key, offer_kind, fetched_offers)
+    return fetched_offers
+
+
+async def fetch_with_price_history_async(query_key, offer_kind, async_fetch_function, use_history=True):
+    recorded_fetch = get_price_history().latest_fetch(query_key, PRICE_HISTORY_FRESH_SECONDS) if use_history else None
+    if recorded_fetch is not None:
+        return FetchedResult(*recorded_fetch)
+    
+    fetched_offers = await async_fetch_function()
+    record_price_history(query_key, offer_kind, fetched_offers)
+    return fetched_offers
+
+
+def find_through_caches(result_cache, query_key, offer_kind, fetch_function):
+    """Result cache, then coalesced with identical searches, then the price history, then fetch_function
+
+    A stale entry's background refresh skips the history: the newest
+    recorded fetch is no younger than the entry being refreshed.
+    """
+    def fetch_via(use_history):
+        return lambda: get_request_coalescer().do(
+            query_key, lambda: fetch_with_price_history(query_key, offer_kind, fetch_function, use_history)
+        )
+    return result_cache.get_or_fetch(query_key, fetch_via(True), refresh_function=fetch_via(False))
+
+
+async def find_through_caches_async(result_cache, query_key, offer_kind, async_fetch_function):
+    def fetch_via(use_history):
+        return lambda: get_request_coalescer().ado(
+            query_key, lambda: fetch_with_price_history_async(query_key, offer_kind, async_fetch_function, use_history)
+        )
+    return await result_cache.aget_or_fetch(query_key, fetch_via(True), async_refresh_function=fetch_via(False))
+
+
+def trip_price_trends(origin, destination, arrival_date, return_date, currency="USD", search_mode=None, flight_search_mode=None):
+    """Cheapest price of every recorded fetch of the trip's outbound, return and hotel searches"""
+    trip_queries = {
+        f"Outbound {origin} → {destination}": flight_query_key(origin, destination, arrival_date, currency, flight_search_mode),
+        f"Return {destination} → {origin}": flight_query_key(destination, origin, return_date, currency, flight_search_mode),
+        f"Hotels in {destination} (per night)": hotel_query_key(destination, arrival_date, return_date, currency, search_mode),
+    }
+    return [
+        {"series": series_name, **trend_point}
+        for series_name, query_key in trip_queries.items()
+        for trend_point in get_price_history().price_trend(query_key)
+    ]
+
+
+# Every validated search is logged so the cache warmer can learn which
+# routes and dates are popular; see cache_warmer.py. The warmer only runs
+# inside CACHE_WARMER_HOURS (local time), which should end when traffic
+# picks up: what it fetches stays fresh for PRICE_HISTORY_FRESH_SECONDS.
+CACHE_WARMER_ENABLED = os.environ.get("CACHE_WARMER_ENABLED", "0") == "1"
+CACHE_WARMER_SEED_PATH = os.environ.get("CACHE_WARMER_SEED_PATH") or None
+CACHE_WARMER_HOURS = os.environ.get("CACHE_WARMER_HOURS", "5-7")
+CACHE_WARMER_CALLS_PER_MINUTE = float(os.environ.get("CACHE_WARMER_CALLS_PER_MINUTE", "30"))
+CACHE_WARMER_MAX_CALLS_PER_ROUND = int(os.environ.get("CACHE_WARMER_MAX_CALLS_PER_ROUND", "300"))
+CACHE_WARMER_TOP_SEARCHES = int(os.environ.get("CACHE_WARMER_TOP_SEARCHES", "50"))
+CACHE_WARMER_LOOKBACK_DAYS = float(os.environ.get("CACHE_WARMER_LOOKBACK_DAYS", "7"))
+CACHE_WARMER_INTERVAL_SECONDS = float(os.environ.get("CACHE_WARMER_INTERVAL_SECONDS", "600"))
+
+
+@lazy_resource
+def get_search_demand_log():
+    return SearchDemandLog()
+
+
+def list_trip_searches(state):
+    """(kind, query key, search params) for every flight leg and hotel stay a trip state searches"""
+    user_currency = state.get('currency', 'USD')
+    search_mode = state.get('hotel_search_mode') or None
+    flight_search_mode = state.get('flight_search_mode') or None
+    
+    if state.get('legs'):
+        flight_searches = [(leg['origin'], leg['destination'], leg['date']) for leg in state['legs']]
+        hotel_searches = [(city, checkin_date, checkout_date) for _, city, checkin_date, checkout_date in list_trip_stays(state['legs'])]
+    else:
+        flight_searches = [
+            (state['origin'], state['destination'], state['arrival_date']),
+            (state['destination'], state['origin'], state['return_date'])
+        ]
+        hotel_searches = [(state['destination'], state['arrival_date'], state['return_date'])]
+    
+    trip_searches = [
+        ("flight", flight_query_key(origin, destination, date, user_currency, flight_search_mode),
+         {"origin": origin, "destination": destination, "date": date, "currency": user_currency, "search_mode": flight_search_mode})
+        for origin, destination, date in flight_searches
+    ]
+    trip_searches += [
+        ("hotel", hotel_query_key(location, checkin_date, checkout_date, user_currency, search_mode),
+         {"location": location, "checkin_date": checkin_date, "checkout_date": checkout_date, "currency": user_currency, "search_mode": search_mode})
+        for location, checkin_date, checkout_date in hotel_searches
+    ]
+    return trip_searches
+
+
+def record_search_demand(state):
+    get_search_demand_log().record_searches(list_trip_searches(state), PRICE_HISTORY_FRESH_SECONDS)
+
+
+@lazy_resource
+def get_cache_warmer():
+    """The background warmer, configured from CACHE_WARMER_*; call .start() to run it"""
+    return CacheWarmer(
+        sys.modules[__name__],
+        get_search_demand_log(),
+        seed_path=CACHE_WARMER_SEED_PATH,
+        top_searches=CACHE_WARMER_TOP_SEARCHES,
+        lookback_days=CACHE_WARMER_LOOKBACK_DAYS,
+        calls_per_minute=CACHE_WARMER_CALLS_PER_MINUTE,
+        max_calls_per_round=CACHE_WARMER_MAX_CALLS_PER_ROUND,
+        hour_windows=parse_hour_windows(CACHE_WARMER_HOURS),
+        interval_seconds=CACHE_WARMER_INTERVAL_SECONDS
+    )
+
+
+@lazy_resource
+def get_flight_result_cache():
+    return create_offer_result_cache("flight_result_cache", FLIGHT_CACHE_TTL_SECONDS)
+
+
+@lazy_resource
+def get_hotel_result_cache():
+    return create_offer_result_cache("hotel_result_cache", HOTEL_CACHE_TTL_SECONDS)
+
+
+def find_flights(origin, destination, date, currency="USD", search_mode=None):
+    """In-process flight search returning FlightOption records (no JSON round trip)"""
+    query_key = flight_query_key(origin, destination, date, currency, search_mode)
+    try:
+        return find_through_caches(
+            get_flight_result_cache(), query_key, "flight",
+            lambda: fetch_flight_results(origin, destination, date, currency, search_mode)
+        )
+    except UpstreamUnavailable:
+        # Amadeus is unhealthy and nothing is cached for this query, not even an expired entry.
+        return []
+
+
+def find_hotels(location, checkin_date, checkout_date, currency="USD", search_mode=None, on_chunk=None):
+    """In-process hotel search returning HotelOption records (no JSON round trip)
+
+    In full_city mode on_chunk is called with each chunk of hotels as it is
+    priced, so callers can show the first results before the search ends.
+    """
+    if (search_mode or HOTEL_SEARCH_MODE) != "full_city":
+        query_key = hotel_query_key(location, checkin_date, checkout_date, currency, search_mode)
+        try:
+            return find_through_caches(
+                get_hotel_result_cache(), query_key, "hotel",
+                lambda: fetch_hotel_results(location, checkin_date, checkout_date, currency)
+            )
+        except UpstreamUnavailable:
+            return []
+    
+    query_key = hotel_query_key(location, checkin_date, checkout_date, currency, search_mode)
+    caller_thread_id = threading.get_ident()
+    
+    def fetch_full_city():
+        # Background stale refreshes run on another thread and must not stream to a finished caller.
+        chunk_callback = on_chunk if threading.get_ident() == caller_thread_id else None
+        hotel_results = []
+        for hotel_chunk in stream_full_city_hotel_results(location, checkin_date, checkout_date, currency):
+            hotel_results.extend(hotel_chunk)
+            if chunk_callback is not None:
+                chunk_callback(hotel_chunk)
+        return sort_hotels_by_price(hotel_results)
+    
+    # Callers that join an in-flight full-city search get its final list, not its chunks.
+    try:
+        return find_through_caches(get_hotel_result_cache(), query_key, "hotel", fetch_full_city)
+    except UpstreamUnavailable:
+        return []
+
+
+@tool
+def search_flight(origin, destination, date, currency="USD"):
+    """Search for flights between two cities on a specific date"""
+    return offers_to_json(find_flights(origin, destination, date, currency))
+
+
+@tool
+def search_hotel(location, checkin_date, checkout_date, currency="USD"):
+    """Search for hotels in a city for specific dates"""
+    return offers_to_json(find_hotels(location, checkin_date, checkout_date, currency))
+
+
+def fetch_flight_results(origin, destination, date, currency="USD", search_mode=None):
+    amadeus_client = get_amadeus_client()
+    if amadeus_client is None:
+        return []
+    
+    try:
+        origin_airport_code = convert_city_to_airport_code(origin)
+        destination_airport_code = convert_city_to_airport_code(destination)
+        
+        api_response = call_amadeus(
+            'flight_offers_search', amadeus_client.shopping.flight_offers_search.get,
+            originLocationCode=origin_airport_code,
+            destinationLocationCode=destination_airport_code,
+            departureDate=date,
+            adults=1,
+            currencyCode=currency,
+            max=flight_max_results(search_mode)
+        )
+        
+        flight_results = build_flight_results(
+            api_response.data, origin_airport_code, destination_airport_code, date, currency, flight_max_results(search_mode)
+        )
+        
+        return flight_results
+    
+    except UpstreamUnavailable:
+        raise
+    except ResponseError:
+        return []
+    except Exception:
+        return []
+
+def fetch_hotel_results(location, checkin_date, checkout_date, currency="USD"):
+    amadeus_client = get_amadeus_client()
+    if amadeus_client is None:
+        return []
+    
+    try:
+        city_airport_code = convert_city_to_airport_code(location)
+        
+        hotels_api_response = call_amadeus(
+            'hotels_by_city', amadeus_client.reference_data.locations.hotels.by_city.get,
+            cityCode=city_airport_code
+        )
+        
+        if not hotels_api_response.data:
+            fallback_hotel = build_city_fallback_hotel(location, checkin_date, checkout_date, currency)
+            return [fallback_hotel]
+        
+        hotels_to_price = hotels_api_response.data[:5]
+        hotel_ids_joined = ','.join(hotel['hotelId'] for hotel in hotels_to_price)
+        
+        try:
+            offers_api_response = call_amadeus(
+                'hotel_offers_search', amadeus_client.shopping.hotel_offers_search.get,
+                hotelIds=hotel_ids_joined,
+                checkInDate=checkin_date,
+                checkOutDate=checkout_date,
+                adults=1,
+                currency=currency
+            )
+            
+            hotel_results = build_hotel_results(
+                offers_api_response.data, location, checkin_date, checkout_date, currency
+            )
+        
+        except ResponseError:
+            # An unhealthy upstream raises instead, so the cache serves its last priced entry.
+            hotel_results = build_unpriced_hotel_results(
+                hotels_to_price, location, checkin_date, checkout_date, currency
+            )
+        
+        return hotel_results
+    
+    except UpstreamUnavailable:
+        raise
+    except ResponseError:
+        return []
+    except Exception:
+        return []
+
+
+def sort_hotels_by_price(hotels):
+    """Priced hotels cheapest first, then the unpriced ones in their original order"""
+    return sorted(hotels, key=lambda hotel: (hotel.price is None, hotel.price or 0))
+
+
+def split_into_chunks(items, chunk_size):
+    return [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+
+
+@lazy_resource
+def get_hotel_offers_pool():
+    return ThreadPoolExecutor(max_workers=HOTEL_OFFERS_MAX_CONCURRENCY, thread_name_prefix="hotel-offers")
+
+
+def price_hotel_chunk(hotel_chunk, location, checkin_date, checkout_date, currency):
+    """Price one chunk of hotels; a rejected request leaves only this chunk unpriced
+
+    UpstreamUnavailable is raised rather than swallowed, so an outage fails
+    the whole search and the cache serves its last priced entry instead of
+    storing a list without prices.
+    """
+    try:
+        offers_api_response = call_amadeus(
+            'hotel_offers_search', get_amadeus_client().shopping.hotel_offers_search.get,
+            hotelIds=','.join(hotel['hotelId'] for hotel in hotel_chunk),
+            checkInDate=checkin_date,
+            checkOutDate=checkout_date,
+            adults=1,
+            currency=currency
+        )
+        return build_hotel_results(offers_api_response.data, location, checkin_date, checkout_date, currency)
+    except UpstreamUnavailable:
+        raise
+    except Exception:
+        return build_unpriced_hotel_results(hotel_chunk, location, checkin_date, checkout_date, currency)
+
+
+def stream_full_city_hotel_results(location, checkin_date, checkout_date, currency="USD"):
+    """Yield lists of HotelOption records for every hotel in the city, one chunk at a time
+
+    The city's hotel list is split into HOTEL_OFFERS_CHUNK_SIZE ids per
+    hotel_offers_search request, and at most HOTEL_OFFERS_MAX_CONCURRENCY
+    chunks are in flight. Chunks are yielded in the order they finish.
+    """
+    amadeus_client = get_amadeus_client()
+    if amadeus_client is None:
+        return
+    
+    try:
+        city_airport_code = convert_city_to_airport_code(location)
+        hotels_api_response = call_amadeus(
+            'hotels_by_city', amadeus_client.reference_data.locations.hotels.by_city.get,
+            cityCode=city_airport_code
+        )
+    except UpstreamUnavailable:
+        raise
+    except Exception:
+        return
+    
+    if not hotels_api_response.data:
+        yield [build_city_fallback_hotel(location, checkin_date, checkout_date, currency)]
+        return
+    
+    hotel_chunks = split_into_chunks(hotels_api_response.data[:HOTEL_FULL_CITY_MAX_HOTELS], HOTEL_OFFERS_CHUNK_SIZE)
+    chunk_futures = [
+        get_hotel_offers_pool().submit(
+            contextvars.copy_context().run,
+            price_hotel_chunk, hotel_chunk, location, checkin_date, checkout_date, currency
+        )
+        for hotel_chunk in hotel_chunks
+    ]
+    
+    try:
+        for chunk_future in as_completed(chunk_futures):
+            yield chunk_future.result()
+    finally:
+        # The caller stopped reading; chunks that have not started are dropped.
+        for chunk_future in chunk_futures:
+            chunk_future.cancel()
+
+# 5b. Async Variants Of The Core Tools
+
+async def look_up_airport_code_upstream_async(city_name):
+    api_response = await get_request_coalescer().ado(
+        make_query_key("locations", normalize_city_keyword(city_name)),
+        lambda: call_amadeus_async('locations', keyword=city_name, subType='CITY')
+    )
+    
+    if api_response.data:
+        return api_response.data[0]['iataCode']
+    return None
+
+
+async def convert_city_to_airport_code_async(city_name):
+    lookup_function = look_up_airport_code_upstream_async if get_amadeus_transport() is not None else None
+    with get_tracer().span("lookup", "iata_code", city=city_name):
+        airport_code = get_airport_index().resolve(city_name)
+        if not airport_code:
+            airport_code = await get_airport_code_cache().aresolve(city_name, lookup_function)
+    
+    if airport_code:
+        return airport_code
+    return city_name
+
+
+async def find_flights_async(origin, destination, date, currency="USD", search_mode=None):
+    query_key = flight_query_key(origin, destination, date, currency, search_mode)
+    try:
+        return await find_through_caches_async(
+            get_flight_result_cache(), query_key, "flight",
+            lambda: fetch_flight_results_async(origin, destination, date, currency, search_mode)
+        )
+    except UpstreamUnavailable:
+        return []
+
+
+async def find_hotels_async(location, checkin_date, checkout_date, currency="USD", search_mode=None, on_chunk=None):
+    if (search_mode or HOTEL_SEARCH_MODE) != "full_city":
+        query_key = hotel_query_key(location, checkin_date, checkout_date, currency, search_mode)
+        try:
+            return await find_through_caches_async(
+                get_hotel_result_cache(), query_key, "hotel",
+                lambda: fetch_hotel_results_async(location, checkin_date, checkout_date, currency)
+            )
+        except UpstreamUnavailable:
+            return []
+    
+    query_key = hotel_query_key(location, checkin_date, checkout_date, currency, search_mode)
+    caller_task = asyncio.current_task()
+    
+    async def fetch_full_city():
+        # Background stale refreshes run outside the caller's task and must not stream to it.
+        chunk_callback = on_chunk if asyncio.current_task() is caller_task else None
+        hotel_results = []
+        async for hotel_chunk in stream_full_city_hotel_results_async(location, checkin_date, checkout_date, currency):
+            hotel_results.extend(hotel_chunk)
+            if chunk_callback is not None:
+                chunk_callback(hotel_chunk)
+        return sort_hotels_by_price(hotel_results)
+    
+    try:
+        return await find_through_caches_async(get_hotel_result_cache(), query_key, "hotel", fetch_full_city)
+    except UpstreamUnavailable:
+        return []
+
+
+@tool
+async def search_flight_async(origin, destination, date, currency="USD"):
+    """Search for flights between two cities on a specific date"""
+    return offers_to_json(await find_flights_async(origin, destination, date, currency))
+
+
+@tool
+async def search_hotel_async(location, checkin_date, checkout_date, currency="USD"):
+    """Search for hotels in a city for specific dates"""
+    return offers_to_json(await find_hotels_async(location, checkin_date, checkout_date, currency))
+
+
+async def fetch_flight_results_async(origin, destination, date, currency="USD", search_mode=None):
+    if get_amadeus_transport() is None:
+        return []
+    
+    try:
+        origin_airport_code, destination_airport_code = await asyncio.gather(
+            convert_city_to_airport_code_async(origin),
+            convert_city_to_airport_code_async(destination)
+        )
+        
+        api_response = await call_amadeus_async(
+            'flight_offers_search',
+            originLocationCode=origin_airport_code,
+            destinationLocationCode=destination_airport_code,
+            departureDate=date,
+            adults=1,
+            currencyCode=currency,
+            max=flight_max_results(search_mode)
+        )
+        
+        flight_results = build_flight_results(
+            api_response.data, origin_airport_code, destination_airport_code, date, currency, flight_max_results(search_mode)
+        )
+        
+        return flight_results
+    
+    except UpstreamUnavailable:
+        raise
+    except AmadeusTransportError:
+        return []
+    except Exception:
+        return []
+
+
+async def fetch_hotel_results_async(location, checkin_date, checkout_date, currency="USD"):
+    if get_amadeus_transport() is None:
+        return []
+    
+    try:
+        city_airport_code = await convert_city_to_airport_code_async(location)
+        
+        hotels_api_response = await call_amadeus_async('hotels_by_city', cityCode=city_airport_code)
+        
+        if not hotels_api_response.data:
+            fallback_hotel = build_city_fallback_hotel(location, checkin_date, checkout_date, currency)
+            return [fallback_hotel]
+        
+        hotels_to_price = hotels_api_response.data[:5]
+        hotel_ids_joined = ','.join(hotel['hotelId'] for hotel in hotels_to_price)
+        
+        try:
+            offers_api_response = await call_amadeus_async(
+                'hotel_offers_search',
+                hotelIds=hotel_ids_joined,
+                checkInDate=checkin_date,
+                checkOutDate=checkout_date,
+                adults=1,
+                currency=currency
+            )
+            
+            hotel_results = build_hotel_results(
+                offers_api_response.data, location, checkin_date, checkout_date, currency
+            )
+        
+        except AmadeusTransportError:
+            hotel_results = build_unpriced_hotel_results(
+                hotels_to_price, location, checkin_date, checkout_date, currency
+            )
+        
+        return hotel_results
+    
+    except UpstreamUnavailable:
+        raise
+    except AmadeusTransportError:
+        return []
+    except Exception:
+        return []
+
+
+async def price_hotel_chunk_async(hotel_chunk, location, checkin_date, checkout_date, currency):
+    try:
+        offers_api_response = await call_amadeus_async(
+            'hotel_offers_search',
+            hotelIds=','.join(hotel['hotelId'] for hotel in hotel_chunk),
+            checkInDate=checkin_date,
+            checkOutDate=checkout_date,
+            adults=1,
+            currency=currency
+        )
+        return build_hotel_results(offers_api_response.data, location, checkin_date, checkout_date, currency)
+    except UpstreamUnavailable:
+        raise
+    except Exception:
+        return build_unpriced_hotel_results(hotel_chunk, location, checkin_date, checkout_date, currency)
+
+
+async def stream_full_city_hotel_results_async(location, checkin_date, checkout_date, currency="USD"):
+    """Async counterpart of stream_full_city_hotel_results"""
+    if get_amadeus_transport() is None:
+        return
+    
+    try:
+        city_airport_code = await convert_city_to_airport_code_async(location)
+        hotels_api_response = await call_amadeus_async('hotels_by_city', cityCode=city_airport_code)
+    except UpstreamUnavailable:
+        raise
+    except Exception:
+        return
+    
+    if not hotels_api_response.data:
+        yield [build_city_fallback_hotel(location, checkin_date, checkout_date, currency)]
+        return
+    
+    hotel_chunks = split_into_chunks(hotels_api_response.data[:HOTEL_FULL_CITY_MAX_HOTELS], HOTEL_OFFERS_CHUNK_SIZE)
+    chunk_slots = asyncio.Semaphore(HOTEL_OFFERS_MAX_CONCURRENCY)
+    
+    async def price_with_slot(hotel_chunk):
+        async with chunk_slots:
+            return await price_hotel_chunk_async(hotel_chunk, location, checkin_date, checkout_date, currency)
+    
+    chunk_tasks = [asyncio.ensure_future(price_with_slot(hotel_chunk)) for hotel_chunk in hotel_chunks]
+    try:
+        for next_finished_chunk in asyncio.as_completed(chunk_tasks):
+            yield await next_finished_chunk
+    finally:
+        for chunk_task in chunk_tasks:
+            chunk_task.cancel()
+
+# 6. Making The Travel Specialist Sub-Graph
+
+FLIGHT_LEG_DEADLINE_SECONDS = float(os.environ.get("FLIGHT_LEG_DEADLINE_SECONDS", "20"))
+# Shared by every search in the process; 0 means two legs for each search that can run at once.
+FLIGHT_SEARCH_POOL_SIZE = int(os.environ.get("FLIGHT_SEARCH_POOL_SIZE", "0"))
+
+
+def create_flight_search_pool(concurrent_searches):
+    return ThreadPoolExecutor(max_workers=FLIGHT_SEARCH_POOL_SIZE or 2 * concurrent_searches, thread_name_prefix="flight-leg")
+
+
+@lazy_resource
+def get_flight_search_pool():
+    # Sized for the search job workers; batch_planner overrides it for its own --workers.
+    return create_flight_search_pool(SEARCH_JOB_WORKERS)
+
+
+def search_flight_legs_concurrently(leg_requests, deadline_seconds=FLIGHT_LEG_DEADLINE_SECONDS):
+    """Run one flight search per leg in parallel; a leg that fails or misses its deadline yields []
+
+    The deadline counts from when a leg starts running, so a short wait
+    for a free pool worker is not held against it. A leg still waiting
+    for a worker once deadline_seconds have passed since the call is
+    dropped without running.
+    """
+    search_started_at = time.monotonic()
+    leg_start_times = [None] * len(leg_requests)
+    leg_started_events = [threading.Event() for _ in leg_requests]
+    
+    def run_leg(leg_index, leg_request):
+        leg_start_times[leg_index] = time.monotonic()
+        leg_started_events[leg_index].set()
+        return find_flights(**leg_request)
+    
+    # Each leg runs in a copy of this context so its spans join the caller's trace.
+    leg_futures = [
+        get_flight_search_pool().submit(contextvars.copy_context().run, run_leg, leg_index, leg_request)
+        for leg_index, leg_request in enumerate(leg_requests)
+    ]
+    
+    leg_results = []
+    for leg_index, leg_future in enumerate(leg_futures):
+        queue_seconds_left = deadline_seconds - (time.monotonic() - search_started_at)
+        if not leg_started_events[leg_index].wait(timeout=max(0.0, queue_seconds_left)):
+            leg_future.cancel()
+            leg_results.append([])
+            continue
+        remaining_seconds = max(0.0, deadline_seconds - (time.monotonic() - leg_start_times[leg_index]))
+        try:
+            leg_results.append(leg_future.result(timeout=remaining_seconds))
+        except Exception:
+            # A running leg cannot be stopped; it finishes on its worker and still fills the result cache.
+            leg_results.append([])
+    
+    return leg_results
+
+
+def travel_agent_node(state):
+    user_currency = state.get('currency', 'USD')
+    
+    outbound_flights, return_flights = search_flight_legs_concurrently([
+        {
+            "origin": state['origin'],
+            "destination": state['destination'],
+            "date": state['arrival_date'],
+            "currency": user_currency,
+            "search_mode": state.get('flight_search_mode')
+        },
+        {
+            "origin": state['destination'],
+            "destination": state['origin'],
+            "date": state['return_date'],
+            "currency": user_currency,
+            "search_mode": state.get('flight_search_mode')
+        }
+    ])
+    
+    all_flights = outbound_flights + return_flights
+    
+    return {"flight_options": keep_best_offers("flight_options", all_flights, MAX_FLIGHTS_PER_LEG)}
+
+
+async def search_flight_legs_async(leg_requests, deadline_seconds=FLIGHT_LEG_DEADLINE_SECONDS):
+    """Async counterpart of search_flight_legs_concurrently"""
+    async def search_one_leg(leg_request):
+        try:
+            return await asyncio.wait_for(find_flights_async(**leg_request), deadline_seconds)
+        except Exception:
+            return []
+    
+    return await asyncio.gather(*(search_one_leg(leg_request) for leg_request in leg_requests))
+
+
+async def travel_agent_node_async(state):
+    user_currency = state.get('currency', 'USD')
+    
+    outbound_flights, return_flights = await search_flight_legs_async([
+        {
+            "origin": state['origin'],
+            "destination": state['destination'],
+            "date": state['arrival_date'],
+            "currency": user_currency,
+            "search_mode": state.get('flight_search_mode')
+        },
+        {
+            "origin": state['destination'],
+            "destination": state['origin'],
+            "date": state['return_date'],
+            "currency": user_currency,
+            "search_mode": state.get('flight_search_mode')
+        }
+    ])
+    
+    all_flights = outbound_flights + return_flights
+    
+    return {"flight_options": keep_best_offers("flight_options", all_flights, MAX_FLIGHTS_PER_LEG)}
+
+
+def flight_leg_node(leg_search):
+    """Search one leg of a multi-city trip; dispatched once per leg with Send, so legs run side by side"""
+    leg_flights = find_flights(**leg_search['query'])
+    return {"leg_flights": {leg_search['leg_key']: merge_offer_lists([], leg_flights, MAX_FLIGHTS_PER_LEG)}}
+
+
+async def flight_leg_node_async(leg_search):
+    leg_flights = await find_flights_async(**leg_search['query'])
+    return {"leg_flights": {leg_search['leg_key']: merge_offer_lists([], leg_flights, MAX_FLIGHTS_PER_LEG)}}
+
+
+@lazy_resource
+def build_travel_graph():
+    tracer = get_tracer()
+    travel_graph_builder = StateGraph(TravelAgentState)
+    travel_graph_builder.add_node(
+        "travel_agent",
+        RunnableLambda(
+            tracer.trace_node("travel_agent", travel_agent_node),
+            afunc=tracer.trace_node("travel_agent", travel_agent_node_async),
+            name="travel_agent"
+        )
+    )
+    travel_graph_builder.add_edge(START, "travel_agent")
+    travel_graph_builder.add_edge("travel_agent", END)
+    return travel_graph_builder.compile()
+
+# 7. Making The Accommodation Specialist Sub-Graph
+
+def stream_hotel_chunk(hotel_chunk):
+    """Publish a priced chunk on the "custom" stream mode; a no-op for invoke()"""
+    get_stream_writer()({"hotel_chunk": hotel_chunk})
+
+
+def hotel_agent_node(state):
+    user_currency = state.get('currency', 'USD')
+    
+    hotels = find_hotels(
+        location=state['destination'],
+        checkin_date=state['arrival_date'],
+        checkout_date=state['return_date'],
+        currency=user_currency,
+        search_mode=state.get('hotel_search_mode'),
+        on_chunk=stream_hotel_chunk
+    )
+    
+    return {"hotel_options": keep_best_offers("hotel_options", hotels, MAX_HOTELS_PER_CITY)}
+
+
+async def hotel_agent_node_async(state):
+    user_currency = state.get('currency', 'USD')
+    
+    hotels = await find_hotels_async(
+        location=state['destination'],
+        checkin_date=state['arrival_date'],
+        checkout_date=state['return_date'],
+        currency=user_currency,
+        search_mode=state.get('hotel_search_mode'),
+        on_chunk=stream_hotel_chunk
+    )
+    
+    return {"hotel_options": keep_best_offers("hotel_options", hotels, MAX_HOTELS_PER_CITY)}
+
+
+def hotel_stay_node(stay_search):
+    """Search the hotels for one stop of a multi-city trip; dispatched once per stop with Send"""
+    stay_hotels = find_hotels(**stay_search['query'])
+    return {"stay_hotels": {stay_search['stay_key']: merge_offer_lists([], stay_hotels, MAX_HOTELS_PER_CITY)}}
+
+
+async def hotel_stay_node_async(stay_search):
+    stay_hotels = await find_hotels_async(**stay_search['query'])
+    return {"stay_hotels": {stay_search['stay_key']: merge_offer_lists([], stay_hotels, MAX_HOTELS_PER_CITY)}}
+
+
+@lazy_resource
+def build_hotel_graph():
+    tracer = get_tracer()
+    hotel_graph_builder = StateGraph(TravelAgentState)
+    hotel_graph_builder.add_node(
+        "hotel_agent",
+        RunnableLambda(
+            tracer.trace_node("hotel_agent", hotel_agent_node),
+            afunc=tracer.trace_node("hotel_agent", hotel_agent_node_async),
+            name="hotel_agent"
+        )
+    )
+    hotel_graph_builder.add_edge(START, "hotel_agent")
+    hotel_graph_builder.add_edge("hotel_agent", END)
+    return hotel_graph_builder.compile()
+
+# 8. Building The Main Graph Nodes
+
+def intake_node(state):
+    # Overwrite bypasses the reducers, so a reused thread starts from empty results.
+    return {
+        "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)],
+        "flight_options": Overwrite([]),
+        "hotel_options": Overwrite([]),
+        "leg_flights": Overwrite({}),
+        "stay_hotels": Overwrite({}),
+        "itinerary": []
+    }
+
+
+def planner_node(state):
+    if state.get('legs'):
+        dates_are_valid, validation_message = check_if_legs_are_valid(state['legs'])
+    else:
+        dates_are_valid, validation_message = check_if_dates_are_valid(
+            state['arrival_date'], 
+            state['return_date']
+        )
+    
+    if not dates_are_valid:
+        return {"date_error": validation_message}
+    
+    record_search_demand(state)
+    return {}
+
+
+def decide_next_step_after_planning(state):
+    if state.get('date_error'):
+        return "present_plan"
+    return "specialists"
+
+
+def list_trip_stays(legs):
+    """(stop index, city, check-in, check-out) for every stop between two legs with at least one night"""
+    trip_stays = []
+    for leg_index, (leg, next_leg) in enumerate(zip(legs, legs[1:])):
+        if next_leg['date'] > leg['date']:
+            trip_stays.append((leg_index, leg['destination'], leg['date'], next_leg['date']))
+    return trip_stays
+
+
+def route_to_both_agents(state):
+    if state.get('legs'):
+        return route_to_leg_searches(state)
+    
+    return [
+        Send("travel_agent", state),
+        Send("accommodation_agent", state)
+    ]
+
+
+def route_to_leg_searches(state):
+    """One flight search per leg and one hotel search per stop, all in the same step"""
+    user_currency = state.get('currency', 'USD')
+    
+    leg_sends = [
+        Send("flight_leg", {
+            "leg_key": str(leg_index),
+            "query": {
+                "origin": leg['origin'],
+                "destination": leg['destination'],
+                "date": leg['date'],
+                "currency": user_currency,
+                "search_mode": state.get('flight_search_mode')
+            }
+        })
+        for leg_index, leg in enumerate(state['legs'])
+    ]
+    stay_sends = [
+        Send("hotel_stay", {
+            "stay_key": str(stay_index),
+            "query": {
+                "location": city,
+                "checkin_date": checkin_date,
+                "checkout_date": checkout_date,
+                "currency": user_currency,
+                "search_mode": state.get('hotel_search_mode')
+            }
+        })
+        for stay_index, city, checkin_date, checkout_date in list_trip_stays(state['legs'])
+    ]
+    return leg_sends + stay_sends
+
+
+def build_multi_city_itinerary(legs, leg_flights, stay_hotels):
+    """One entry per leg: its flights cheapest first, then the hotels at the stop it ends at (if any)"""
+    stays_by_leg = {stay_index: (checkin_date, checkout_date) for stay_index, _, checkin_date, checkout_date in list_trip_stays(legs)}
+    itinerary = []
+    
+    for leg_index, leg in enumerate(legs):
+        flights = sorted(leg_flights.get(str(leg_index), []), key=lambda flight: flight.price)
+        itinerary_entry = {**leg, "flights": flights, "cheapest_flight": flights[0] if flights else None}
+        
+        if leg_index in stays_by_leg:
+            checkin_date, checkout_date = stays_by_leg[leg_index]
+            hotels = sort_hotels_by_price(stay_hotels.get(str(leg_index), []))
+            itinerary_entry["stay"] = {
+                "city": leg['destination'],
+                "checkin_date": checkin_date,
+                "checkout_date": checkout_date,
+                "nights": (datetime.strptime(checkout_date, "%Y-%m-%d") - datetime.strptime(checkin_date, "%Y-%m-%d")).days,
+                "hotels": hotels,
+                "cheapest_hotel": next((hotel for hotel in hotels if hotel.price), None)
+            }
+        itinerary.append(itinerary_entry)
+    
+    return itinerary
+
+
+def present_plan_node(state):
+    if state.get('date_error'):
+        error_message = state.get('date_error')
+        error_text = f"**Error:** {error_message}"
+        return {"messages": [AIMessage(content=error_text)]}
+    
+    if state.get('legs'):
+        return {
+            "itinerary": build_multi_city_itinerary(state['legs'], state.get('leg_flights', {}), state.get('stay_hotels', {})),
+            "messages": [AIMessage(content="Success")]
+        }
+    
+    return {"messages": [AIMessage(content="Success")]}
+
+# 9. Building The Main Graph
+
+CHECKPOINT_DATABASE = os.environ.get("CHECKPOINT_DB", "travel_planner_streamlit.db")
+# "final" keeps each search's last checkpoint, "all" keeps every step, "ephemeral" keeps nothing.
+CHECKPOINT_RETENTION = os.environ.get("CHECKPOINT_RETENTION", "final")
+CHECKPOINT_MAX_AGE_DAYS = float(os.environ.get("CHECKPOINT_MAX_AGE_DAYS", "7"))
+CHECKPOINT_MAINTENANCE_INTERVAL_SECONDS = float(os.environ.get("CHECKPOINT_MAINTENANCE_INTERVAL_SECONDS", "3600"))
+# VACUUM once free pages pass this share of the checkpoint file; empty disables it.
+CHECKPOINT_VACUUM_FREE_FRACTION = float(os.environ.get("CHECKPOINT_VACUUM_FREE_FRACTION", "0.25") or "inf")
+
+
+@lazy_resource
+def build_workflow(checkpoint_retention=CHECKPOINT_RETENTION):
+    tracer = get_tracer()
+    memory_saver = None
+    if checkpoint_retention != "ephemeral":
+        memory_saver = PooledSqliteSaver(
+            CHECKPOINT_DATABASE,
+            serde=OfferRecordSerializer()
+        )
+        tracer.trace_checkpoint_writes(memory_saver)
+        CheckpointMaintenance(
+            memory_saver,
+            retention=checkpoint_retention,
+            max_age_days=CHECKPOINT_MAX_AGE_DAYS,
+            interval_seconds=CHECKPOINT_MAINTENANCE_INTERVAL_SECONDS,
+            vacuum_free_fraction=CHECKPOINT_VACUUM_FREE_FRACTION
+        ).start()
+    
+    workflow_builder = StateGraph(TravelAgentState)
+    
+    workflow_builder.add_node("intake", tracer.trace_node("intake", intake_node))
+    workflow_builder.add_node("planner", tracer.trace_node("planner", planner_node))
+    workflow_builder.add_node("specialists", lambda state: {})
+    workflow_builder.add_node("present_plan", tracer.trace_node("present_plan", present_plan_node))
+    workflow_builder.add_node("travel_agent", build_travel_graph())
+    workflow_builder.add_node("accommodation_agent", build_hotel_graph())
+    workflow_builder.add_node(
+        "flight_leg",
+        RunnableLambda(
+            tracer.trace_node("flight_leg", flight_leg_node),
+            afunc=tracer.trace_node("flight_leg", flight_leg_node_async),
+            name="flight_leg"
+        )
+    )
+    workflow_builder.add_node(
+        "hotel_stay",
+        RunnableLambda(
+            tracer.trace_node("hotel_stay", hotel_stay_node),
+            afunc=tracer.trace_node("hotel_stay", hotel_stay_node_async),
+            name="hotel_stay"
+        )
+    )
+    
+    workflow_builder.add_edge(START, "intake")
+    workflow_builder.add_edge("intake", "planner")
+    workflow_builder.add_conditional_edges(
+        "planner",
+        decide_next_step_after_planning,
+        {"specialists": "specialists", "present_plan": "present_plan"}
+    )
+    workflow_builder.add_conditional_edges(
+        "specialists",
+        route_to_both_agents,
+        ["travel_agent", "accommodation_agent", "flight_leg", "hotel_stay"]
+    )
+    workflow_builder.add_edge(["travel_agent", "accommodation_agent"], "present_plan")
+    # Every leg and stop is sent in the same step, so present_plan runs once, after the slowest.
+    workflow_builder.add_edge("flight_leg", "present_plan")
+    workflow_builder.add_edge("hotel_stay", "present_plan")
+    workflow_builder.add_edge("present_plan", END)
+    
+    return workflow_builder.compile(checkpointer=memory_saver)
+
+
+def invoke_trip_search(user_inputs, thread_id, planner_app=None, checkpoint_retention=CHECKPOINT_RETENTION):
+    planner_app = planner_app or build_workflow()
+    config = {"configurable": {"thread_id": thread_id}}
+    
+    try:
+        return planner_app.invoke(user_inputs, config)
+    finally:
+        if planner_app.checkpointer and checkpoint_retention == "final":
+            planner_app.checkpointer.prune([thread_id], strategy="keep_final")
+
+
+def stream_trip_search(user_inputs, thread_id, planner_app=None, checkpoint_retention=CHECKPOINT_RETENTION):
+    """Yield (event, payload) pairs as the search progresses instead of one final state
+
+    Events are "date_error" (message), "flights" and "hotels" (each
+    specialist's full result, even where the state keeps only the
+    cheapest few) and "hotel_chunk" (a partial hotel list in full_city
+    mode). Multi-city trips instead yield "leg_flights" and
+    "stay_hotels" as (position, offers) per leg and stop, then
+    "itinerary" with the combined plan. Closing the generator stops the run: steps that have
+    not started are never scheduled, and close() returns once the steps
+    already running finish.
+    """
+    planner_app = planner_app or build_workflow()
+    config = {"configurable": {"thread_id": thread_id}}
+    full_offer_lists = {}
+    
+    try:
+        for namespace, stream_mode, chunk in planner_app.stream(
+            user_inputs, config, stream_mode=["updates", "custom"], subgraphs=True
+        ):
+            if stream_mode == "custom":
+                if "hotel_chunk" in chunk:
+                    yield "hotel_chunk", chunk["hotel_chunk"]
+                elif "full_offers" in chunk:
+                    channel_name, offers = chunk["full_offers"]
+                    full_offer_lists[channel_name] = offers
+                continue
+            
+            # Sub-graph internals are reported again by their parent node.
+            if namespace:
+                continue
+            
+            for node_name, node_update in chunk.items():
+                if not node_update:
+                    continue
+                if node_name == "planner" and node_update.get("date_error"):
+                    yield "date_error", node_update["date_error"]
+                elif node_name == "travel_agent":
+                    yield "flights", full_offer_lists.pop("flight_options", None) or node_update.get("flight_options", [])
+                elif node_name == "accommodation_agent":
+                    yield "hotels", full_offer_lists.pop("hotel_options", None) or node_update.get("hotel_options", [])
+                elif node_name == "flight_leg":
+                    for leg_key, leg_flights in node_update.get("leg_flights", {}).items():
+                        yield "leg_flights", (int(leg_key), leg_flights)
+                elif node_name == "hotel_stay":
+                    for stay_key, stay_hotels in node_update.get("stay_hotels", {}).items():
+                        yield "stay_hotels", (int(stay_key), stay_hotels)
+                elif node_name == "present_plan" and node_update.get("itinerary"):
+                    yield "itinerary", node_update["itinerary"]
+    finally:
+        if planner_app.checkpointer and checkpoint_retention == "final":
+            planner_app.checkpointer.prune([thread_id], strategy="keep_final")
+
+
+# Searches submitted from the page run here, never on the Streamlit script thread.
+SEARCH_JOB_WORKERS = int(os.environ.get("SEARCH_JOB_WORKERS", "4"))
+SEARCH_JOB_MAX_QUEUED = int(os.environ.get("SEARCH_JOB_MAX_QUEUED", "16"))
+SEARCH_JOB_RETENTION_HOURS = float(os.environ.get("SEARCH_JOB_RETENTION_HOURS", "24"))
+
+
+@lazy_resource
+def get_search_job_queue():
+    """Bounded pool running every search the page starts; the job id doubles as thread and trace id"""
+    return SearchJobQueue(
+        {"trip": stream_trip_search, "flexible_dates": stream_flexible_dates_search},
+        max_workers=SEARCH_JOB_WORKERS,
+        max_queued=SEARCH_JOB_MAX_QUEUED,
+        retention_seconds=SEARCH_JOB_RETENTION_HOURS * 3600,
+        tracer=get_tracer()
+    )
+
+# 9b. Flexible Dates Price Matrix
+
+FLEX_MAX_CONCURRENCY = int(os.environ.get("FLEX_MAX_CONCURRENCY", "6"))
+
+
+class FlexibleDatesState(TypedDict):
+    origin: Annotated[str, replace_old_value_with_new]
+    destination: Annotated[str, replace_old_value_with_new]
+    currency: Annotated[str, replace_old_value_with_new]
+    arrival_date: Annotated[str, replace_old_value_with_new]
+    return_date: Annotated[str, replace_old_value_with_new]
+    flex_days: Annotated[int, replace_old_value_with_new]
+    leg_prices: Annotated[dict, merge_dictionaries]
+    price_matrix: Annotated[List[dict], replace_old_value_with_new]
+
+
+def list_flexible_dates(center_date_string, flex_days):
+    center_date = datetime.strptime(center_date_string, "%Y-%m-%d").date()
+    today = datetime.now().date()
+    
+    flexible_dates = []
+    for day_offset in range(-flex_days, flex_days + 1):
+        candidate_date = center_date + timedelta(days=day_offset)
+        if candidate_date >= today:
+            flexible_dates.append(candidate_date.strftime("%Y-%m-%d"))
+    
+    return flexible_dates
+
+
+def make_leg_price_key(origin, destination, date, currency):
+    return f"{origin.strip().lower()}|{destination.strip().lower()}|{date}|{currency}"
+
+
+def route_to_date_cells(state):
+    """Send one one-way search per unique (route, date); the matrix cells share them"""
+    leg_queries = {}
+    
+    for outbound_date in list_flexible_dates(state['arrival_date'], state['flex_days']):
+        leg_query = {
+            "origin": state['origin'],
+            "destination": state['destination'],
+            "date": outbound_date,
+            "currency": state['currency']
+        }
+        leg_queries[make_leg_price_key(**leg_query)] = leg_query
+    
+    for return_date in list_flexible_dates(state['return_date'], state['flex_days']):
+        leg_query = {
+            "origin": state['destination'],
+            "destination": state['origin'],
+            "date": return_date,
+            "currency": state['currency']
+        }
+        leg_queries[make_leg_price_key(**leg_query)] = leg_query
+    
+    if not leg_queries:
+        return "build_price_matrix"
+    
+    return [Send("price_leg_date", leg_query) for leg_query in leg_queries.values()]
+
+
+def price_leg_date_node(leg_query):
+    # Repeated cells are answered by the search_flight result cache.
+    leg_price_key = make_leg_price_key(**leg_query)
+    
+    flights = find_flights(**leg_query)
+    cheapest_price = min((flight.price for flight in flights), default=None)
+    
+    return {"leg_prices": {leg_price_key: cheapest_price}}
+
+
+def build_price_matrix_node(state):
+    leg_prices = state.get('leg_prices', {})
+    price_matrix = []
+    
+    for outbound_date in list_flexible_dates(state['arrival_date'], state['flex_days']):
+        for return_date in list_flexible_dates(state['return_date'], state['flex_days']):
+            if return_date <= outbound_date:
+                continue
+            
+            outbound_price = leg_prices.get(
+                make_leg_price_key(state['origin'], state['destination'], outbound_date, state['currency'])
+            )
+            return_price = leg_prices.get(
+                make_leg_price_key(state['destination'], state['origin'], return_date, state['currency'])
+            )
+            
+            total_price = None
+            if outbound_price is not None and return_price is not None:
+                total_price = outbound_price + return_price
+            
+            price_matrix.append({
+                "outbound_date": outbound_date,
+                "return_date": return_date,
+                "outbound_price": outbound_price,
+                "return_price": return_price,
+                "total_price": total_price
+            })
+    
+    return {"price_matrix": price_matrix}
+
+
+@lazy_resource
+def build_flexible_dates_workflow():
+    tracer = get_tracer()
+    flexible_dates_builder = StateGraph(FlexibleDatesState)
+    
+    flexible_dates_builder.add_node("plan_date_grid", lambda state: {})
+    flexible_dates_builder.add_node("price_leg_date", tracer.trace_node("price_leg_date", price_leg_date_node))
+    flexible_dates_builder.add_node("build_price_matrix", tracer.trace_node("build_price_matrix", build_price_matrix_node))
+    
+    flexible_dates_builder.add_edge(START, "plan_date_grid")
+    flexible_dates_builder.add_conditional_edges(
+        "plan_date_grid",
+        route_to_date_cells,
+        ["price_leg_date", "build_price_matrix"]
+    )
+    flexible_dates_builder.add_edge("price_leg_date", "build_price_matrix")
+    flexible_dates_builder.add_edge("build_price_matrix", END)
+    
+    # One-shot matrices are not checkpointed.
+    return flexible_dates_builder.compile()
+
+
+def stream_flexible_dates_search(flexible_dates_inputs, thread_id):
+    """The matrix as a search job: a single "price_matrix" event once every cell is priced"""
+    matrix_result = build_flexible_dates_workflow().invoke(
+        flexible_dates_inputs,
+        {"max_concurrency": FLEX_MAX_CONCURRENCY, "configurable": {"thread_id": thread_id}}
+    )
+    yield "price_matrix", matrix_result.get("price_matrix", [])